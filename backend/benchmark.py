@@ -0,0 +1,498 @@
+"""
+Benchmarks for the transaction processing paths in main.py.
+
+Run from the backend directory, after pip install -r requirements-dev.txt
+(the load test and the suite drive the app through httpx):
+
+    python benchmark.py summary --sizes 10000 100000 1000000
+    python benchmark.py loadtest --analyses 20 --llm-latency 2
+    python benchmark.py dates --rows 200000 --unique-dates 400
+    python benchmark.py suite --sizes 10000 100000 --output results.json
+    python benchmark.py routes
+
+The summary benchmark prints one line per size with the timings of the previous
+implementation and the current one, and checks that both produce the same result.
+The load test runs the app in-process with a stubbed LLM and measures /health latency
+while analyses are in flight. The dates benchmark compares per-row strptime
+with the memoized fast-path date parser of the CSV format registry, in rows per second.
+The suite generates Desjardins and simple-format statements of each size, times every
+ingestion stage (detect, parse, summarize, persist, reopen and read a first page, serialize
+every row) and the main endpoints through an in-process client with a stubbed LLM, and
+writes the results as JSON. The routes check fails if a /query-suggestions prompt, or one of a
+few questions that only mention a category name or a merchant, is routed differently than expected.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from langchain_core.messages import AIMessage
+
+import numpy as np
+
+import main as api
+from main import (
+    CSV_FORMATS, EPOCH_ORDINAL, TransactionRow, TransactionStore, compile_date_format, create_transaction_summary,
+    detect_csv_format, encode_transactions, parse_csv_file, to_epoch_day
+)
+
+
+DESCRIPTIONS = [
+    "Payroll deposit",
+    "Interac purchase - Grocery",
+    "Interac purchase - Gas station",
+    "Online bill payment - Hydro",
+    "Transfer to savings",
+    "ATM withdrawal",
+    "Monthly account fee",
+    "Restaurant",
+    "Pharmacy",
+    "Subscription - Streaming",
+]
+
+
+def synthetic_rows(count: int, seed: int = 0, bank: str = None) -> List[TransactionRow]:
+    """
+    Generate `count` rows spread over roughly a decade. With `bank`, rows also get the bank
+    name and a unique transaction id, as in a Desjardins export.
+    """
+    rng = random.Random(seed)
+    day = datetime(2015, 1, 1)
+    balance = 2500.0
+    rows = []
+    for index in range(count):
+        if rng.random() < 0.3:
+            day += timedelta(days=1)
+        description = rng.choice(DESCRIPTIONS) if rng.random() < 0.9 else f"Merchant #{rng.randrange(5000)}"
+        if rng.random() < 0.25:
+            credit, debit = round(rng.uniform(10, 3000), 2), 0.0
+        else:
+            credit, debit = 0.0, round(rng.uniform(1, 400), 2)
+        balance = round(balance + credit - debit, 2)
+        if bank is None:
+            rows.append(TransactionRow(to_epoch_day(day), description, debit, credit, balance))
+        else:
+            rows.append(TransactionRow(to_epoch_day(day), description, debit, credit, balance, bank, str(100000 + index)))
+    return rows
+
+
+def to_simple_csv(rows: List[TransactionRow]) -> str:
+    """Render rows in the simple 5-column CSV format accepted by /upload."""
+    lines = []
+    for row in rows:
+        date = datetime.fromordinal(row.date + EPOCH_ORDINAL)
+        debit = f"{row.debit:.2f}" if row.debit else ""
+        credit = f"{row.credit:.2f}" if row.credit else ""
+        lines.append(f"{date:%m/%d/%Y},{row.description},{debit},{credit},{row.balance:.2f}\n")
+    return "".join(lines)
+
+
+def to_desjardins_csv(rows: List[TransactionRow]) -> str:
+    """Render rows as a Desjardins export: 14 columns, YYYY/MM/DD dates, balance last."""
+    lines = []
+    for row in rows:
+        date = datetime.fromordinal(row.date + EPOCH_ORDINAL)
+        debit = f"{row.debit:.2f}" if row.debit else ""
+        credit = f"{row.credit:.2f}" if row.credit else ""
+        lines.append(
+            f'"{row.bank or "Desjardins Ontario"}","815-30000","EOP",{date:%Y/%m/%d},{row.transaction_id or ""},'
+            f'"{row.description}","",{debit},{credit},"","","","",{row.balance:.2f}\n'
+        )
+    return "".join(lines)
+
+
+STATEMENT_GENERATORS = {
+    "simple": lambda count, seed: to_simple_csv(synthetic_rows(count, seed)),
+    "desjardins": lambda count, seed: to_desjardins_csv(synthetic_rows(count, seed, bank="Desjardins Ontario")),
+}
+
+
+def legacy_create_transaction_summary(transactions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The list-of-dicts summary implementation this engine replaced, kept as a baseline."""
+    if not transactions:
+        return {}
+
+    total_transactions = len(transactions)
+    total_credits = sum(t["credit"] for t in transactions)
+    total_debits = sum(t["debit"] for t in transactions)
+    net_change = total_credits - total_debits
+
+    start_date = transactions[0]["date"]
+    end_date = transactions[-1]["date"]
+
+    monthly_data = defaultdict(lambda: {"credits": 0, "debits": 0, "count": 0})
+    for t in transactions:
+        date_string = t["date"]
+        month = None
+        if isinstance(date_string, str) and "T" in date_string:
+            month = date_string[:7]
+        if not month:
+            if isinstance(date_string, str) and "/" in date_string:
+                parts = date_string.split('/')
+                if len(parts) == 3:
+                    month = f"{parts[0]}-{parts[1]}"
+        if month:
+            monthly_data[month]["credits"] += t["credit"]
+            monthly_data[month]["debits"] += t["debit"]
+            monthly_data[month]["count"] += 1
+
+    monthly_summary = {
+        month: {
+            "credits": data["credits"],
+            "debits": data["debits"],
+            "net": data["credits"] - data["debits"],
+            "count": data["count"]
+        }
+        for month, data in sorted(monthly_data.items())
+    }
+
+    description_counter = defaultdict(int)
+    for t in transactions:
+        description_counter[t["description"]] += 1
+
+    common_descriptions = [
+        {"description": desc, "count": count}
+        for desc, count in sorted(description_counter.items(), key=lambda x: x[1], reverse=True)[:10]
+    ]
+
+    largest_credits = sorted(transactions, key=lambda x: x["credit"], reverse=True)[:5]
+    largest_debits = sorted(transactions, key=lambda x: x["debit"], reverse=True)[:5]
+
+    return {
+        "total_transactions": total_transactions,
+        "total_credits": total_credits,
+        "total_debits": total_debits,
+        "net_change": net_change,
+        "date_range": {"start": start_date, "end": end_date},
+        "monthly_summary": monthly_summary,
+        "common_descriptions": common_descriptions,
+        "largest_credits": largest_credits,
+        "largest_debits": largest_debits
+    }
+
+
+def best_time(function: Callable[[], Any], repeat: int) -> float:
+    """Return the fastest of `repeat` runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench_summary(sizes: List[int], repeat: int) -> None:
+    print(f"{'rows':>10} {'legacy (s)':>12} {'engine (s)':>12} {'speedup':>9}")
+    for size in sizes:
+        store = TransactionStore()
+        store.extend(synthetic_rows(size))
+        transactions = store.to_dicts()
+
+        expected = legacy_create_transaction_summary(transactions)
+        actual = create_transaction_summary(store)
+        if json.dumps(expected) != json.dumps(actual):
+            raise AssertionError(f"Summary mismatch at {size} rows")
+
+        legacy = best_time(lambda: legacy_create_transaction_summary(transactions), repeat)
+        engine = best_time(lambda: create_transaction_summary(store), repeat)
+        print(f"{size:>10} {legacy:>12.4f} {engine:>12.4f} {legacy / engine:>8.1f}x")
+
+
+# Local op (or None for the LLM) each question must be routed to. Every /query-suggestions
+# prompt is listed, plus questions that mention a category name without being about it and
+# one naming a merchant that has no rows.
+EXPECTED_ROUTES = {
+    "What is the total amount of credits and debits in these transactions?": "totals",
+    "What are the most common types of transactions?": "common",
+    "What's the pattern of account balance over time?": None,
+    "Are there any unusual or large transactions I should be aware of?": None,
+    "What's the monthly breakdown of income and expenses?": "monthly",
+    "Which months had the highest expenses?": "top_months",
+    "What were the largest transactions this year?": "largest",
+    "What are the top 10 largest debits?": "largest",
+    "How much did I spend on bank fees?": "categories",
+    "Which recurring payments should I review?": None,
+    "Which months had the highest income?": "top_months",
+    "Which months had the lowest expenses?": "top_months",
+    "What is my total income?": "totals",
+    "Show me my cash flow": None,
+    "What other fees did I pay?": None,
+    "Show me spending by category": "categories",
+    "Total spending at Costco": None,
+}
+
+
+def check_routes() -> None:
+    suggestions = asyncio.run(api.get_query_suggestions())
+    missing = [query for query in suggestions if query not in EXPECTED_ROUTES]
+    if missing:
+        raise AssertionError(f"No expected route for suggestions: {missing}")
+
+    mismatches = []
+    for query, expected in EXPECTED_ROUTES.items():
+        spec = api.route_query(query)
+        actual = spec["op"] if spec else None
+        print(f"{actual or 'llm':>11}  {query}")
+        if actual != expected:
+            mismatches.append(f"{query!r}: expected {expected or 'llm'}, got {actual or 'llm'}")
+    if mismatches:
+        raise AssertionError("Route mismatch:\n" + "\n".join(mismatches))
+
+
+def bench_dates(rows: int, unique_dates: int, repeat: int) -> None:
+    rng = random.Random(0)
+    start = datetime(2015, 1, 1)
+    print(f"{'format':>12} {'method':<28} {'rows/s':>14}")
+    for name in ("simple", "desjardins"):
+        csv_format = CSV_FORMATS[name]
+        date_format = csv_format.date_formats[0]
+        pool = [f"{start + timedelta(days=day):{date_format}}" for day in rng.sample(range(3650), unique_dates)]
+        texts = [rng.choice(pool) for _ in range(rows)]
+
+        def per_row_strptime(values=texts):
+            return [to_epoch_day(datetime.strptime(text, date_format)) for text in values]
+
+        def memoized(values=texts):
+            # A new converter per run, so each run starts with an empty cache
+            parse_date = csv_format.date_parser()
+            return [parse_date(text) for text in values]
+
+        fast_path = compile_date_format(date_format)
+        if memoized() != per_row_strptime() or [fast_path(text) for text in pool] != per_row_strptime(pool):
+            raise AssertionError(f"Date parser mismatch for {name}")
+
+        cold = [f"{start + timedelta(days=day):{date_format}}" for day in range(min(rows, 36500))]
+        results = [
+            ("strptime per row", best_time(per_row_strptime, repeat), rows),
+            (f"memoized ({unique_dates} distinct)", best_time(memoized, repeat), rows),
+            ("strptime, all distinct", best_time(lambda: per_row_strptime(cold), repeat), len(cold)),
+            ("fast path, all distinct", best_time(lambda: [fast_path(text) for text in cold], repeat), len(cold)),
+        ]
+        for method, seconds, count in results:
+            print(f"{name:>12} {method:<28} {count / seconds:>14,.0f}")
+
+
+class StubChatModel:
+    """Stands in for ChatOpenAI: waits `latency` seconds, then returns a canned answer."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def ainvoke(self, messages, *args, **kwargs) -> AIMessage:
+        await asyncio.sleep(self.latency)
+        return AIMessage(content="Stub analysis.")
+
+
+async def probe_health(client, probes: int, interval: float) -> List[float]:
+    """Call /health `probes` times and return each latency in milliseconds."""
+    latencies = []
+    for _ in range(probes):
+        started = time.perf_counter()
+        response = await client.get("/health")
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def describe(latencies: List[float]) -> str:
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"p50={statistics.median(ordered):7.2f}ms p95={p95:7.2f}ms max={ordered[-1]:7.2f}ms"
+
+
+async def run_loadtest(analyses: int, latency: float, rows: int, probes: int) -> None:
+    import httpx
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    stub = StubChatModel(latency)
+    api.llm_clients.get = lambda api_key, model: stub
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        csv_text = to_simple_csv(synthetic_rows(rows))
+        upload = await client.post("/upload", files={"file": ("benchmark.csv", csv_text.encode(), "text/csv")})
+        upload.raise_for_status()
+        session_id = upload.json()["session_id"]
+
+        interval = latency / (probes * 2)
+        idle = await probe_health(client, probes, interval)
+
+        started = time.perf_counter()
+        in_flight = [
+            asyncio.create_task(client.post("/analyze", json={"session_id": session_id, "query": f"Question {i}"}))
+            for i in range(analyses)
+        ]
+        await asyncio.sleep(0)
+        loaded = await probe_health(client, probes, interval)
+        responses = await asyncio.gather(*in_flight)
+        elapsed = time.perf_counter() - started
+
+        await client.delete(f"/sessions/{session_id}")
+
+    failures = sum(response.status_code != 200 for response in responses)
+    print(f"/health idle:                      {describe(idle)}")
+    print(f"/health with {analyses:>3} analyses in flight: {describe(loaded)}")
+    print(f"{analyses} analyses ({latency:.1f}s stub LLM latency, {rows} rows) finished in {elapsed:.2f}s, {failures} failed")
+
+
+def result(suite: str, name: str, csv_format: str, rows: int, seconds: float, **extra: Any) -> Dict[str, Any]:
+    record = {
+        "suite": suite,
+        "name": name,
+        "format": csv_format,
+        "rows": rows,
+        "seconds": round(seconds, 6),
+        "rows_per_second": round(rows / seconds) if seconds else None,
+    }
+    record.update(extra)
+    return record
+
+
+def bench_stages(csv_format: str, rows: int, path: str, repeat: int) -> List[Dict[str, Any]]:
+    """Time each ingestion stage on a generated statement file."""
+    store, _ = parse_csv_file(path)
+    binary_path = f"{path}.bin"
+    store.save(binary_path)
+    everything = np.arange(len(store))
+    stages = [
+        ("detect", lambda: detect_csv_format(path)),
+        ("parse", lambda: parse_csv_file(path)),
+        ("summarize", lambda: create_transaction_summary(store)),
+        ("persist", lambda: store.save(binary_path)),
+        ("load", lambda: TransactionStore.open(binary_path).rows(slice(0, 1000))),
+        ("serialize", lambda: b"".join(encode_transactions(store, everything, None, "json"))),
+    ]
+    return [
+        result("stages", name, csv_format, len(store), best_time(function, repeat))
+        for name, function in stages
+    ]
+
+
+async def bench_endpoints(csv_format: str, rows: int, csv_text: str, repeat: int) -> List[Dict[str, Any]]:
+    """Time the main endpoints end to end through an in-process client with a stubbed LLM."""
+    import httpx
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    stub = StubChatModel(0)
+    api.llm_clients.get = lambda api_key, model: stub
+    records = []
+
+    async def timed(name: str, request: Callable[[], Any]) -> Any:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = await request()
+            timings.append(time.perf_counter() - started)
+            response.raise_for_status()
+        records.append(result("endpoints", name, csv_format, rows, min(timings), bytes=len(response.content)))
+        return response
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        uploaded = []
+
+        async def upload():
+            response = await client.post("/upload", files={"file": ("benchmark.csv", csv_text.encode(), "text/csv")})
+            uploaded.append(response.json().get("session_id"))
+            return response
+
+        await timed("POST /upload", upload)
+        session_id = uploaded[-1]
+        questions = iter(range(1_000_000))
+
+        await timed("GET /transactions", lambda: client.get(f"/transactions/{session_id}"))
+        await timed("GET /transactions?limit=1000", lambda: client.get(f"/transactions/{session_id}", params={"limit": 1000, "search": "purchase"}))
+        await timed("GET /summary", lambda: client.get(f"/summary/{session_id}"))
+        await timed("POST /analyze (LLM)", lambda: client.post("/analyze", json={"session_id": session_id, "query": f"Anything unusual in the grocery purchases? #{next(questions)}"}))
+        await timed("POST /analyze (local)", lambda: client.post("/analyze", json={"session_id": session_id, "query": "", "structured": {"op": "monthly"}}))
+
+        for session_id in uploaded:
+            await client.delete(f"/sessions/{session_id}")
+    return records
+
+
+def run_suite(sizes: List[int], formats: List[str], repeat: int, endpoints: bool) -> Dict[str, Any]:
+    records = []
+    with tempfile.TemporaryDirectory() as directory:
+        for csv_format in formats:
+            for size in sizes:
+                csv_text = STATEMENT_GENERATORS[csv_format](size, 0)
+                path = os.path.join(directory, f"{csv_format}-{size}.csv")
+                with open(path, "w", encoding="utf-8") as csv_file:
+                    csv_file.write(csv_text)
+                records += bench_stages(csv_format, size, path, repeat)
+                if endpoints:
+                    records += asyncio.run(bench_endpoints(csv_format, size, csv_text, repeat))
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "results": records,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    summary = subparsers.add_parser("summary", help="create_transaction_summary vs the list-of-dicts baseline")
+    summary.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    summary.add_argument("--repeat", type=int, default=3)
+
+    loadtest = subparsers.add_parser("loadtest", help="/health latency while /analyze requests are in flight")
+    loadtest.add_argument("--analyses", type=int, default=20, help="concurrent /analyze requests")
+    loadtest.add_argument("--llm-latency", type=float, default=2.0, help="seconds the stub LLM takes to answer")
+    loadtest.add_argument("--rows", type=int, default=50_000, help="rows in the uploaded session")
+    loadtest.add_argument("--probes", type=int, default=20, help="/health requests per measurement")
+
+    dates = subparsers.add_parser("dates", help="date parsing throughput, per-row strptime vs the memoized fast path")
+    dates.add_argument("--rows", type=int, default=200_000)
+    dates.add_argument("--unique-dates", type=int, default=400, help="distinct dates repeated across the rows")
+    dates.add_argument("--repeat", type=int, default=3)
+
+    subparsers.add_parser("routes", help="check which questions are answered locally and which go to the LLM")
+
+    suite = subparsers.add_parser("suite", help="every ingestion stage and endpoint, as JSON")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    suite.add_argument("--formats", nargs="+", choices=sorted(STATEMENT_GENERATORS), default=sorted(STATEMENT_GENERATORS))
+    suite.add_argument("--repeat", type=int, default=3)
+    suite.add_argument("--no-endpoints", action="store_true", help="only time the ingestion stages")
+    suite.add_argument("--output", help="write the JSON results to this file instead of stdout")
+
+    args = parser.parse_args()
+    if args.benchmark == "summary":
+        bench_summary(args.sizes, args.repeat)
+    elif args.benchmark == "routes":
+        check_routes()
+    elif args.benchmark == "dates":
+        bench_dates(args.rows, args.unique_dates, args.repeat)
+    elif args.benchmark == "suite":
+        report = run_suite(args.sizes, args.formats, args.repeat, not args.no_endpoints)
+        for record in report["results"]:
+            print(f"{record['format']:>11} {record['rows']:>9} {record['name']:<30} {record['seconds']:>10.4f}s", file=sys.stderr)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as output:
+                json.dump(report, output, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+    elif args.benchmark == "loadtest":
+        asyncio.run(run_loadtest(args.analyses, args.llm_latency, args.rows, args.probes))
+
+
+if __name__ == "__main__":
+    main()
@@ -37,18 +37,18 @@ Langchain and Langgrapg: AI analysis pipeline
 #FAST API CREATES core api application, used to instantiate the app object that defines all end points
 #Upload File and File facilitate file uploads in /upload endpoint to recieve csv files from clients
 #HTTP Exception: Provides a standard way to return HTTP Errors like 400 or 404 thrown in endpoints when errors occur
-#Background Tasks: Enables schedules to run in background (such as cleanup or post-processing) not used in code rn
+#Background Tasks: Runs work after the response is sent, used by delete_session to free a deleted session's storage
 #Form Processes form data submitted in HTTP Requests, imported for potential future use not in code rn
 #CORSMiddleWare - allow cross origin requests, configuraed bia app.add_middleware
 #JSONResponse - provides custom JSON responses - 
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 #Provide type annotations to ensure clarity and correctness in code - used extensicely to annotate parameters and return types for example defining GraphState in lg pipeline
 #Base model enables data validation and serialization of request/response bodies in Used to define models such as TransactionQuery, TransactionResponse, UploadResponse, AnalysisResponse, Session, and HelloWorldResponse.
 
-from typing import List, Dict, Any, TypedDict, Optional, Union, Tuple
-from pydantic import BaseModel
+from typing import List, Dict, Any, TypedDict, Optional, Union, Tuple, Set, Iterator, AsyncIterator, NamedTuple, Callable
+from pydantic import BaseModel, ConfigDict
 
 #Used to read and parse csv files - in parse_csv_file function
 import csv
@@ -61,20 +61,56 @@ import os
 from datetime import datetime
 #Unique ids for session ids
 import uuid
-#simplifies dict operations by providing default values - used in create_transaction_summary 
-from collections import defaultdict
+#simplifies dict operations by providing default values - used in create_transaction_summary; Counter tracks the rows matched while deduplicating an append
+from collections import defaultdict, Counter, OrderedDict
 #Why: Handles high-level file operations such as copying and deleting files or directories. Where: Used to copy the uploaded file in the /upload endpoint and to clean up session directories in the /delete_session endpoint.
 import shutil
 #Regular expressions for parsing
 import re
+#Month names for recognising date ranges in natural language queries
+import calendar
+#Columnar storage for transactions (contiguous float64/int64 arrays instead of per-row dicts)
+import numpy as np
+#Memoizes epoch-day to ISO date conversion when rows are materialized
+from functools import lru_cache
+#Streaming text decoding of uploads, lazy chaining of the sniffed sample and fixed-size top-N heaps for the summary
+import io
+import itertools
+import heapq
+#Storage backends for sessions are abstract base classes
+import abc
+#Guards the shared LLM client pool and caches
+import threading
+import weakref
+import contextlib
+#Locks a session across uvicorn workers sharing the sessions directory (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+#Keeps blocking parsing and LLM calls off the event loop
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+#Content hashes of transaction stores, used as cache keys
+import hashlib
+#Answer cache expiry and query normalization
+import time
+import unicodedata
+#Binary session files are written with struct headers and read back through mmap
+import mmap
+import struct
+#Structured logging and metrics
+import logging
 
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langgraph.graph import StateGraph, END
 from fastapi.security import APIKeyHeader
-from fastapi import Depends, Security
+from fastapi import Depends, Security, Query
 from typing import List, Dict, Any, TypedDict, Optional, Union, Tuple
 from pydantic import BaseModel
 # Load environment variables
@@ -104,6 +140,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Authorization", "X-API-Key"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],
 )
 
 # Directory for storing uploaded files and results
@@ -113,6 +150,640 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # Create a directory for temporary session data
 SESSION_DIR = "backend/sessions"
 os.makedirs(SESSION_DIR, exist_ok=True)
+# Binary column file written for every session (see TransactionStore.save)
+TRANSACTIONS_FILE = "transactions.bin"
+
+
+# Observability
+"""
+Logging goes through the "transaction_api" logger as one event per line: JSON objects by
+default (LOG_FORMAT=json) or key=value text (LOG_FORMAT=text), at LOG_LEVEL. log_event checks
+the level before building anything, so disabled events cost one comparison.
+
+Hot paths report durations and sizes to in-process histograms and counters, exposed in the
+Prometheus text format on /metrics. Each worker process keeps its own metrics.
+"""
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+
+
+class StructuredLogFormatter(logging.Formatter):
+    """Render a record and the fields passed to log_event as JSON or key=value pairs."""
+    
+    def __init__(self, output: str):
+        super().__init__()
+        self.output = output
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if self.output == "text":
+            return " ".join(f"{key}={value}" for key, value in entry.items())
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+logger = logging.getLogger("transaction_api")
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(StructuredLogFormatter(LOG_FORMAT))
+    logger.addHandler(log_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def log_event(event: str, level: int = logging.INFO, **fields: Any) -> None:
+    """Log one structured event with arbitrary fields."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+class Histogram:
+    """A Prometheus-style histogram with cumulative buckets, keyed by label values."""
+    
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts, then sum, then count
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            pairs = [f'{name}="{value}"' for name, value in zip(self.label_names, labels)]
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, values[:len(self.buckets)] + [values[-1]]):
+                bucket_labels = format_labels(pairs + ['le="' + bound + '"'])
+                lines.append(f"{self.name}_bucket{bucket_labels} {count:g}")
+            lines.append(f"{self.name}_sum{format_labels(pairs)} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{format_labels(pairs)} {values[-1]:g}")
+        return lines
+
+
+class MetricCounter:
+    """A Prometheus-style counter, keyed by label values."""
+    
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            pairs = [f'{name}="{label}"' for name, label in zip(self.label_names, labels)]
+            lines.append(f"{self.name}{format_labels(pairs)} {value:g}")
+        return lines
+
+
+def format_labels(pairs: List[str]) -> str:
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+stage_seconds = Histogram("transaction_api_stage_seconds", "Time spent in each processing stage", STAGE_BUCKETS, ("stage",))
+stage_rows = MetricCounter("transaction_api_stage_rows_total", "Rows processed by each processing stage", ("stage",))
+llm_request_seconds = Histogram("transaction_api_llm_request_seconds", "LLM request latency", LLM_BUCKETS, ("model", "outcome"))
+llm_tokens = MetricCounter("transaction_api_llm_tokens_total", "Tokens reported by the LLM", ("model", "kind"))
+context_tokens_histogram = Histogram("transaction_api_context_tokens", "Tokens of transaction context sent to the LLM", TOKEN_BUCKETS)
+METRICS = [stage_seconds, stage_rows, llm_request_seconds, llm_tokens, context_tokens_histogram]
+
+
+class StageTimer:
+    """
+    Context manager recording the duration of a stage in the metrics; set `rows` before it
+    exits to also count the rows the stage processed.
+    """
+    
+    def __init__(self, stage: str, rows: Optional[int] = None):
+        self.stage = stage
+        self.rows = rows
+    
+    def __enter__(self) -> "StageTimer":
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.seconds = time.perf_counter() - self.started
+        stage_seconds.observe(self.seconds, self.stage)
+        if self.rows:
+            stage_rows.inc(self.rows, self.stage)
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+# Columnar transaction storage
+"""
+Transactions are kept column by column instead of as one dict per row: debit, credit and
+balance are contiguous float64 arrays, dates are int64 days since 1970-01-01, and the string
+columns (descriptions, bank names, transaction ids) are dictionary-encoded into int32 codes
+that point into a StringPool. Dict rows are only materialized when a response is serialized.
+"""
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def to_epoch_day(value: datetime) -> int:
+    """Convert a parsed date to days since 1970-01-01."""
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+@lru_cache(maxsize=8192)
+def epoch_day_to_iso(day: int) -> str:
+    """Render an epoch day the way datetime.isoformat() renders a parsed CSV date."""
+    return datetime.fromordinal(day + EPOCH_ORDINAL).isoformat()
+
+
+@lru_cache(maxsize=8192)
+def epoch_day_to_month(day: int) -> str:
+    """Return the YYYY-MM month key of an epoch day."""
+    return epoch_day_to_iso(day)[:7]
+
+
+def batched(iterable, size: int) -> Iterator[List[Any]]:
+    """Yield lists of up to `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class TransactionRow(NamedTuple):
+    """One parsed CSV row before it is appended to a TransactionStore."""
+    date: Union[int, str]  # Epoch day, or the raw text when the date could not be parsed
+    description: str
+    debit: float
+    credit: float
+    balance: float
+    bank: Optional[str] = None
+    transaction_id: Optional[str] = None
+    source: Optional[str] = None  # File the row came from, for sessions merged from several uploads
+
+
+class StringPool:
+    """Dictionary encoding for a string column: every distinct value is stored once."""
+    
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+    
+    def intern(self, value: str) -> int:
+        """Return the code of `value`, adding it to the pool on first sight."""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+    
+    def __getitem__(self, code: int) -> str:
+        return self.values[code]
+    
+    def __len__(self) -> int:
+        return len(self.values)
+    
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the values."""
+        return sum(len(value) + 64 for value in self.values)
+
+
+class MappedStringPool(StringPool):
+    """
+    A StringPool backed by a string table in a memory-mapped session file: `offsets` holds
+    len + 1 byte offsets into the UTF-8 `data` buffer. Values are decoded on first use, and
+    the reverse index needed by intern() is only built if the pool is appended to.
+    """
+    
+    def __init__(self, offsets: np.ndarray, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+        self._decoded: List[Optional[str]] = [None] * (len(offsets) - 1)
+        self._codes = None
+    
+    def __getitem__(self, code: int) -> str:
+        value = self._decoded[code]
+        if value is None:
+            value = str(self._data[self._offsets[code]:self._offsets[code + 1]], "utf-8")
+            self._decoded[code] = value
+        return value
+    
+    def __len__(self) -> int:
+        return len(self._decoded)
+    
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) + 64 * len(self._decoded)
+    
+    @property
+    def values(self) -> List[str]:
+        for code, value in enumerate(self._decoded):
+            if value is None:
+                self[code]
+        return self._decoded
+    
+    def intern(self, value: str) -> int:
+        if self._codes is None:
+            self._codes = {existing: code for code, existing in enumerate(self.values)}
+        return super().intern(value)
+
+
+class TransactionStore:
+    """
+    Append-only columnar storage for the transactions of one session.
+    
+    Codes of -1 in a string column mean the value is absent (e.g. simple-format rows have
+    no bank or transaction id), and an unparseable date is stored as NO_DATE with its raw
+    text in the `date_text` column.
+    """
+    
+    NO_DATE = np.iinfo(np.int64).min
+    ABSENT = -1
+    BATCH_SIZE = 8192
+    
+    # Binary session file: a header, a table of sections (name, offset, byte length), then
+    # the sections themselves, 8-byte aligned. Every column is stored as raw little-endian
+    # values and every string pool as an int64 offsets array plus a UTF-8 data blob.
+    FILE_MAGIC = b"TXNSTORE"
+    FILE_VERSION = 1
+    FILE_HEADER = struct.Struct("<8sIIQQ32s")  # magic, file version, section count, rows, store version, digest
+    FILE_SECTION = struct.Struct("<24sQQ")  # name, offset, byte length
+    
+    NUMERIC_COLUMNS = {
+        "date": np.int64,
+        "debit": np.float64,
+        "credit": np.float64,
+        "balance": np.float64,
+    }
+    STRING_COLUMNS = ("date_text", "description", "bank", "transaction_id", "source", "category")
+    # Optional string columns materialized after the numeric fields, in this order
+    EXTRA_FIELDS = ("bank", "transaction_id", "source", "category")
+    
+    def __init__(self, capacity: int = 1024):
+        self._size = 0
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.empty(capacity, dtype=dtype) for name, dtype in self.NUMERIC_COLUMNS.items()
+        }
+        for name in self.STRING_COLUMNS:
+            self._columns[name] = np.empty(capacity, dtype=np.int32)
+        self.pools: Dict[str, StringPool] = {name: StringPool() for name in self.STRING_COLUMNS}
+        # Bumped on every append; content_hash chains a digest of each appended batch
+        self.version = 0
+        self._content_digest = b""
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def column(self, name: str) -> np.ndarray:
+        """Return a view of a column trimmed to the number of stored rows."""
+        return self._columns[name][:self._size]
+    
+    @property
+    def debit(self) -> np.ndarray:
+        return self.column("debit")
+    
+    @property
+    def credit(self) -> np.ndarray:
+        return self.column("credit")
+    
+    @property
+    def balance(self) -> np.ndarray:
+        return self.column("balance")
+    
+    @property
+    def dates(self) -> np.ndarray:
+        return self.column("date")
+    
+    @property
+    def content_hash(self) -> str:
+        """
+        Digest of the appended data. Identical hashes mean identical contents; the same rows
+        appended in differently sized batches may hash differently.
+        """
+        return self._content_digest.hex()
+    
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the columns and string pools."""
+        column_bytes = sum(column.nbytes for column in self._columns.values())
+        return column_bytes + sum(pool.nbytes for pool in self.pools.values())
+    
+    def snapshot(self) -> "TransactionStore":
+        """
+        A read-only view of the rows stored so far, sharing their columns and string pools
+        without copying. Rows appended to this store afterwards do not show up in it.
+        """
+        store = TransactionStore(capacity=0)
+        store._columns = {name: column[:self._size] for name, column in self._columns.items()}
+        store.pools = self.pools
+        store._size = self._size
+        store.version = self.version
+        store._content_digest = self._content_digest
+        return store
+    
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._columns["date"])
+        if size <= capacity:
+            return
+        capacity = max(capacity, 1)
+        while capacity < size:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+    
+    def append_batch(self, rows: List[TransactionRow]) -> None:
+        """Append a batch of parsed rows to every column."""
+        if not rows:
+            return
+        start = self._size
+        stop = start + len(rows)
+        self._reserve(stop)
+        pool_sizes = {name: len(pool) for name, pool in self.pools.items()}
+        
+        dates, descriptions, debits, credits, balances, banks, transaction_ids, sources = zip(*rows)
+        
+        date_pool = self.pools["date_text"]
+        self._columns["date"][start:stop] = [d if type(d) is int else self.NO_DATE for d in dates]
+        self._columns["date_text"][start:stop] = [self.ABSENT if type(d) is int else date_pool.intern(d) for d in dates]
+        self._columns["debit"][start:stop] = debits
+        self._columns["credit"][start:stop] = credits
+        self._columns["balance"][start:stop] = balances
+        
+        self._columns["description"][start:stop] = [self.pools["description"].intern(v) for v in descriptions]
+        for name, values in (("bank", banks), ("transaction_id", transaction_ids), ("source", sources)):
+            pool = self.pools[name]
+            self._columns[name][start:stop] = [self.ABSENT if v is None else pool.intern(v) for v in values]
+        # Derived from the description afterwards (see categorize_rows)
+        self._columns["category"][start:stop] = self.ABSENT
+        
+        self._add_to_digest(start, stop, pool_sizes)
+        self._size = stop
+        self.version += 1
+    
+    def _add_to_digest(self, start: int, stop: int, pool_sizes: Dict[str, int]) -> None:
+        """Chain rows [start, stop) and the pool values added since `pool_sizes` into content_hash."""
+        digest = hashlib.sha256(self._content_digest)
+        for column in self._columns.values():
+            digest.update(column[start:stop].tobytes())
+        for name, pool in self.pools.items():
+            for value in pool.values[pool_sizes[name]:]:
+                digest.update(value.encode("utf-8") + b"\0")
+        self._content_digest = digest.digest()
+    
+    @classmethod
+    def _from_columns(cls, columns: Dict[str, np.ndarray], pools: Dict[str, StringPool]) -> "TransactionStore":
+        """Build a store from complete columns, as if they had been appended in one batch."""
+        store = cls(capacity=0)
+        store._columns = columns
+        store.pools = pools
+        size = len(columns["date"])
+        if size:
+            store._add_to_digest(0, size, {name: 0 for name in pools})
+            store._size = size
+            store.version = 1
+        return store
+    
+    @classmethod
+    def concatenate(cls, stores: List["TransactionStore"], sources: Optional[List[str]] = None) -> "TransactionStore":
+        """
+        Merge stores end to end, re-encoding their string columns against shared pools. When
+        `sources` is given, every row of stores[i] gets sources[i] in the source column.
+        """
+        columns = {name: np.concatenate([store.column(name) for store in stores]) for name in cls.NUMERIC_COLUMNS}
+        pools = {name: StringPool() for name in cls.STRING_COLUMNS}
+        for name in cls.STRING_COLUMNS:
+            parts = []
+            for index, store in enumerate(stores):
+                if name == "source" and sources is not None:
+                    parts.append(np.full(len(store), pools[name].intern(sources[index]), dtype=np.int32))
+                    continue
+                # The extra trailing entry maps ABSENT (-1) to itself
+                remap = np.array([pools[name].intern(value) for value in store.pools[name].values] + [cls.ABSENT], dtype=np.int32)
+                parts.append(remap[store.column(name)])
+            columns[name] = np.concatenate(parts)
+        return cls._from_columns(columns, pools)
+    
+    def take(self, indices: np.ndarray) -> "TransactionStore":
+        """
+        Copy the rows at `indices`, in that order, into a new store whose string pools are
+        re-encoded in first-seen order, as if the rows had been appended in that order.
+        """
+        columns = {name: self.column(name)[indices] for name in self.NUMERIC_COLUMNS}
+        pools = {}
+        for name in self.STRING_COLUMNS:
+            codes = self.column(name)[indices]
+            present = codes[codes != self.ABSENT]
+            used, first_seen = np.unique(present, return_index=True)
+            used = used[np.argsort(first_seen)]
+            pool = StringPool()
+            remap = np.full(len(self.pools[name]) + 1, self.ABSENT, dtype=np.int32)
+            remap[used] = [pool.intern(self.pools[name][code]) for code in used.tolist()]
+            columns[name] = remap[codes]
+            pools[name] = pool
+        return self._from_columns(columns, pools)
+    
+    def derive_column(self, source: str, target: str, func: Callable[[str], Optional[str]], start: int = 0, stop: Optional[int] = None) -> None:
+        """
+        Set string column `target` of rows [start, stop) to func(value of `source`), calling
+        func once per distinct value in the range. Rows where either is absent stay absent.
+        """
+        stop = self._size if stop is None else min(stop, self._size)
+        if stop <= start:
+            return
+        codes = self.column(source)[start:stop]
+        source_pool, target_pool = self.pools[source], self.pools[target]
+        # The extra trailing entry maps ABSENT (-1) to itself
+        lookup = np.full(len(source_pool) + 1, self.ABSENT, dtype=np.int32)
+        for code in np.unique(codes[codes != self.ABSENT]).tolist():
+            value = func(source_pool[code])
+            lookup[code] = self.ABSENT if value is None else target_pool.intern(value)
+        if not self._columns[target].flags.writeable:
+            # A column of a memory-mapped file
+            self._columns[target] = self._columns[target].copy()
+        self._columns[target][start:stop] = lookup[codes]
+    
+    def extend(self, rows) -> None:
+        """Append every row of an iterable, one batch at a time."""
+        for batch in batched(rows, self.BATCH_SIZE):
+            self.append_batch(batch)
+    
+    def date_strings(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        """Return the serialized date of each row in [start, stop)."""
+        days = self.column("date")[start:stop].tolist()
+        texts = self.column("date_text")[start:stop].tolist()
+        pool = self.pools["date_text"]
+        return [pool[text] if text != self.ABSENT else epoch_day_to_iso(day) for day, text in zip(days, texts)]
+    
+    def months(self, start: int = 0, stop: Optional[int] = None) -> List[Optional[str]]:
+        """Return the YYYY-MM month key of each row in [start, stop), or None if unknown."""
+        days = self.column("date")[start:stop].tolist()
+        texts = self.column("date_text")[start:stop].tolist()
+        pool = self.pools["date_text"]
+        return [
+            transaction_month(pool[text]) if text != self.ABSENT else epoch_day_to_month(day)
+            for day, text in zip(days, texts)
+        ]
+    
+    def dedup_keys(self, start: int = 0, stop: Optional[int] = None) -> List[Tuple]:
+        """
+        Return the keys identifying rows [start, stop) across uploads: the Desjardins
+        transaction id when present, otherwise date, description and amounts.
+        """
+        transaction_ids = self.column("transaction_id")[start:stop].tolist()
+        descriptions = self.column("description")[start:stop].tolist()
+        debits = self.debit[start:stop].tolist()
+        credits = self.credit[start:stop].tolist()
+        dates = self.date_strings(start, stop)
+        id_pool = self.pools["transaction_id"]
+        description_pool = self.pools["description"]
+        return [
+            ("id", id_pool[tid]) if tid != self.ABSENT and id_pool[tid] else (date, description_pool[description], debit, credit)
+            for tid, date, description, debit, credit in zip(transaction_ids, dates, descriptions, debits, credits)
+        ]
+    
+    def rows(self, indices) -> List[Dict[str, Any]]:
+        """Materialize the rows at `indices` (a slice or an integer array) as dictionaries."""
+        days = self._columns["date"][:self._size][indices].tolist()
+        texts = self._columns["date_text"][:self._size][indices].tolist()
+        columns = [self._columns[name][:self._size][indices].tolist() for name in ("description", "debit", "credit", "balance")]
+        extras = [(name, self.pools[name], self._columns[name][:self._size][indices].tolist()) for name in self.EXTRA_FIELDS]
+        date_pool = self.pools["date_text"]
+        descriptions = self.pools["description"]
+        
+        rows = []
+        for offset, (day, text, description, debit, credit, balance) in enumerate(zip(days, texts, *columns)):
+            row = {
+                "date": date_pool[text] if text != self.ABSENT else epoch_day_to_iso(day),
+                "description": descriptions[description],
+                "debit": debit,
+                "credit": credit,
+                "balance": balance,
+            }
+            for name, pool, codes in extras:
+                code = codes[offset]
+                if code != self.ABSENT:
+                    row[name] = pool[code]
+            rows.append(row)
+        return rows
+    
+    def row(self, index: int) -> Dict[str, Any]:
+        """Materialize a single row as a dictionary."""
+        return self.rows(slice(index, index + 1))[0]
+    
+    def iter_dicts(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Yield rows in [start, stop) as dictionaries, materializing one batch at a time."""
+        stop = self._size if stop is None else min(stop, self._size)
+        for batch_start in range(start, stop, self.BATCH_SIZE):
+            yield from self.rows(slice(batch_start, min(batch_start + self.BATCH_SIZE, stop)))
+    
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Materialize every row; only used at serialization boundaries."""
+        return list(self.iter_dicts())
+    
+    def _file_sections(self) -> Iterator[Tuple[str, bytes]]:
+        for name, dtype in self.NUMERIC_COLUMNS.items():
+            yield name, self.column(name).astype(np.dtype(dtype).newbyteorder("<"), copy=False).tobytes()
+        for name in self.STRING_COLUMNS:
+            yield name, self.column(name).astype("<i4", copy=False).tobytes()
+        for name, pool in self.pools.items():
+            encoded = [value.encode("utf-8") for value in pool.values]
+            offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            yield f"{name}.offsets", offsets.tobytes()
+            yield f"{name}.data", b"".join(encoded)
+    
+    def save(self, path: str) -> None:
+        """Write the store to a binary session file, atomically replacing `path`."""
+        sections = list(self._file_sections())
+        position = self.FILE_HEADER.size + self.FILE_SECTION.size * len(sections)
+        table = []
+        for name, payload in sections:
+            position += -position % 8
+            table.append(self.FILE_SECTION.pack(name.encode("ascii"), position, len(payload)))
+            position += len(payload)
+        
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as binary_file:
+            binary_file.write(self.FILE_HEADER.pack(
+                self.FILE_MAGIC, self.FILE_VERSION, len(sections), self._size, self.version, self._content_digest.ljust(32, b"\0")
+            ))
+            binary_file.write(b"".join(table))
+            for name, payload in sections:
+                binary_file.write(b"\0" * (-binary_file.tell() % 8))
+                binary_file.write(payload)
+        os.replace(temporary_path, path)
+    
+    @classmethod
+    def open(cls, path: str) -> "TransactionStore":
+        """
+        Open a binary session file without reading it: the columns are read-only views of a
+        memory map, so only the pages a query touches are loaded. Appending copies the
+        columns into memory first.
+        """
+        with open(path, "rb") as binary_file:
+            if os.fstat(binary_file.fileno()).st_size == 0:
+                raise ValueError(f"{path} is empty")
+            mapped = mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(mapped)
+        
+        magic, file_version, section_count, size, version, digest = cls.FILE_HEADER.unpack_from(buffer, 0)
+        if magic != cls.FILE_MAGIC or file_version != cls.FILE_VERSION:
+            raise ValueError(f"{path} is not a version {cls.FILE_VERSION} transaction file")
+        sections = {}
+        for index in range(section_count):
+            name, offset, length = cls.FILE_SECTION.unpack_from(buffer, cls.FILE_HEADER.size + index * cls.FILE_SECTION.size)
+            sections[name.rstrip(b"\0").decode("ascii")] = buffer[offset:offset + length]
+        
+        store = cls(capacity=0)
+        for name, dtype in cls.NUMERIC_COLUMNS.items():
+            store._columns[name] = np.frombuffer(sections[name], dtype=np.dtype(dtype).newbyteorder("<"))
+        for name in cls.STRING_COLUMNS:
+            if name not in sections:
+                # A column added after the file was written
+                store._columns[name] = np.full(size, cls.ABSENT, dtype=np.int32)
+                continue
+            store._columns[name] = np.frombuffer(sections[name], dtype="<i4")
+            store.pools[name] = MappedStringPool(np.frombuffer(sections[f"{name}.offsets"], dtype="<i8"), sections[f"{name}.data"])
+        store._size = size
+        store.version = version
+        store._content_digest = digest if version else b""
+        return store
 
 
 # Define state structure for LangGraph
@@ -122,21 +793,48 @@ TypedDict is used mainly for static type checking. Tools like mypy or IDEs check
 
 """
 class GraphState(TypedDict):
-    transactions: List[Dict[str, Any]]
+    transactions: TransactionStore
     transaction_summary: Dict[str, Any]
+    summary_version: int  # TransactionStore.version of transaction_summary, -1 if not computed
+    insights: Dict[str, Any]  # InsightDetector results for the prompt, empty if not given
     query: str
+    context: str  # Session-stable data, sent before the conversation
+    query_context: str  # Rows picked for this query, sent with the question
+    history: List[Dict[str, str]]  # Earlier messages ({"role", "content"}), compacted by build_context
+    context_tokens: int
+    tokens_saved: int
+    local_query: Optional[Dict[str, Any]]  # StructuredQuery to answer without the LLM, if any
+    route: str  # "local" or "llm"
+    chunks: List[str]  # Per-part contexts when the rows are analyzed by map-reduce, else empty
+    partial_answers: List[str]  # Answers for each of chunks
     response: str
 
 
 # Pydantic models for API requests and responses
+class StructuredQuery(BaseModel):
+    """An explicit aggregation to run locally instead of asking the LLM."""
+    op: str  # "totals", "monthly", "top_months", "largest", "common" or "categories"
+    start_date: Optional[str] = None  # YYYY-MM-DD, inclusive
+    end_date: Optional[str] = None  # YYYY-MM-DD, inclusive
+    kind: Optional[str] = None  # "debit" or "credit" for largest/top_months; both when omitted
+    limit: int = 5
+    order: Optional[str] = None  # For top_months: "asc" for the lowest months first; highest first when omitted
+    category: Optional[str] = None  # For categories: a single category, every category when omitted; other ops: only its rows
+
+
 class TransactionQuery(BaseModel):
     session_id: str
-    query: str
+    query: str = ""
+    structured: Optional[StructuredQuery] = None  # Run this aggregation locally instead of asking the LLM
 
 
 class TransactionResponse(BaseModel):
     session_id: str
     response: str
+    context_tokens: Optional[int] = None
+    tokens_saved: Optional[int] = None
+    cached: bool = False
+    answered_locally: bool = False
 
 
 class UploadResponse(BaseModel):
@@ -146,6 +844,15 @@ class UploadResponse(BaseModel):
     csv_format: str
 
 
+class AppendResponse(BaseModel):
+    session_id: str
+    message: str
+    transaction_count: int
+    added_count: int
+    duplicate_count: int
+    csv_format: str
+
+
 class AnalysisResponse(BaseModel):
     session_id: str
     summary: Dict[str, Any]
@@ -156,12 +863,26 @@ class Message(BaseModel):
     timestamp: str
 
 class Session(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    
     session_id: str
     file_path: str
-    transactions: List[Dict[str, Any]]
+    transactions: TransactionStore
     transaction_summary: Dict[str, Any]
     csv_format: str
     messages: List[Message] = []  # Add messages field with default empty list
+    # Bumped whenever rows are added, so other workers know to reload the transactions
+    data_version: int = 1
+    # TransactionStore.version the transaction_summary was computed at
+    summary_version: int = -1
+    # Incremental state for /sessions/{session_id}/append, rebuilt lazily when missing
+    summary_builder: Optional[Any] = None  # TransactionSummaryBuilder
+    dedup_index: Optional[Any] = None  # DedupIndex of TransactionStore.dedup_keys()
+    # InsightDetector results, and the TransactionStore.version they were computed at
+    insights: Dict[str, Any] = {}
+    insights_version: int = -1
+    insight_detector: Optional[Any] = None  # InsightDetector, rebuilt lazily when missing
+    time_index: Optional[Any] = None  # TimeIndex, rebuilt lazily when the store changes
 
 
 class HelloWorldResponse(BaseModel):
@@ -170,243 +891,2851 @@ class HelloWorldResponse(BaseModel):
     timestamp: str
 
 
+# Session storage
+"""
+Sessions are persisted under SESSION_DIR/<session_id>/: the ingestion pipeline writes the
+transactions, and the backend writes session.json with everything else (summary, messages,
+format). SessionManager keeps recently used sessions in an in-memory LRU bounded by count and
+bytes and rehydrates the rest lazily on first access, so sessions survive restarts and can be
+shared by several uvicorn workers. A cached session is refreshed when another worker has
+updated its session.json.
+
+Every change to a session (an append, a new conversation turn) is a read-modify-write done
+under SessionManager.lock(): an asyncio.Lock orders the requests of one process, and the
+backend's lock (flock on SESSION_LOCK_FILE in the session directory) orders the workers.
+Inside it the session is reloaded from storage, so a change made by another worker is never
+overwritten with stale state. Without fcntl (Windows), only the in-process lock is taken and a
+single worker is supported.
+"""
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "file")
+SESSION_CACHE_MAX_SESSIONS = int(os.environ.get("SESSION_CACHE_MAX_SESSIONS", "64"))
+SESSION_CACHE_MAX_BYTES = int(os.environ.get("SESSION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+SESSION_ID_PATTERN = re.compile(r"[0-9A-Za-z-]{1,64}")
+# Minimum seconds between two recorded accesses of the same session
+SESSION_TOUCH_INTERVAL = 60
+SESSION_LOCK_FILE = ".lock"
+# Seconds between two attempts to take a session lock held by another worker
+SESSION_LOCK_POLL_INTERVAL = 0.01
+
+
+class SessionBackend(abc.ABC):
+    """Durable storage for sessions; subclasses decide where the data lives."""
+    
+    @abc.abstractmethod
+    def stamp(self, session_id: str) -> Optional[Any]:
+        """Cheap change marker for a session's metadata, or None if the session does not exist."""
+    
+    @abc.abstractmethod
+    def load(self, session_id: str) -> Optional[Session]:
+        """Rehydrate a session, or return None if it does not exist."""
+    
+    @abc.abstractmethod
+    def load_metadata(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Read only the session metadata (no transactions)."""
+    
+    @abc.abstractmethod
+    def save_metadata(self, session: Session) -> Any:
+        """Persist everything but the transactions and return the new stamp."""
+    
+    @abc.abstractmethod
+    def detach(self, session_id: str) -> Optional[Any]:
+        """
+        Make a session unreachable right away and return a handle for reclaim(), which frees
+        its storage later; None if the session does not exist.
+        """
+    
+    @abc.abstractmethod
+    def reclaim(self, handle: Any) -> int:
+        """Free the storage of a detached session and return the bytes reclaimed."""
+    
+    def reclaim_detached(self) -> int:
+        """Free storage left detached by an interrupted reclaim() and return the bytes reclaimed."""
+        return 0
+    
+    def try_lock(self, session_id: str) -> Optional[Any]:
+        """
+        Take a session's lock for other processes without waiting. Return a handle for
+        unlock(), or None if another process holds it. Backends shared by several workers
+        must override this; the default only suits a single worker.
+        """
+        return session_id
+    
+    def unlock(self, handle: Any) -> None:
+        """Release a lock taken with try_lock()."""
+    
+    @abc.abstractmethod
+    def touch(self, session_id: str) -> None:
+        """Record that a session was used, for idle expiry."""
+    
+    @abc.abstractmethod
+    def usage(self) -> List["SessionUsage"]:
+        """Last access time and storage size of every stored session."""
+    
+    @abc.abstractmethod
+    def list_ids(self) -> List[str]:
+        """Session ids, oldest first."""
+
+
+class SessionUsage(NamedTuple):
+    session_id: str
+    last_access: float  # Seconds since the epoch
+    disk_bytes: int
+
+
+def directory_size(path: str) -> int:
+    """Total size of the files under a directory."""
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def transaction_row_from_dict(t: Dict[str, Any]) -> TransactionRow:
+    """Convert a serialized transaction back into a parsed row."""
+    date = t["date"]
+    if isinstance(date, str) and date.endswith("T00:00:00"):
+        try:
+            date = to_epoch_day(datetime.fromisoformat(date))
+        except ValueError:
+            pass
+    return TransactionRow(date, t["description"], t["debit"], t["credit"], t["balance"], t.get("bank"), t.get("transaction_id"), t.get("source"))
+
+
+def iter_transactions_json(json_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the transactions of a transactions.json written by the ingestion pipeline (one
+    transaction per line), falling back to a full parse for other layouts.
+    """
+    with open(json_path, "r", encoding="utf-8") as json_file:
+        for line in json_file:
+            line = line.strip().rstrip(",")
+            if line in ("[", "]", ""):
+                continue
+            if not line.startswith("{"):
+                break
+            yield json.loads(line)
+        else:
+            return
+    
+    with open(json_path, "r", encoding="utf-8") as json_file:
+        yield from json.load(json_file)
+
+
+class FileSessionBackend(SessionBackend):
+    """Stores each session as files in its own directory under SESSION_DIR."""
+    
+    META_FILE = "session.json"
+    TRASH_PREFIX = ".trash-"
+    
+    def __init__(self, root: str):
+        self.root = root
+    
+    def _path(self, session_id: str, name: str = "") -> str:
+        return os.path.join(self.root, session_id, name)
+    
+    def stamp(self, session_id: str) -> Optional[Any]:
+        try:
+            stat = os.stat(self._path(session_id, self.META_FILE))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def load_metadata(self, session_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(session_id, self.META_FILE), "r", encoding="utf-8") as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+    
+    def load(self, session_id: str) -> Optional[Session]:
+        metadata = self.load_metadata(session_id)
+        if metadata is None:
+            return None
+        
+        binary_path = self._path(session_id, TRANSACTIONS_FILE)
+        if os.path.exists(binary_path):
+            transactions = TransactionStore.open(binary_path)
+        else:
+            # Sessions created before transactions.bin existed
+            transactions = TransactionStore()
+            transactions.extend(
+                transaction_row_from_dict(t)
+                for t in iter_transactions_json(self._path(session_id, "transactions.json"))
+            )
+        if ensure_categories(transactions):
+            # Sessions saved before categories existed; their stored summary lacks them
+            metadata["transaction_summary"] = create_transaction_summary(transactions)
+        return Session(
+            transactions=transactions,
+            summary_version=transactions.version,
+            insights_version=transactions.version if "insights" in metadata else -1,
+            **metadata
+        )
+    
+    def save_metadata(self, session: Session) -> Any:
+        metadata = {
+            "session_id": session.session_id,
+            "file_path": session.file_path,
+            "csv_format": session.csv_format,
+            "transaction_summary": session.transaction_summary,
+            "messages": [message.model_dump() for message in session.messages],
+            "data_version": session.data_version,
+        }
+        if session.insights_version == session.transactions.version:
+            metadata["insights"] = session.insights
+        path = self._path(session.session_id, self.META_FILE)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as meta_file:
+            json.dump(metadata, meta_file)
+        os.replace(temporary_path, path)
+        return self.stamp(session.session_id)
+    
+    def detach(self, session_id: str) -> Optional[Any]:
+        # Renaming is atomic, so the session disappears at once however large it is
+        trash_path = os.path.join(self.root, f"{self.TRASH_PREFIX}{session_id}-{uuid.uuid4().hex}")
+        try:
+            os.rename(self._path(session_id), trash_path)
+        except OSError:
+            return None
+        return trash_path
+    
+    def reclaim(self, handle: Any) -> int:
+        reclaimed = directory_size(handle)
+        shutil.rmtree(handle, ignore_errors=True)
+        return reclaimed
+    
+    def reclaim_detached(self) -> int:
+        with os.scandir(self.root) as entries:
+            leftovers = [entry.path for entry in entries if entry.name.startswith(self.TRASH_PREFIX)]
+        return sum(self.reclaim(path) for path in leftovers)
+    
+    def try_lock(self, session_id: str) -> Optional[Any]:
+        if fcntl is None:
+            return -1
+        try:
+            descriptor = os.open(self._path(session_id, SESSION_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            # The session does not exist (any more); loading it will say so
+            return -1
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(descriptor)
+            return None
+        return descriptor
+    
+    def unlock(self, handle: Any) -> None:
+        if handle >= 0:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            os.close(handle)
+    
+    def touch(self, session_id: str) -> None:
+        try:
+            os.utime(self._path(session_id))
+        except OSError:
+            pass
+    
+    def usage(self) -> List[SessionUsage]:
+        # Sessions without session.json yet (uploads in progress or that failed) are included
+        with os.scandir(self.root) as entries:
+            directories = [entry for entry in entries if entry.is_dir() and SESSION_ID_PATTERN.fullmatch(entry.name)]
+        usage = []
+        for entry in directories:
+            try:
+                last_access = entry.stat().st_mtime
+            except OSError:
+                continue
+            usage.append(SessionUsage(entry.name, last_access, directory_size(entry.path)))
+        return usage
+    
+    def list_ids(self) -> List[str]:
+        sessions = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not SESSION_ID_PATTERN.fullmatch(entry.name):
+                    continue
+                try:
+                    created = os.stat(os.path.join(entry.path, "transactions.csv")).st_mtime_ns
+                except OSError:
+                    # Sessions created by /upload/batch
+                    try:
+                        created = os.stat(os.path.join(entry.path, BATCH_SOURCES_DIR)).st_mtime_ns
+                    except OSError:
+                        continue
+                if os.path.exists(os.path.join(entry.path, self.META_FILE)):
+                    sessions.append((created, entry.name))
+        return [session_id for _, session_id in sorted(sessions)]
+
+
+SESSION_BACKENDS = {
+    "file": FileSessionBackend,
+}
+
+
+class SessionManager:
+    """In-memory LRU of hot sessions in front of a durable SessionBackend."""
+    
+    def __init__(self, backend: SessionBackend, max_sessions: int, max_bytes: int):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._cache: "OrderedDict[str, Tuple[Session, Any]]" = OrderedDict()
+        # time.monotonic() of the last access to each hot session, and of its last touch()
+        self._last_used: Dict[str, float] = {}
+        self._last_touched: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        # In-process half of lock(), one per session while in use
+        self._write_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.loads = 0
+        self.refreshes = 0
+        self.evicted = 0
+    
+    @staticmethod
+    def _valid_id(session_id: str) -> bool:
+        return bool(SESSION_ID_PATTERN.fullmatch(session_id))
+    
+    @staticmethod
+    def _session_bytes(session: Session) -> int:
+        """Memory held by a hot session: its store and the incremental state kept for appends."""
+        size = session.transactions.nbytes
+        if session.insight_detector is not None:
+            size += session.insight_detector.nbytes
+        if session.dedup_index is not None:
+            size += session.dedup_index.nbytes
+        return size
+    
+    def _cached_bytes(self) -> int:
+        return sum(self._session_bytes(session) for session, _ in self._cache.values())
+    
+    def _forget(self, session_id: str) -> None:
+        self._cache.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        self._last_touched.pop(session_id, None)
+    
+    def _used(self, session_id: str) -> None:
+        now = time.monotonic()
+        self._last_used[session_id] = now
+        if now - self._last_touched.get(session_id, -SESSION_TOUCH_INTERVAL) >= SESSION_TOUCH_INTERVAL:
+            self._last_touched[session_id] = now
+            self.backend.touch(session_id)
+    
+    def _remember(self, session: Session, stamp: Any) -> None:
+        self._cache[session.session_id] = (session, stamp)
+        self._cache.move_to_end(session.session_id)
+        self._used(session.session_id)
+        # Evict least recently used sessions, always keeping the one just used
+        while len(self._cache) > 1 and (len(self._cache) > self.max_sessions or self._cached_bytes() > self.max_bytes):
+            self._forget(next(iter(self._cache)))
+            self.evicted += 1
+    
+    def _write_lock(self, session_id: str) -> asyncio.Lock:
+        with self._lock:
+            lock = self._write_locks.get(session_id)
+            if lock is None:
+                lock = self._write_locks[session_id] = asyncio.Lock()
+            return lock
+    
+    @contextlib.asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        """
+        Hold a session's lock in this process and, through the backend, against other
+        workers. The backend lock is polled so that waiting never blocks the event loop.
+        """
+        async with self._write_lock(session_id):
+            handle = self.backend.try_lock(session_id)
+            while handle is None:
+                await asyncio.sleep(SESSION_LOCK_POLL_INTERVAL)
+                handle = self.backend.try_lock(session_id)
+            try:
+                yield
+            finally:
+                self.backend.unlock(handle)
+    
+    def get(self, session_id: str) -> Optional[Session]:
+        """Return a session, rehydrating it from the backend if it is not in memory."""
+        if not self._valid_id(session_id):
+            return None
+        
+        stamp = self.backend.stamp(session_id)
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if stamp is None:
+                self._forget(session_id)
+                return None
+            if cached is not None and cached[1] == stamp:
+                self._cache.move_to_end(session_id)
+                self._used(session_id)
+                self.hits += 1
+                return cached[0]
+        
+        # Rehydrate outside the lock so a large session does not block the others
+        if cached is not None:
+            # Another worker updated the session; reload only what changed
+            session = cached[0]
+            metadata = self.backend.load_metadata(session_id)
+            if metadata is not None and metadata["data_version"] == session.data_version:
+                session.messages = [Message(**message) for message in metadata["messages"]]
+                with self._lock:
+                    self._remember(session, stamp)
+                    self.refreshes += 1
+                return session
+        
+        with StageTimer("session_load") as timer:
+            session = self.backend.load(session_id)
+            timer.rows = len(session.transactions) if session is not None else None
+        if session is None:
+            return None
+        with self._lock:
+            self._remember(session, stamp)
+            self.loads += 1
+        return session
+    
+    def save(self, session: Session) -> None:
+        """Persist a new or changed session and keep it hot."""
+        with self._lock, StageTimer("session_save"):
+            stamp = self.backend.save_metadata(session)
+            self._remember(session, stamp)
+    
+    def delete(self, session_id: str) -> Optional[Any]:
+        """
+        Forget a session and detach its data, returning the handle to pass to reclaim(), or
+        None if the session did not exist.
+        """
+        if not self._valid_id(session_id):
+            return None
+        with self._lock:
+            self._forget(session_id)
+            return self.backend.detach(session_id)
+    
+    def reclaim(self, handle: Any) -> int:
+        """Free the storage of a deleted session; returns the bytes reclaimed."""
+        return self.backend.reclaim(handle)
+    
+    def evict_idle(self, max_idle: float) -> Tuple[int, int]:
+        """Drop hot sessions unused for `max_idle` seconds from memory; returns (count, bytes)."""
+        cutoff = time.monotonic() - max_idle
+        with self._lock:
+            idle = [session_id for session_id, last_used in self._last_used.items() if last_used < cutoff and session_id in self._cache]
+            freed = sum(self._session_bytes(self._cache[session_id][0]) for session_id in idle)
+            for session_id in idle:
+                self._forget(session_id)
+            self.evicted += len(idle)
+        return len(idle), freed
+    
+    def list_ids(self) -> List[str]:
+        return self.backend.list_ids()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hot_sessions": len(self._cache),
+                "hot_bytes": self._cached_bytes(),
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "refreshes": self.refreshes,
+                "evicted": self.evicted,
+            }
+
+
 # Store active sessions
-active_sessions: Dict[str, Session] = {}
+sessions = SessionManager(
+    SESSION_BACKENDS[SESSION_BACKEND](SESSION_DIR),
+    max_sessions=SESSION_CACHE_MAX_SESSIONS,
+    max_bytes=SESSION_CACHE_MAX_BYTES
+)
+
+
+# Session expiry
+"""
+Nothing else removes sessions, so a janitor task sweeps them periodically: hot sessions idle
+for SESSION_HOT_IDLE_TTL seconds are dropped from memory, and stored sessions idle for
+SESSION_IDLE_TTL seconds, or the least recently used ones while the sessions directory is
+over SESSION_DISK_QUOTA_BYTES, are deleted. Deleted directories are renamed away first and
+removed in the CPU pool. Set SESSION_JANITOR_INTERVAL to 0 to disable the sweeps, and a TTL
+or the quota to 0 to disable that rule.
+"""
+SESSION_JANITOR_INTERVAL = int(os.environ.get("SESSION_JANITOR_INTERVAL", "300"))
+SESSION_IDLE_TTL = int(os.environ.get("SESSION_IDLE_TTL", str(24 * 3600)))
+SESSION_HOT_IDLE_TTL = int(os.environ.get("SESSION_HOT_IDLE_TTL", "900"))
+SESSION_DISK_QUOTA_BYTES = int(os.environ.get("SESSION_DISK_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+
+class SessionJanitor:
+    """Expires sessions by idle time and disk quota and keeps a running tally of what it freed."""
+    
+    def __init__(self, manager: SessionManager, interval: int, idle_ttl: int, hot_idle_ttl: int, disk_quota: int):
+        self.manager = manager
+        self.interval = interval
+        self.idle_ttl = idle_ttl
+        self.hot_idle_ttl = hot_idle_ttl
+        self.disk_quota = disk_quota
+        self.runs = 0
+        self.expired_idle = 0
+        self.expired_quota = 0
+        self.unloaded = 0
+        self.bytes_reclaimed = 0
+        self.memory_freed = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+    
+    def sweep(self) -> Dict[str, Any]:
+        """Run one expiry pass and return what it did."""
+        unloaded, memory_freed = self.manager.evict_idle(self.hot_idle_ttl) if self.hot_idle_ttl else (0, 0)
+        backend = self.manager.backend
+        reclaimed = backend.reclaim_detached()
+        
+        now = time.time()
+        usage = sorted(backend.usage(), key=lambda entry: entry.last_access)
+        idle = [entry for entry in usage if self.idle_ttl and now - entry.last_access > self.idle_ttl]
+        remaining = [entry for entry in usage if entry not in idle]
+        
+        # Least recently used first until the rest fits in the quota
+        over_quota = []
+        disk_bytes = sum(entry.disk_bytes for entry in remaining)
+        for entry in remaining:
+            if not self.disk_quota or disk_bytes <= self.disk_quota:
+                break
+            over_quota.append(entry)
+            disk_bytes -= entry.disk_bytes
+        
+        expired = []
+        for entry in idle + over_quota:
+            handle = self.manager.delete(entry.session_id)
+            if handle is not None:
+                reclaimed += self.manager.reclaim(handle)
+                expired.append(entry.session_id)
+        
+        report = {
+            "timestamp": datetime.now().isoformat(),
+            "expired_idle": len(idle),
+            "expired_quota": len(over_quota),
+            "unloaded": unloaded,
+            "bytes_reclaimed": reclaimed,
+            "memory_freed": memory_freed,
+            "sessions_remaining": len(usage) - len(expired),
+            "disk_bytes": disk_bytes,
+        }
+        self.runs += 1
+        self.expired_idle += len(idle)
+        self.expired_quota += len(over_quota)
+        self.unloaded += unloaded
+        self.bytes_reclaimed += reclaimed
+        self.memory_freed += memory_freed
+        self.last_report = report
+        if expired or unloaded or reclaimed:
+            log_event("sessions_expired", **report)
+        return report
+    
+    async def run(self) -> None:
+        """Sweep every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_cpu_bound(self.sweep)
+            except Exception as e:
+                log_event("session_expiry_failed", logging.ERROR, error=str(e))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "idle_ttl": self.idle_ttl,
+            "hot_idle_ttl": self.hot_idle_ttl,
+            "disk_quota": self.disk_quota,
+            "runs": self.runs,
+            "expired_idle": self.expired_idle,
+            "expired_quota": self.expired_quota,
+            "unloaded": self.unloaded,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "memory_freed": self.memory_freed,
+            "last_run": self.last_report,
+        }
+
+
+session_janitor = SessionJanitor(
+    sessions,
+    interval=SESSION_JANITOR_INTERVAL,
+    idle_ttl=SESSION_IDLE_TTL,
+    hot_idle_ttl=SESSION_HOT_IDLE_TTL,
+    disk_quota=SESSION_DISK_QUOTA_BYTES
+)
+janitor_task: Optional[asyncio.Task] = None
+
+
+# Bounded pool for blocking work (CSV parsing, summaries, context building, file I/O) so it
+# never runs on the event loop; LLM calls are awaited directly
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """Run a blocking function on the CPU pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, functools.partial(func, *args, **kwargs))
+
+
+# Worker processes for parsing several files in parallel (pure-Python parsing holds the GIL),
+# started on first use; spawned rather than forked because the server already runs threads
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+parse_executor: Optional[ProcessPoolExecutor] = None
+
+
+async def run_in_parse_pool(func, *args):
+    """Run a picklable function in a parse worker process and await its result."""
+    global parse_executor
+    if parse_executor is None:
+        parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(parse_executor, func, *args)
+
+
+# Streaming ingestion settings
+"""
+Starlette spools the whole upload (in memory, then in a temporary file once it is large)
+before the endpoint runs. The spooled file is then parsed in a single streaming pass: it is
+read in INGEST_CHUNK_SIZE chunks and copied to the session's transactions.csv as it is read,
+the format is sniffed from the first FORMAT_SNIFF_SIZE characters, and parsed rows are
+appended in batches to an in-memory TransactionStore while the summary builder and insight
+detector are updated. The store is then saved to transactions.bin.
+
+The reading side holds only a chunk, the sniff sample and one batch of parsed rows at a time,
+but the store itself grows with the number of rows (compactly, as columns of numbers and codes
+into string pools).
+"""
+INGEST_CHUNK_SIZE = 64 * 1024
+FORMAT_SNIFF_SIZE = 2000
+
+
+# Utility functions
+# CSV format registry
+"""
+Each supported bank export is declared as a CsvFormat: which column holds each field, the
+date formats to try, how many columns a transaction row has, which fields must be present and
+how to recognize the format from the first characters of a file. Formats are compiled once
+into a row converter with the column indexes bound and a per-format date cache, so adding a
+bank means registering a new CsvFormat rather than touching the parsing loop.
+
+Formats are tried in registration order when sniffing; DEFAULT_CSV_FORMAT is used when none
+matches.
+"""
+DEFAULT_CSV_FORMAT = "simple"
+# Bound on the distinct date strings cached per format
+DATE_CACHE_SIZE = 65536
+
+
+def compile_date_format(date_format: str) -> Callable[[str], Optional[int]]:
+    """
+    Build a parser from date text to an epoch day (None if the text does not match).
+    
+    Numeric formats made of %Y, %m and %d joined by one separator (e.g. %m/%d/%Y) get a fast
+    path that splits the text instead of calling strptime; anything the fast path cannot
+    decide, such as padded or out-of-range values, falls back to strptime, so results are
+    the same as strptime's.
+    """
+    def parse_with_strptime(text: str) -> Optional[int]:
+        try:
+            return to_epoch_day(datetime.strptime(text, date_format))
+        except ValueError:
+            return None
+    
+    pattern = re.fullmatch(r"%([Ymd])([^%\w])%([Ymd])\2%([Ymd])", date_format)
+    if pattern is None or len(set(pattern.group(1, 3, 4))) != 3:
+        return parse_with_strptime
+    
+    separator = pattern.group(2)
+    fields = pattern.group(1, 3, 4)
+    year_index, month_index, day_index = (fields.index(field) for field in "Ymd")
+    
+    def parse(text: str) -> Optional[int]:
+        parts = text.split(separator)
+        if len(parts) == 3 and all(part.isascii() and part.isdigit() for part in parts):
+            year, month, day = parts[year_index], parts[month_index], parts[day_index]
+            if len(year) == 4 and len(month) <= 2 and len(day) <= 2:
+                try:
+                    return datetime(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL
+                except ValueError:
+                    pass
+        return parse_with_strptime(text)
+    
+    return parse
+
+
+class CsvFormat:
+    """
+    Declarative description of a CSV export.
+    
+    `columns` maps the TransactionRow fields to column indexes (negative indexes count from
+    the end). Rows shorter than `min_columns`, with an empty `required` field, or whose field
+    holds one of `skip_values[field]` (e.g. repeated headers) are skipped. Amount columns
+    beyond the end of a row read as empty, and empty amounts are 0.0. Dates that match none
+    of `date_formats` are kept as raw text.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        columns: Dict[str, int],
+        date_formats: Tuple[str, ...],
+        min_columns: int,
+        required: Tuple[str, ...] = ("date",),
+        skip_values: Optional[Dict[str, Tuple[str, ...]]] = None,
+        detect_markers: Tuple[str, ...] = (),
+        detect_pattern: Optional[str] = None
+    ):
+        self.name = name
+        self.columns = columns
+        self.date_formats = date_formats
+        self.min_columns = min_columns
+        self.required = required
+        self.skip_values = skip_values or {}
+        self.detect_markers = detect_markers
+        self.detect_pattern = re.compile(detect_pattern, re.MULTILINE) if detect_pattern else None
+    
+    def detect(self, sample: str) -> bool:
+        """Whether a sample of the start of a file looks like this format."""
+        if any(marker in sample for marker in self.detect_markers):
+            return True
+        return bool(self.detect_pattern and self.detect_pattern.search(sample))
+    
+    def date_parser(self) -> Callable[[str], Union[int, str]]:
+        """
+        A memoized parser from date text to an epoch day, or the text itself if unparseable.
+        Exports repeat a few hundred dates over many rows, so most rows are cache hits.
+        """
+        parsers = [compile_date_format(date_format) for date_format in self.date_formats]
+        
+        @lru_cache(maxsize=DATE_CACHE_SIZE)
+        def parse_date(text: str) -> Union[int, str]:
+            for parser in parsers:
+                day = parser(text)
+                if day is not None:
+                    return day
+            return text
+        
+        return parse_date
+    
+    def compile(self) -> Callable[[List[str]], Optional[TransactionRow]]:
+        """Build the row converter for this format."""
+        columns = self.columns
+        date_index = columns["date"]
+        description_index = columns["description"]
+        amount_indexes = tuple(columns.get(field) for field in ("debit", "credit", "balance"))
+        text_indexes = tuple(columns.get(field) for field in ("bank", "transaction_id"))
+        min_columns = self.min_columns
+        required = tuple(columns[field] for field in self.required)
+        skipped = tuple((columns[field], frozenset(values)) for field, values in self.skip_values.items())
+        parse_date = self.date_parser()
+        name = self.name
+        
+        def amount(row: List[str], index: Optional[int]) -> float:
+            if index is None or index >= len(row):
+                return 0.0
+            text = row[index].strip()
+            return float(text) if text else 0.0
+        
+        def convert(row: List[str]) -> Optional[TransactionRow]:
+            if len(row) < min_columns:
+                return None
+            for index in required:
+                if not row[index].strip():
+                    return None
+            for index, values in skipped:
+                if row[index].strip() in values:
+                    return None
+            
+            try:
+                debit, credit, balance = [amount(row, index) for index in amount_indexes]
+                bank, transaction_id = [None if index is None else row[index].strip() for index in text_indexes]
+                return TransactionRow(
+                    parse_date(row[date_index].strip()),
+                    row[description_index].strip(),
+                    debit,
+                    credit,
+                    balance,
+                    bank,
+                    transaction_id
+                )
+            except Exception as e:
+                log_event("row_parse_failed", logging.WARNING, csv_format=name, row=row, error=str(e))
+                return None
+        
+        return convert
+
+
+CSV_FORMATS: Dict[str, CsvFormat] = {}
+ROW_PARSERS: Dict[str, Callable[[List[str]], Optional[TransactionRow]]] = {}
+
+
+def register_csv_format(csv_format: CsvFormat) -> None:
+    """Add a format to the registry and compile its row converter."""
+    CSV_FORMATS[csv_format.name] = csv_format
+    ROW_PARSERS[csv_format.name] = csv_format.compile()
+
+
+register_csv_format(CsvFormat(
+    name="desjardins",
+    columns={"bank": 0, "date": 3, "transaction_id": 4, "description": 5, "debit": 7, "credit": 8, "balance": -1},
+    date_formats=("%Y/%m/%d",),
+    min_columns=8,
+    required=("date", "bank"),
+    skip_values={"date": ("PCA",)},
+    detect_markers=('"Desjardins Ontario"',)
+))
+
+register_csv_format(CsvFormat(
+    name="simple",
+    columns={"date": 0, "description": 1, "debit": 2, "credit": 3, "balance": 4},
+    date_formats=("%m/%d/%Y",),
+    min_columns=5,
+    detect_pattern=r"^\d{2}/\d{2}/\d{4}"
+))
+
+
+def sniff_csv_format(sample_content: str) -> str:
+    """
+    Detect the format of a CSV file from a sample of its first characters.
+    
+    Returns:
+        str: the name of the first registered format that recognizes the sample, or
+        DEFAULT_CSV_FORMAT
+    """
+    for csv_format in CSV_FORMATS.values():
+        if csv_format.detect(sample_content):
+            return csv_format.name
+    return DEFAULT_CSV_FORMAT
+
+
+def detect_csv_format(file_path: str) -> str:
+    """
+    Detect the format of the CSV file.
+    
+    Returns:
+        str: the name of the detected format (see sniff_csv_format)
+    """
+    with open(file_path, 'r', newline='', encoding='utf-8') as csv_file:
+        sample_content = csv_file.read(FORMAT_SNIFF_SIZE)  # Read first 2000 chars to detect format
+    
+    return sniff_csv_format(sample_content)
+
+
+def iter_csv_transactions(text_stream) -> Tuple[str, Iterator[TransactionRow]]:
+    """
+    Sniff the format of a text stream and return a generator over its transactions.
+    
+    The stream is consumed lazily, one CSV record at a time, so only the sniff sample and
+    the current record are held in memory.
+    
+    Returns:
+        Tuple containing:
+        - Name of the detected CSV format
+        - Generator of parsed transaction rows
+    """
+    with StageTimer("detect"):
+        sample = text_stream.read(FORMAT_SNIFF_SIZE)
+        csv_format = sniff_csv_format(sample)
+    
+    # Finish the current line so the sample can be replayed through the CSV reader
+    sample += text_stream.readline()
+    lines = itertools.chain(io.StringIO(sample, newline=''), text_stream)
+    
+    parse_row = ROW_PARSERS[csv_format]
+    
+    def generate() -> Iterator[TransactionRow]:
+        for row in csv.reader(lines, quotechar='"', delimiter=','):
+            transaction = parse_row(row)
+            if transaction is not None:
+                yield transaction
+    
+    return csv_format, generate()
+
+
+class TeeReader(io.RawIOBase):
+    """Raw byte stream that copies everything read from `source` into `sink`."""
+    
+    def __init__(self, source, sink=None):
+        self._source = source
+        self._sink = sink
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer) -> int:
+        data = self._source.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        if self._sink is not None and size:
+            self._sink.write(data)
+        return size
+
+
+def open_text_stream(byte_stream, sink=None) -> io.TextIOWrapper:
+    """Wrap a binary upload stream as UTF-8 text, optionally teeing the raw bytes to `sink`."""
+    buffered = io.BufferedReader(TeeReader(byte_stream, sink), buffer_size=INGEST_CHUNK_SIZE)
+    return io.TextIOWrapper(buffered, encoding='utf-8', newline='')
+
+
+def parse_csv_file(file_path: str) -> Tuple[TransactionStore, str]:
+    """
+    Parse a CSV file into a columnar transaction store, handling different formats.
+    
+    Returns:
+        Tuple containing:
+        - TransactionStore holding the parsed rows
+        - Name of the detected CSV format
+    """
+    transactions = TransactionStore()
+    
+    with StageTimer("parse") as timer, open(file_path, 'r', newline='', encoding='utf-8') as csv_file:
+        csv_format, rows = iter_csv_transactions(csv_file)
+        transactions.extend(rows)
+        timer.rows = len(transactions)
+    
+    log_event("csv_parsed", path=file_path, csv_format=csv_format, rows=len(transactions), seconds=round(timer.seconds, 4))
+    
+    return transactions, csv_format
+
+
+def transaction_month(date_string: Any) -> Optional[str]:
+    """Extract the YYYY-MM month key used by the monthly summary, or None if unknown."""
+    month = None
+    
+    # Try to extract month from ISO format date
+    if isinstance(date_string, str) and "T" in date_string:
+        month = date_string[:7]  # Extract YYYY-MM from ISO format
+    
+    # If we couldn't extract month in standard way, try alternative formats
+    if not month:
+        if isinstance(date_string, str) and "/" in date_string:
+            # Try parsing as YYYY/MM/DD
+            parts = date_string.split('/')
+            if len(parts) == 3:
+                month = f"{parts[0]}-{parts[1]}"
+    
+    return month
+
+
+def top_k_indices(values: np.ndarray, k: int) -> np.ndarray:
+    """
+    Return the positions of the k largest values, largest first.
+    
+    Uses partial selection (argpartition) so the cost is O(n) rather than a full sort;
+    ties keep the earlier position, matching a stable descending sort.
+    """
+    n = len(values)
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if n > k:
+        threshold = values[np.argpartition(values, n - k)[n - k]]
+        above = np.flatnonzero(values > threshold)
+        ties = np.flatnonzero(values == threshold)[:k - len(above)]
+        candidates = np.concatenate((above, ties))
+    else:
+        candidates = np.arange(n)
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+
+class TransactionSummaryBuilder:
+    """
+    Vectorized summary engine over ranges of rows of a TransactionStore.
+    
+    Each call to add_rows makes one pass over the column slices with NumPy: totals via a
+    sequential cumulative sum (bit-identical to Python's sum), the monthly group-by and
+    description counts via bincount, and the largest credits/debits via partial selection.
+    State is O(months + unique descriptions).
+    """
+    
+    TOP_DESCRIPTIONS = 10
+    TOP_TRANSACTIONS = 5
+    
+    def __init__(self):
+        self.total_transactions = 0
+        self.total_credits = 0
+        self.total_debits = 0
+        self.monthly_data = defaultdict(lambda: {"credits": 0, "debits": 0, "count": 0})
+        self.description_counts = np.zeros(0, dtype=np.int64)
+        # Per-category totals, indexed by category code
+        self.category_credits = np.zeros(0)
+        self.category_debits = np.zeros(0)
+        self.category_counts = np.zeros(0, dtype=np.int64)
+        # Per-file totals for sessions merged from several uploads, indexed by source code
+        self.source_credits = np.zeros(0)
+        self.source_debits = np.zeros(0)
+        self.source_counts = np.zeros(0, dtype=np.int64)
+        # Row indexes of the current largest credits/debits, in row order
+        self._largest_credits = np.zeros(0, dtype=np.int64)
+        self._largest_debits = np.zeros(0, dtype=np.int64)
+    
+    def _month_ids(self, store: TransactionStore, start: int, stop: int) -> Tuple[np.ndarray, List[str]]:
+        """Assign each row a month id (-1 when unknown) and return the ids' YYYY-MM keys."""
+        days = store.dates[start:stop]
+        texts = store.column("date_text")[start:stop]
+        month_keys: List[str] = []
+        key_ids: Dict[str, int] = {}
+        
+        def key_id(month: Optional[str]) -> int:
+            if not month:
+                return -1
+            if month not in key_ids:
+                key_ids[month] = len(month_keys)
+                month_keys.append(month)
+            return key_ids[month]
+        
+        ids = np.full(stop - start, -1, dtype=np.int64)
+        
+        typed = texts == TransactionStore.ABSENT
+        months = days[typed].astype("datetime64[D]").astype("datetime64[M]")
+        unique_months, inverse = np.unique(months, return_inverse=True)
+        lookup = np.array([key_id(str(month)) for month in unique_months], dtype=np.int64)
+        ids[typed] = lookup[inverse.ravel()]
+        
+        if not typed.all():
+            raw = ~typed
+            pool = store.pools["date_text"]
+            unique_texts, inverse = np.unique(texts[raw], return_inverse=True)
+            lookup = np.array([key_id(transaction_month(pool[code])) for code in unique_texts.tolist()], dtype=np.int64)
+            ids[raw] = lookup[inverse.ravel()]
+        
+        return ids, month_keys
+    
+    def _merge_largest(self, current: np.ndarray, amounts: np.ndarray, start: int) -> np.ndarray:
+        """Merge the top rows of a new slice into the current top rows."""
+        candidates = np.concatenate((current, top_k_indices(amounts[start:], self.TOP_TRANSACTIONS) + start))
+        candidates.sort()
+        return np.sort(candidates[top_k_indices(amounts[candidates], self.TOP_TRANSACTIONS)])
+    
+    @staticmethod
+    def _add_group_totals(totals: Tuple[np.ndarray, np.ndarray, np.ndarray], codes: np.ndarray, credits: np.ndarray,
+                          debits: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Fold rows into per-code (credits, debits, counts) totals, skipping rows without a code.
+        The running totals are seeded in like the monthly ones.
+        """
+        group_credits, group_debits, group_counts = totals
+        present = codes != TransactionStore.ABSENT
+        groups = np.concatenate((np.arange(len(group_counts)), codes[present]))
+        counts = np.bincount(codes[present], minlength=size)
+        counts[:len(group_counts)] += group_counts
+        return (
+            np.bincount(groups, weights=np.concatenate((group_credits, credits[present])), minlength=size),
+            np.bincount(groups, weights=np.concatenate((group_debits, debits[present])), minlength=size),
+            counts,
+        )
+    
+    def add_rows(self, store: TransactionStore, start: int, stop: int) -> None:
+        """Fold rows [start, stop) of `store` into the summary."""
+        if stop <= start:
+            return
+        credits = store.credit[start:stop]
+        debits = store.debit[start:stop]
+        
+        # Totals: cumsum accumulates left to right, seeded with the running total
+        self.total_credits = np.cumsum(np.concatenate(([self.total_credits], credits)))[-1].item()
+        self.total_debits = np.cumsum(np.concatenate(([self.total_debits], debits)))[-1].item()
+        
+        # Monthly group-by; bincount adds in row order, so each month's running total is
+        # prepended as a seed row to keep the sums identical to a sequential loop
+        ids, month_keys = self._month_ids(store, start, stop)
+        known = ids >= 0
+        previous = [self.monthly_data.get(month, {"credits": 0, "debits": 0}) for month in month_keys]
+        groups = np.concatenate((np.arange(len(month_keys)), ids[known]))
+        monthly_credits = np.bincount(groups, weights=np.concatenate(([p["credits"] for p in previous], credits[known])), minlength=len(month_keys)).tolist()
+        monthly_debits = np.bincount(groups, weights=np.concatenate(([p["debits"] for p in previous], debits[known])), minlength=len(month_keys)).tolist()
+        monthly_counts = np.bincount(ids[known], minlength=len(month_keys)).tolist()
+        for month, credit, debit, count in zip(month_keys, monthly_credits, monthly_debits, monthly_counts):
+            if count:
+                data = self.monthly_data[month]
+                data["credits"] = credit
+                data["debits"] = debit
+                data["count"] += count
+        
+        # Description counts, indexed by dictionary code
+        counts = np.bincount(store.column("description")[start:stop], minlength=len(store.pools["description"]))
+        counts[:len(self.description_counts)] += self.description_counts
+        self.description_counts = counts
+        
+        # Category and source totals
+        self.category_credits, self.category_debits, self.category_counts = self._add_group_totals(
+            (self.category_credits, self.category_debits, self.category_counts),
+            store.column("category")[start:stop], credits, debits, len(store.pools["category"])
+        )
+        self.source_credits, self.source_debits, self.source_counts = self._add_group_totals(
+            (self.source_credits, self.source_debits, self.source_counts),
+            store.column("source")[start:stop], credits, debits, len(store.pools["source"])
+        )
+        
+        # Largest transactions by partial selection
+        self._largest_credits = self._merge_largest(self._largest_credits, store.credit[:stop], start)
+        self._largest_debits = self._merge_largest(self._largest_debits, store.debit[:stop], start)
+        
+        self.total_transactions += stop - start
+    
+    def build(self, store: TransactionStore) -> Dict[str, Any]:
+        """Return the summary in the shape produced by create_transaction_summary."""
+        if not self.total_transactions:
+            return {}
+        
+        # Convert to regular dict
+        monthly_summary = {
+            month: {
+                "credits": data["credits"],
+                "debits": data["debits"],
+                "net": data["credits"] - data["debits"],
+                "count": data["count"]
+            }
+            for month, data in sorted(self.monthly_data.items())
+        }
+        
+        # Most common descriptions; codes are in first-seen order, so ties keep that order
+        descriptions = store.pools["description"]
+        common_descriptions = [
+            {"description": descriptions[code], "count": int(self.description_counts[code])}
+            for code in top_k_indices(self.description_counts, self.TOP_DESCRIPTIONS).tolist()
+        ]
+        
+        # Largest transactions, materialized only for the selected rows
+        largest_credits = store.rows(self._largest_credits[top_k_indices(store.credit[self._largest_credits], self.TOP_TRANSACTIONS)])
+        largest_debits = store.rows(self._largest_debits[top_k_indices(store.debit[self._largest_debits], self.TOP_TRANSACTIONS)])
+        
+        first_date, = store.date_strings(0, 1)
+        last_date, = store.date_strings(len(store) - 1, len(store))
+        
+        summary = {
+            "total_transactions": self.total_transactions,
+            "total_credits": self.total_credits,
+            "total_debits": self.total_debits,
+            "net_change": self.total_credits - self.total_debits,
+            "date_range": {
+                "start": first_date,
+                "end": last_date
+            },
+            "monthly_summary": monthly_summary,
+            "common_descriptions": common_descriptions,
+            "largest_credits": largest_credits,
+            "largest_debits": largest_debits
+        }
+        
+        # Per-file totals for sessions merged from several uploads
+        if self.source_counts.any():
+            pool = store.pools["source"]
+            credits, debits, counts = self.source_credits.tolist(), self.source_debits.tolist(), self.source_counts.tolist()
+            summary["sources"] = {
+                pool[code]: {"credits": credits[code], "debits": debits[code], "net": credits[code] - debits[code], "count": counts[code]}
+                for code in range(len(counts)) if counts[code]
+            }
+        
+        # Per-category totals, largest spending first
+        if self.category_counts.any():
+            pool = store.pools["category"]
+            credits, debits, counts = self.category_credits.tolist(), self.category_debits.tolist(), self.category_counts.tolist()
+            summary["categories"] = {
+                pool[code]: {"credits": credits[code], "debits": debits[code], "net": credits[code] - debits[code], "count": counts[code]}
+                for code in sorted(range(len(counts)), key=lambda code: -debits[code]) if counts[code]
+            }
+        
+        return summary
+
+
+def create_transaction_summary(transactions: TransactionStore) -> Dict[str, Any]:
+    """Create a summary of the transaction data."""
+    builder = TransactionSummaryBuilder()
+    builder.add_rows(transactions, 0, len(transactions))
+    return builder.build(transactions)
+
+
+# Transaction categories
+"""
+Every row gets a category at ingestion. The rules below are compiled into one regular
+expression, and each distinct description is classified once: results are memoized by
+description text for the whole process, and a store only classifies the distinct
+descriptions of the rows being added. The summary then carries per-category totals, so
+category questions are answered from it instead of from the raw descriptions.
+"""
+UNCATEGORIZED = "Other"
+CATEGORY_CACHE_SIZE = int(os.environ.get("CATEGORY_CACHE_SIZE", "65536"))
+# Keyword patterns matched against lowercased, accent-stripped descriptions (English and
+# French exports). Rules are tried in order, so a description matching several categories
+# gets the first one, e.g. "Interac e-Transfer fee" is a bank fee and "condo fees" housing.
+CATEGORY_RULES: List[Tuple[str, Tuple[str, ...]]] = [
+    ("Income", (r"\bpay ?roll\b", r"\bpaie\b", r"\bsalar(y|ies|e)\b", r"\bdirect deposit\b", r"\bdepot direct\b", r"\bpension\b", r"\btax refund\b", r"\bremboursement d'impot\b")),
+    ("Housing", (r"\brent\b", r"\bloyer\b", r"\bmortgage\b", r"\bhypotheque\b", r"\bcondo\b", r"\bproperty tax\b", r"\btaxes? municipales?\b")),
+    ("Bank fees", (r"\bfees?\b", r"\bfrais\b", r"\bservice charges?\b", r"\boverdraft\b", r"\bdecouvert\b", r"\bnsf\b", r"\binterest charges?\b", r"\binterets?\b")),
+    ("Transfers", (r"\btransfers?\b", r"\bvirements?\b", r"\btransferts?\b")),
+    ("Cash", (r"\batm\b", r"\bwithdrawals?\b", r"\bretraits?\b", r"\bguichet\b", r"\bcash\b")),
+    ("Groceries", (r"\bgrocer(y|ies)\b", r"\bepicerie\b", r"\bsupermarche?\b", r"\bsupermarket\b", r"\biga\b", r"\bmetro\b", r"\bprovigo\b", r"\bmaxi\b", r"\bloblaws\b", r"\bsuper c\b", r"\bcostco\b")),
+    ("Dining", (r"\brestaurants?\b", r"\bcafe\b", r"\bcoffee\b", r"\bstarbucks\b", r"\btim hortons\b", r"\bmcdonald", r"\bpizza\b", r"\bbistro\b", r"\buber eats\b", r"\bdoordash\b", r"\bskip ?the ?dishes\b")),
+    ("Transportation", (r"\bgas\b", r"\bessence\b", r"\bpetro", r"\bshell\b", r"\besso\b", r"\bultramar\b", r"\buber\b", r"\btaxi\b", r"\bstm\b", r"\bparking\b", r"\bstationnement\b", r"\btransit\b")),
+    ("Utilities & bills", (r"\bhydro\b", r"\belectric", r"\binternet\b", r"\bphone\b", r"\btelephone\b", r"\bvideotron\b", r"\bbell\b", r"\brogers\b", r"\bfido\b", r"\btelus\b", r"\bbill payment\b", r"\bpaiement de factures?\b")),
+    ("Health", (r"\bpharmac(y|ie)\b", r"\bjean coutu\b", r"\bpharmaprix\b", r"\bdent(al|ist|iste)\b", r"\bclini(c|que)\b", r"\bmedical\b")),
+    ("Subscriptions", (r"\bsubscriptions?\b", r"\babonnements?\b", r"\bnetflix\b", r"\bspotify\b", r"\bdisney\b", r"\bstreaming\b", r"\bgym\b")),
+    ("Insurance", (r"\binsurance\b", r"\bassurances?\b")),
+    ("Taxes & government", (r"\btax(es)?\b", r"\bimpots?\b", r"\brevenu quebec\b", r"\bcanada revenue\b")),
+    ("Shopping", (r"\bamazon\b", r"\bpurchase\b", r"\bachats?\b", r"\bstore\b", r"\bmagasin\b")),
+]
+
+
+def normalize_description(description: str) -> str:
+    """Casefold and strip accents, so "ÉPICERIE" and "epicerie" match the same rules."""
+    decomposed = unicodedata.normalize("NFKD", description.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def compile_category_rules(rules: List[Tuple[str, Tuple[str, ...]]]) -> re.Pattern:
+    """
+    Compile the rules into one pattern matched at the start of a description: alternative i
+    looks ahead for any keyword of rule i in a named group c<i>, so the first rule that
+    matches anywhere in the text wins and its group names it.
+    """
+    alternatives = [f"(?=.*?(?P<c{index}>{'|'.join(patterns)}))" for index, (_, patterns) in enumerate(rules)]
+    return re.compile("|".join(alternatives), re.DOTALL)
+
+
+CATEGORY_PATTERN = compile_category_rules(CATEGORY_RULES)
+CATEGORY_NAMES = tuple(name for name, _ in CATEGORY_RULES) + (UNCATEGORIZED,)
+
+
+@lru_cache(maxsize=CATEGORY_CACHE_SIZE)
+def categorize_description(description: str) -> str:
+    """Return the category of a description, or UNCATEGORIZED when no rule matches."""
+    match = CATEGORY_PATTERN.match(normalize_description(description))
+    if match is None:
+        return UNCATEGORIZED
+    return CATEGORY_RULES[int(match.lastgroup[1:])][0]
+
+
+def categorize_rows(store: TransactionStore, start: int = 0, stop: Optional[int] = None) -> None:
+    """Fill the category column of rows [start, stop) from their descriptions."""
+    store.derive_column("description", "category", categorize_description, start, stop)
+
+
+def ensure_categories(store: TransactionStore) -> bool:
+    """Categorize the rows of a store saved before categories existed; True if any were missing."""
+    missing = np.flatnonzero(store.column("category") == TransactionStore.ABSENT)
+    if not len(missing):
+        return False
+    categorize_rows(store, int(missing[0]))
+    return True
+
+
+# Transaction insights
+"""
+InsightDetector makes one pass over the rows as they are ingested, keeping O(1) state per
+description and direction (debit or credit): a running mean and variance (Welford) of the
+amounts, to flag amounts far from that description's earlier ones; the same for the days
+between occurrences, to recognise recurring payments; and the last row per description and
+amount, to spot the same charge repeated within DUPLICATE_WINDOW_DAYS. Gaps are measured
+between consecutive occurrences, so rows are expected in date order (in either direction).
+The last charges are kept per description and amount, so they are dropped once they fall
+outside the duplicate window of the row being scanned.
+"""
+OUTLIER_Z_SCORE = float(os.environ.get("OUTLIER_Z_SCORE", "3.5"))
+# Earlier occurrences of a description needed before one of its amounts can be an outlier
+OUTLIER_MIN_HISTORY = 5
+# Spread assumed for descriptions with near-constant amounts, as a fraction of their mean
+OUTLIER_MIN_SPREAD = 0.05
+RECURRING_MIN_OCCURRENCES = 3
+# Cadence -> typical days between occurrences
+RECURRING_CADENCES = {"weekly": 7.0, "biweekly": 14.0, "monthly": 30.44, "quarterly": 91.31, "yearly": 365.25}
+DUPLICATE_WINDOW_DAYS = int(os.environ.get("DUPLICATE_WINDOW_DAYS", "1"))
+# Entries kept in each list of the insights; the counts cover every detection
+INSIGHT_LIST_SIZE = 20
+# Last charges kept before the ones outside the duplicate window are dropped
+CHARGE_PRUNE_MIN = 1024
+
+
+def keep_largest(heap: List[Tuple], item: Tuple, size: int = INSIGHT_LIST_SIZE) -> None:
+    """Push onto a min-heap holding the `size` largest items seen."""
+    if len(heap) < size:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+class InsightDetector:
+    """
+    Single-pass detector of unusual amounts, recurring payments and duplicate charges.
+    
+    State is indexed by description code * 2 + direction (0 for debits, 1 for credits), so it
+    is tied to the store it reads, like TransactionSummaryBuilder.
+    """
+    
+    def __init__(self):
+        self.rows = 0
+        self._amount_count: List[int] = []
+        self._amount_mean: List[float] = []
+        self._amount_m2: List[float] = []
+        self._gap_count: List[int] = []
+        self._gap_mean: List[float] = []
+        self._gap_m2: List[float] = []
+        self._last_day: List[Optional[int]] = []
+        self._latest_day: List[Optional[int]] = []
+        # (key, amount in cents) -> (row, day) of the last debit with that description and amount
+        self._last_charge: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        self._prune_at = CHARGE_PRUNE_MIN
+        self.outlier_count = 0
+        self.duplicate_count = 0
+        self._outliers: List[Tuple[float, int, float]] = []  # (score, row, expected amount)
+        self._duplicates: List[Tuple[float, int, int]] = []  # (amount, earlier row, row)
+    
+    def _grow(self, size: int) -> None:
+        missing = size - len(self._amount_count)
+        if missing <= 0:
+            return
+        for values, initial in ((self._amount_count, 0), (self._amount_mean, 0.0), (self._amount_m2, 0.0),
+                                (self._gap_count, 0), (self._gap_mean, 0.0), (self._gap_m2, 0.0),
+                                (self._last_day, None), (self._latest_day, None)):
+            values.extend([initial] * missing)
+    
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held: 8 list slots per key and about 240 bytes per last charge."""
+        return 8 * 24 * len(self._amount_count) + 240 * len(self._last_charge)
+    
+    def _prune_charges(self, day: int) -> None:
+        """Drop the last charges too far from `day` to be repeated by a later row."""
+        last_charge = self._last_charge
+        for charge in [charge for charge, (_, seen) in last_charge.items() if abs(day - seen) > DUPLICATE_WINDOW_DAYS]:
+            del last_charge[charge]
+        self._prune_at = max(2 * len(last_charge), CHARGE_PRUNE_MIN)
+    
+    def add_rows(self, store: TransactionStore, start: int, stop: int) -> None:
+        """Scan rows [start, stop) of `store`, in order."""
+        if stop <= start:
+            return
+        self._grow(2 * len(store.pools["description"]))
+        amount_count, amount_mean, amount_m2 = self._amount_count, self._amount_mean, self._amount_m2
+        gap_count, gap_mean, gap_m2 = self._gap_count, self._gap_mean, self._gap_m2
+        last_day, latest_day, last_charge = self._last_day, self._latest_day, self._last_charge
+        no_date = TransactionStore.NO_DATE
+        
+        columns = (
+            store.column("description")[start:stop].tolist(),
+            store.debit[start:stop].tolist(),
+            store.credit[start:stop].tolist(),
+            store.dates[start:stop].tolist(),
+        )
+        for row, code, debit, credit, day in zip(range(start, stop), *columns):
+            if debit:
+                key, amount = 2 * code, debit
+            elif credit:
+                key, amount = 2 * code + 1, credit
+            else:
+                continue
+            
+            # Amount against the earlier amounts of the same description
+            count = amount_count[key]
+            mean = amount_mean[key]
+            if count >= OUTLIER_MIN_HISTORY:
+                spread = max((amount_m2[key] / (count - 1)) ** 0.5, OUTLIER_MIN_SPREAD * abs(mean), 0.01)
+                score = abs(amount - mean) / spread
+                if score > OUTLIER_Z_SCORE:
+                    self.outlier_count += 1
+                    keep_largest(self._outliers, (score, row, mean))
+            count += 1
+            delta = amount - mean
+            mean += delta / count
+            amount_m2[key] += delta * (amount - mean)
+            amount_count[key] = count
+            amount_mean[key] = mean
+            
+            if day == no_date:
+                continue
+            
+            # Days since the previous occurrence
+            previous_day = last_day[key]
+            if previous_day is not None:
+                gap = abs(day - previous_day)
+                gaps = gap_count[key] + 1
+                delta = gap - gap_mean[key]
+                gap_mean[key] += delta / gaps
+                gap_m2[key] += delta * (gap - gap_mean[key])
+                gap_count[key] = gaps
+            last_day[key] = day
+            if latest_day[key] is None or day > latest_day[key]:
+                latest_day[key] = day
+            
+            # The same debit again within the window
+            if key % 2 == 0:
+                charge = (key, round(amount * 100))
+                previous = last_charge.get(charge)
+                if previous is not None and abs(day - previous[1]) <= DUPLICATE_WINDOW_DAYS:
+                    self.duplicate_count += 1
+                    keep_largest(self._duplicates, (amount, previous[0], row))
+                last_charge[charge] = (row, day)
+                if len(last_charge) > self._prune_at:
+                    self._prune_charges(day)
+        
+        self.rows += stop - start
+    
+    def _recurring(self, store: TransactionStore) -> List[Dict[str, Any]]:
+        descriptions = store.pools["description"]
+        recurring = []
+        for key, count in enumerate(self._amount_count):
+            gaps = self._gap_count[key]
+            if count < RECURRING_MIN_OCCURRENCES or gaps < RECURRING_MIN_OCCURRENCES - 1:
+                continue
+            gap_mean = self._gap_mean[key]
+            gap_spread = (self._gap_m2[key] / (gaps - 1)) ** 0.5
+            cadence = next((
+                name for name, days in RECURRING_CADENCES.items()
+                if abs(gap_mean - days) <= 0.15 * days and gap_spread <= max(0.2 * days, 2.0)
+            ), None)
+            if cadence is None:
+                continue
+            amount = self._amount_mean[key]
+            amount_spread = (self._amount_m2[key] / (count - 1)) ** 0.5
+            latest = self._latest_day[key]
+            recurring.append({
+                "description": descriptions[key // 2],
+                "kind": "credit" if key % 2 else "debit",
+                "cadence": cadence,
+                "occurrences": count,
+                "average_amount": round(amount, 2),
+                "amount_varies": amount_spread > 0.1 * abs(amount),
+                "last_date": period_label(latest, "day"),
+                "next_expected": period_label(latest + round(gap_mean), "day"),
+                "yearly_amount": round(amount * 365.25 / gap_mean, 2),
+            })
+        recurring.sort(key=lambda item: item["yearly_amount"], reverse=True)
+        return recurring
+    
+    def build(self, store: TransactionStore) -> Dict[str, Any]:
+        """Return the detections, most significant first."""
+        outliers = sorted(self._outliers, reverse=True)
+        outlier_rows = store.rows(np.array([row for _, row, _ in outliers], dtype=np.int64))
+        duplicates = sorted(self._duplicates, reverse=True)
+        duplicate_rows = store.rows(np.array([row for _, first, second in duplicates for row in (first, second)], dtype=np.int64))
+        recurring = self._recurring(store)
+        return {
+            "rows_scanned": self.rows,
+            "outlier_count": self.outlier_count,
+            "outliers": [
+                {**row, "expected_amount": round(expected, 2), "score": round(score, 1)}
+                for (score, _, expected), row in zip(outliers, outlier_rows)
+            ],
+            "recurring_count": len(recurring),
+            "recurring": recurring[:INSIGHT_LIST_SIZE],
+            "duplicate_count": self.duplicate_count,
+            "duplicates": [
+                {
+                    "description": duplicate_rows[2 * index]["description"],
+                    "amount": amount,
+                    "first_date": duplicate_rows[2 * index]["date"],
+                    "second_date": duplicate_rows[2 * index + 1]["date"],
+                }
+                for index, (amount, _, _) in enumerate(duplicates)
+            ],
+        }
+
+
+def detect_insights(store: TransactionStore) -> Tuple[Dict[str, Any], InsightDetector]:
+    """Scan a whole store, returning the insights and the detector to extend on append."""
+    detector = InsightDetector()
+    with StageTimer("insights", len(store)):
+        detector.add_rows(store, 0, len(store))
+    return detector.build(store), detector
+
+
+def session_insights(session: "Session") -> Dict[str, Any]:
+    """Return the session's insights, scanning the store when they are missing or stale."""
+    if session.insights_version != session.transactions.version:
+        session.insights, session.insight_detector = detect_insights(session.transactions)
+        session.insights_version = session.transactions.version
+    return session.insights
+
+
+def row_dedup_key(row: TransactionRow) -> Tuple:
+    """Key of a parsed row, matching TransactionStore.dedup_keys()."""
+    if row.transaction_id:
+        return ("id", row.transaction_id)
+    date = epoch_day_to_iso(row.date) if type(row.date) is int else row.date
+    return (date, row.description, row.debit, row.credit)
+
+
+def dedup_hash(key: Tuple) -> int:
+    """64-bit hash of a dedup key, the same in every process (unlike hash())."""
+    # Amounts compare equal as int or float, so they must hash the same too
+    text = repr(tuple(float(value) if type(value) is int else value for value in key))
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class DedupIndex:
+    """
+    Multiset of the dedup keys of a session's rows, kept as a sorted array of their 64-bit
+    hashes: 8 bytes per row instead of a tuple of Python objects.
+    """
+    
+    def __init__(self, hashes: np.ndarray):
+        self.hashes = np.sort(hashes)
+    
+    @classmethod
+    def from_store(cls, store: TransactionStore) -> "DedupIndex":
+        parts = [
+            np.fromiter((dedup_hash(key) for key in store.dedup_keys(start, min(start + TransactionStore.BATCH_SIZE, len(store)))), dtype=np.uint64)
+            for start in range(0, len(store), TransactionStore.BATCH_SIZE)
+        ]
+        return cls(np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint64))
+    
+    @property
+    def nbytes(self) -> int:
+        return self.hashes.nbytes
+    
+    def count(self, key_hash: int) -> int:
+        value = np.uint64(key_hash)
+        return int(np.searchsorted(self.hashes, value, side="right") - np.searchsorted(self.hashes, value, side="left"))
+    
+    def update(self, key_hashes: List[int]) -> None:
+        if key_hashes:
+            self.hashes = np.sort(np.concatenate((self.hashes, np.array(key_hashes, dtype=np.uint64))), kind="stable")
+
+
+class DuplicateFilter:
+    """
+    Drop parsed rows that already exist in a session.
+    
+    Keys are counted as a multiset, so a file that legitimately contains two identical rows
+    only loses as many of them as the session already holds. The index is only extended once
+    the upload has been fully consumed.
+    """
+    
+    def __init__(self, existing: DedupIndex):
+        self.existing = existing
+        self.matched: Counter = Counter()
+        self.added: List[int] = []
+        self.duplicates = 0
+    
+    def __call__(self, rows: Iterator[TransactionRow]) -> Iterator[TransactionRow]:
+        for row in rows:
+            key_hash = dedup_hash(row_dedup_key(row))
+            if self.matched[key_hash] < self.existing.count(key_hash):
+                self.matched[key_hash] += 1
+                self.duplicates += 1
+                continue
+            self.added.append(key_hash)
+            yield row
+    
+    def commit(self) -> None:
+        """Record the keys of the rows that were kept."""
+        self.existing.update(self.added)
+        self.added = []
+
+
+def ingest_rows(rows: Iterator[TransactionRow], transactions: TransactionStore, builder: "TransactionSummaryBuilder",
+                detector: Optional[InsightDetector] = None) -> None:
+    """
+    Append parsed rows to the store in batches, folding each batch into the summary builder
+    and, when given, the insight detector.
+    """
+    # Parsing happens lazily while batches are pulled, so each phase is timed per batch
+    timings = {"parse": 0.0, "store": 0.0, "categorize": 0.0, "summarize": 0.0, "insights": 0.0}
+    first = len(transactions)
+    batches = batched(rows, TransactionStore.BATCH_SIZE)
+    while True:
+        started = time.perf_counter()
+        batch = next(batches, None)
+        parsed = time.perf_counter()
+        if batch is None:
+            timings["parse"] += parsed - started
+            break
+        start = len(transactions)
+        transactions.append_batch(batch)
+        stored = time.perf_counter()
+        categorize_rows(transactions, start)
+        categorized = time.perf_counter()
+        builder.add_rows(transactions, start, len(transactions))
+        summarized = time.perf_counter()
+        if detector is not None:
+            detector.add_rows(transactions, start, len(transactions))
+        timings["parse"] += parsed - started
+        timings["store"] += stored - parsed
+        timings["categorize"] += categorized - stored
+        timings["summarize"] += summarized - categorized
+        timings["insights"] += time.perf_counter() - summarized
+    
+    added = len(transactions) - first
+    if detector is None:
+        del timings["insights"]
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, stage)
+        stage_rows.inc(added, stage)
+
+
+class IngestResult(NamedTuple):
+    transactions: TransactionStore
+    transaction_summary: Dict[str, Any]
+    csv_format: str
+    summary_builder: TransactionSummaryBuilder
+    insights: Dict[str, Any]
+    insight_detector: InsightDetector
+
+
+def ingest_csv_upload(byte_stream, session_path: str) -> IngestResult:
+    """
+    Parse an uploaded CSV in a single streaming pass.
+    
+    The raw bytes are written to transactions.csv as they are read, and each batch of parsed
+    rows is appended to the store and fed to the summary builder without re-reading the file.
+    The store is then saved to transactions.bin.
+    """
+    file_path = os.path.join(session_path, "transactions.csv")
+    
+    transactions = TransactionStore()
+    builder = TransactionSummaryBuilder()
+    detector = InsightDetector()
+    
+    with StageTimer("ingest") as timer:
+        with open(file_path, "wb") as raw_copy:
+            text_stream = open_text_stream(byte_stream, sink=raw_copy)
+            csv_format, rows = iter_csv_transactions(text_stream)
+            ingest_rows(rows, transactions, builder, detector)
+        
+        with StageTimer("persist", len(transactions)):
+            transactions.save(os.path.join(session_path, TRANSACTIONS_FILE))
+        with StageTimer("summary_build"):
+            transaction_summary = builder.build(transactions)
+            insights = detector.build(transactions)
+    
+    log_event("csv_ingested", csv_format=csv_format, rows=len(transactions), seconds=round(timer.seconds, 4))
+    return IngestResult(transactions, transaction_summary, csv_format, builder, insights, detector)
+
+
+class AppendResult(NamedTuple):
+    added_count: int
+    duplicate_count: int
+    csv_format: str
+
+
+def append_csv_upload(byte_stream, session: "Session", session_path: str) -> AppendResult:
+    """
+    Merge another statement into an existing session in O(new rows).
+    
+    Rows already present in the session are dropped, the rest are appended to the store, and
+    the session's summary builder is updated with only the new rows. Only the new file's rows
+    are buffered; existing rows are not parsed or summarized again, just rewritten to
+    transactions.bin column by column.
+    """
+    if session.summary_builder is None:
+        session.summary_builder = TransactionSummaryBuilder()
+        session.summary_builder.add_rows(session.transactions, 0, len(session.transactions))
+    if session.dedup_index is None:
+        session.dedup_index = DedupIndex.from_store(session.transactions)
+    if session.insight_detector is None or session.insight_detector.rows != len(session.transactions):
+        session.insights, session.insight_detector = detect_insights(session.transactions)
+    
+    file_path = os.path.join(session_path, f"append-{datetime.now():%Y%m%d%H%M%S%f}.csv")
+    duplicates = DuplicateFilter(session.dedup_index)
+    start = len(session.transactions)
+    
+    # Stage the new rows first so a decoding error leaves the session untouched
+    with open(file_path, "wb") as raw_copy:
+        text_stream = open_text_stream(byte_stream, sink=raw_copy)
+        csv_format, rows = iter_csv_transactions(text_stream)
+        new_rows = list(duplicates(rows))
+    
+    ingest_rows(iter(new_rows), session.transactions, session.summary_builder, session.insight_detector)
+    with StageTimer("persist", len(session.transactions)):
+        session.transactions.save(os.path.join(session_path, TRANSACTIONS_FILE))
+    
+    duplicates.commit()
+    with StageTimer("summary_build"):
+        session.transaction_summary = session.summary_builder.build(session.transactions)
+        session.insights = session.insight_detector.build(session.transactions)
+    session.summary_version = session.transactions.version
+    session.insights_version = session.transactions.version
+    session.data_version += 1
+    
+    added = len(session.transactions) - start
+    log_event("csv_appended", session_id=session.session_id, csv_format=csv_format, rows=added, duplicates=duplicates.duplicates)
+    
+    return AppendResult(added, duplicates.duplicates, csv_format)
+
+
+# Batch uploads
+"""
+/upload/batch creates one session from several statements: each file is copied to the
+session's sources/ directory, the files are parsed concurrently in the process pool with
+parse_csv_file, and the parsed stores are merged, sorted by date and tagged with the file they
+came from. The summary covers every file and adds per-file totals.
+"""
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get("BATCH_UPLOAD_MAX_FILES", "20"))
+BATCH_SOURCES_DIR = "sources"
+
+
+class BatchFileResult(BaseModel):
+    filename: str
+    csv_format: str
+    transaction_count: int
+
+
+class BatchUploadResponse(UploadResponse):
+    files: List[BatchFileResult]
+
+
+def save_batch_source(byte_stream, path: str) -> None:
+    """Copy one uploaded file to disk without holding it in memory."""
+    with open(path, "wb") as source_file:
+        shutil.copyfileobj(byte_stream, source_file, INGEST_CHUNK_SIZE)
+
+
+def merge_batch_upload(parsed: List[Tuple[TransactionStore, str]], filenames: List[str], session_path: str) -> IngestResult:
+    """Merge the stores parsed from a batch, sort them by date and summarize the result."""
+    with StageTimer("batch_merge") as timer:
+        merged = TransactionStore.concatenate([store for store, _ in parsed], sources=filenames)
+        # Stable sort by date, keeping each file's order within a day; unparsed dates go last
+        days = merged.dates
+        sort_keys = np.where(days == TransactionStore.NO_DATE, np.iinfo(np.int64).max, days)
+        transactions = merged.take(np.argsort(sort_keys, kind="stable"))
+        timer.rows = len(transactions)
+    
+    with StageTimer("categorize", len(transactions)):
+        categorize_rows(transactions)
+    builder = TransactionSummaryBuilder()
+    with StageTimer("summarize", len(transactions)):
+        builder.add_rows(transactions, 0, len(transactions))
+    with StageTimer("persist", len(transactions)):
+        transactions.save(os.path.join(session_path, TRANSACTIONS_FILE))
+    with StageTimer("summary_build"):
+        transaction_summary = builder.build(transactions)
+    insights, detector = detect_insights(transactions)
+    
+    formats = sorted({csv_format for _, csv_format in parsed})
+    log_event("batch_merged", files=len(parsed), rows=len(transactions), csv_formats=formats)
+    return IngestResult(transactions, transaction_summary, "+".join(formats), builder, insights, detector)
+
+
+# LLM context building
+"""
+Rather than pasting every transaction into the prompt as indented JSON, the build_context node
+sends compact pipe-separated tables: the pre-computed summary plus only the rows relevant to
+the query (matching dates and descriptions), capped at CONTEXT_TOKEN_BUDGET tokens.
+
+Prompts are laid out so providers can cache their start: the system prompt and a data section
+that depends only on the session's contents come first and are byte-identical from one question
+to the next, then the conversation so far, then the rows picked for this question and the
+question itself. Older turns are condensed once they exceed HISTORY_TOKEN_BUDGET tokens.
+"""
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "12000"))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "2000"))
+# Characters kept of each earlier question once the history is condensed
+HISTORY_NOTE_CHARS = 200
+# Rows rendered as indented JSON to estimate what the full-dump prompt would have cost
+LEGACY_ESTIMATE_SAMPLE = 200
+
+MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTH_NUMBERS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+# Abbreviations (and "may") are also ordinary words, so they only count as months after
+# in/during/of or before a year: "in may", "mar 2024", but not "May I see..."
+MONTH_ABBREVIATIONS = {name.lower() for name in calendar.month_abbr if name}
+MONTH_PATTERN = re.compile(
+    r"\b(?:(" + "|".join(sorted(set(MONTH_NUMBERS) - MONTH_ABBREVIATIONS, key=len, reverse=True))
+    + r")|(?:in|during|of)\s+(" + "|".join(sorted(MONTH_ABBREVIATIONS)) + r")|("
+    + "|".join(sorted(MONTH_ABBREVIATIONS)) + r")(?=\s+\d{4}))\b(?:\s+(\d{4}))?"
+)
+ISO_MONTH_PATTERN = re.compile(r"\b(\d{4})-(\d{2})\b")
+YEAR_PATTERN = re.compile(r"\b((?:19|20)\d{2})\b")
+RELATIVE_PERIOD_PATTERN = re.compile(r"\b(this|last) (month|year)\b")
+QUERY_WORD_PATTERN = re.compile(r"[a-z][a-z0-9&'-]{3,}")
+QUERY_STOPWORDS = {
+    "what", "which", "when", "where", "were", "have", "with", "from", "there", "these", "those",
+    "this", "that", "than", "them", "they", "your", "about", "much", "many", "most", "more", "some",
+    "does", "show", "tell", "list", "give", "total", "amount", "amounts", "transaction", "transactions",
+    "spend", "spent", "spending", "money", "month", "months", "monthly", "year", "years", "pattern",
+    "account", "balance", "over", "time", "each", "every", "highest", "lowest", "largest", "smallest",
+    "common", "types", "unusual", "large", "should", "aware", "breakdown", "income", "expenses",
+    "credits", "debits", "credit", "debit", "please", "could", "would", "what's", "whats", "here",
+    "into", "also", "only", "during", "between", "since", "until", "before", "after", "ever", "overall",
+    "biggest", "frequent", "summary", "totals", "category", "categories", "deposits", "withdrawals",
+    "last", "first", "recent", "latest", "least",
+}
+
+
+@lru_cache(maxsize=1)
+def get_token_encoding():
+    """Return the tiktoken encoding used to count prompt tokens, or None if unavailable."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count prompt tokens, falling back to the ~4 characters per token rule of thumb."""
+    encoding = get_token_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def format_amount(value: float) -> str:
+    return f"{value:.2f}" if value else ""
+
+
+def format_transaction_table(transactions: List[Dict[str, Any]]) -> str:
+    """Encode transactions as a pipe-separated table with one row per line."""
+    lines = ["date|description|debit|credit|balance"]
+    for t in transactions:
+        lines.append("|".join((
+            t["date"][:10] if t["date"][10:] == "T00:00:00" else t["date"],
+            t["description"].replace("|", "/"),
+            format_amount(t["debit"]),
+            format_amount(t["credit"]),
+            f"{t['balance']:.2f}",
+        )))
+    return "\n".join(lines)
+
+
+def format_summary_tables(summary: Dict[str, Any]) -> str:
+    """Encode the pre-computed summary as compact tables."""
+    if not summary:
+        return "No summary available."
+    
+    lines = [
+        f"total_transactions={summary['total_transactions']} total_credits={summary['total_credits']:.2f} "
+        f"total_debits={summary['total_debits']:.2f} net_change={summary['net_change']:.2f} "
+        f"date_range={summary['date_range']['start']}..{summary['date_range']['end']}",
+        "",
+        "Monthly summary:",
+        "month|credits|debits|net|count",
+    ]
+    for month, data in summary["monthly_summary"].items():
+        lines.append(f"{month}|{data['credits']:.2f}|{data['debits']:.2f}|{data['net']:.2f}|{data['count']}")
+    
+    if summary.get("categories"):
+        lines += ["", "Totals by category:", "category|credits|debits|net|count"]
+        for category, data in summary["categories"].items():
+            lines.append(f"{category}|{data['credits']:.2f}|{data['debits']:.2f}|{data['net']:.2f}|{data['count']}")
+    
+    lines += ["", "Most common descriptions:", "description|count"]
+    lines += [f"{d['description']}|{d['count']}" for d in summary["common_descriptions"]]
+    
+    lines += ["", "Largest credits:", format_transaction_table(summary["largest_credits"])]
+    lines += ["", "Largest debits:", format_transaction_table(summary["largest_debits"])]
+    return "\n".join(lines)
+
+
+def format_insight_tables(insights: Dict[str, Any]) -> str:
+    """Encode the detected outliers, recurring payments and duplicate charges as compact tables."""
+    lines = [
+        f"Unusual amounts ({insights['outlier_count']} found, compared with earlier transactions with the same description):",
+        "date|description|debit|credit|expected|score",
+    ]
+    for t in insights["outliers"]:
+        lines.append(f"{t['date'][:10]}|{t['description'].replace('|', '/')}|{format_amount(t['debit'])}|{format_amount(t['credit'])}|{t['expected_amount']:.2f}|{t['score']}")
+    
+    lines += ["", f"Recurring payments ({insights['recurring_count']} found):", "description|kind|cadence|occurrences|average_amount|last_date|next_expected"]
+    for r in insights["recurring"]:
+        lines.append(f"{r['description'].replace('|', '/')}|{r['kind']}|{r['cadence']}|{r['occurrences']}|{r['average_amount']:.2f}|{r['last_date']}|{r['next_expected']}")
+    
+    lines += ["", f"Possible duplicate charges ({insights['duplicate_count']} found):", "description|amount|first_date|second_date"]
+    for d in insights["duplicates"]:
+        lines.append(f"{d['description'].replace('|', '/')}|{d['amount']:.2f}|{d['first_date'][:10]}|{d['second_date'][:10]}")
+    return "\n".join(lines)
+
+
+def query_date_mask(store: TransactionStore, query: str) -> Optional[np.ndarray]:
+    """
+    Return a mask of the rows falling in the periods the query mentions (month names, YYYY-MM,
+    years, "this/last month/year"), or None if the query names no period.
+    """
+    text = query.lower()
+    periods: List[Tuple[Optional[int], Optional[int]]] = []  # (year, month), None = any
+    
+    for year, month in ISO_MONTH_PATTERN.findall(text):
+        periods.append((int(year), int(month)))
+    text = ISO_MONTH_PATTERN.sub(" ", text)
+    
+    for name, after_preposition, before_year, year in MONTH_PATTERN.findall(text):
+        periods.append((int(year) if year else None, MONTH_NUMBERS[name or after_preposition or before_year]))
+    text = MONTH_PATTERN.sub(" ", text)
+    
+    for year in YEAR_PATTERN.findall(text):
+        periods.append((int(year), None))
+    
+    days = store.dates
+    valid = days != TransactionStore.NO_DATE
+    if not valid.any():
+        return None
+    
+    months = np.where(valid, days, 0).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    years = months // 12 + 1970
+    month_numbers = months % 12 + 1
+    
+    relative = RELATIVE_PERIOD_PATTERN.findall(text)
+    if relative:
+        latest = int(months[valid].max())
+        for which, unit in relative:
+            if unit == "year":
+                periods.append((latest // 12 + 1970 - (which == "last"), None))
+            else:
+                month = latest - (which == "last")
+                periods.append((month // 12 + 1970, month % 12 + 1))
+    
+    if not periods:
+        return None
+    
+    mask = np.zeros(len(store), dtype=bool)
+    for year, month in periods:
+        selected = valid.copy()
+        if year is not None:
+            selected &= years == year
+        if month is not None:
+            selected &= month_numbers == month
+        mask |= selected
+    return mask
+
+
+def query_word_stem(word: str) -> str:
+    return word.rstrip("s") if len(word) > 4 else word
+
+
+QUERY_STOPWORD_STEMS = {query_word_stem(word) for word in QUERY_STOPWORDS} | set(MONTH_NUMBERS)
+
+
+def query_description_words(query: str) -> Set[str]:
+    """The significant words of a query: those that may name a merchant or description."""
+    return {query_word_stem(word) for word in QUERY_WORD_PATTERN.findall(query.lower())} - QUERY_STOPWORD_STEMS
+
+
+def query_description_mask(store: TransactionStore, query: str) -> Optional[np.ndarray]:
+    """
+    Return a mask of the rows whose description contains a significant word of the query,
+    or None if no description matches. Matching is done once per unique description.
+    """
+    words = query_description_words(query)
+    if not words:
+        return None
+    
+    matching = [
+        code for code, description in enumerate(store.pools["description"].values)
+        if any(word in description.lower() for word in words)
+    ]
+    if not matching:
+        return None
+    return np.isin(store.column("description"), matching)
+
+
+def estimate_legacy_prompt_tokens(store: TransactionStore, summary: Dict[str, Any]) -> int:
+    """Estimate the tokens of the old prompt that embedded every row as indented JSON."""
+    if not len(store):
+        return 0
+    sample_size = min(len(store), LEGACY_ESTIMATE_SAMPLE)
+    sample = store.rows(np.linspace(0, len(store) - 1, sample_size).astype(np.int64))
+    per_row = count_tokens(json.dumps(sample, indent=2)) / sample_size
+    return int(per_row * len(store)) + count_tokens(json.dumps(summary, indent=2))
+
+
+class AnalysisContext(NamedTuple):
+    text: str  # Session-stable part of the data, sent before the conversation
+    tokens: int  # Tokens of text and query_text together
+    selected_rows: int
+    matching_rows: int
+    query_text: str = ""  # Rows picked for this query, sent with the question
+
+
+def select_context_rows(store: TransactionStore, query: str) -> np.ndarray:
+    """Return the indexes of the rows relevant to the query (every row if nothing narrows it)."""
+    mask = np.ones(len(store), dtype=bool)
+    for query_mask in (query_date_mask(store, query), query_description_mask(store, query)):
+        if query_mask is not None:
+            mask &= query_mask
+    return np.flatnonzero(mask)
+
+
+def estimate_table_tokens(store: TransactionStore, indexes: np.ndarray) -> float:
+    """Estimate the tokens of the rows at `indexes` as a table, from the first 50 of them."""
+    if not len(indexes):
+        return 0.0
+    sample = format_transaction_table(store.rows(indexes[:50]))
+    per_row = max(count_tokens(sample) / min(len(indexes), 50), 1.0)
+    return per_row * len(indexes)
+
+
+def fit_context_rows(store: TransactionStore, indexes: np.ndarray, budget: int) -> Tuple[np.ndarray, str]:
+    """
+    Encode the rows at `indexes` as a table of at most `budget` tokens. When they do not all
+    fit, the rows with the largest amounts are kept, still in their original order.
+    """
+    if not len(indexes) or budget <= 0:
+        return indexes[:0], ""
+    # Estimate how many rows fit from a sample, then trim until the table is under budget
+    per_row = estimate_table_tokens(store, indexes) / len(indexes)
+    limit = min(len(indexes), int(budget / per_row))
+    if limit < len(indexes):
+        amounts = store.debit[indexes] + store.credit[indexes]
+        indexes = np.sort(indexes[top_k_indices(amounts, limit)]) if limit > 0 else indexes[:0]
+    while len(indexes):
+        rows_text = format_transaction_table(store.rows(indexes))
+        if count_tokens(rows_text) <= budget:
+            return indexes, rows_text
+        # Drop at least one row per pass, so a single row over budget ends the loop
+        keep = min(int(len(indexes) * 0.9), len(indexes) - 1)
+        indexes = np.sort(indexes[top_k_indices(store.debit[indexes] + store.credit[indexes], keep)])
+    return indexes, ""
+
+
+def build_prompt_prefix(store: TransactionStore, summary: Dict[str, Any], budget: int = CONTEXT_TOKEN_BUDGET,
+                        insights: Optional[Dict[str, Any]] = None) -> AnalysisContext:
+    """
+    Build the part of the data that only depends on the session's contents: the summary
+    tables and any insights, followed by every transaction when they all fit in the budget.
+    """
+    summary_text = format_summary_tables(summary)
+    if insights:
+        summary_text += f"\n\n{format_insight_tables(insights)}"
+    remaining = budget - count_tokens(summary_text)
+    
+    rows_text = ""
+    if len(store) and estimate_table_tokens(store, np.arange(len(store))) <= remaining:
+        rows_text = format_transaction_table(store.rows(slice(0, len(store))))
+        if count_tokens(rows_text) > remaining:
+            rows_text = ""
+    
+    text = f"Summary:\n{summary_text}"
+    if rows_text:
+        text += f"\n\nAll {len(store)} transactions:\n{rows_text}"
+    return AnalysisContext(text, count_tokens(text), len(store) if rows_text else 0, len(store))
+
+
+def session_prompt_prefix(store: TransactionStore, summary: Dict[str, Any], budget: int = CONTEXT_TOKEN_BUDGET,
+                          insights: Optional[Dict[str, Any]] = None) -> AnalysisContext:
+    """Return build_prompt_prefix for the store, built once per content and budget."""
+    key = f"{store.content_hash}:{budget}:{'insights' if insights else ''}"
+    cached = prompt_prefix_cache.get(key)
+    if cached is None:
+        cached = build_prompt_prefix(store, summary, budget, insights)._asdict()
+        prompt_prefix_cache.put(key, cached)
+    return AnalysisContext(**cached)
+
+
+def build_analysis_context(store: TransactionStore, summary: Dict[str, Any], query: str, budget: int = CONTEXT_TOKEN_BUDGET,
+                           indexes: Optional[np.ndarray] = None, insights: Optional[Dict[str, Any]] = None) -> AnalysisContext:
+    """
+    Build the data section of the prompt under a token budget.
+    
+    The session's prompt prefix (see build_prompt_prefix) comes first. Unless it already lists
+    every row, relevant rows (selected from the query unless `indexes` is given) follow in
+    chronological order in query_text; when they do not all fit, the rows with the largest
+    amounts are kept.
+    """
+    prefix = session_prompt_prefix(store, summary, budget, insights)
+    if prefix.selected_rows == len(store):
+        return prefix
+    
+    if indexes is None:
+        indexes = select_context_rows(store, query)
+    matching = len(indexes)
+    indexes, rows_text = fit_context_rows(store, indexes, budget - prefix.tokens)
+    
+    selected = len(indexes) if rows_text else 0
+    if not matching:
+        heading = "No transactions match the periods or descriptions in the query."
+    elif selected == len(store):
+        heading = f"All {selected} transactions:"
+    elif selected == matching:
+        heading = f"The {selected} transactions relevant to the query (out of {len(store)}):"
+    else:
+        heading = (f"{selected} of the {matching} transactions relevant to the query (largest amounts first "
+                   f"selected, shown by date; the summary covers all {len(store)}):")
+    
+    query_text = f"{heading}\n{rows_text}".rstrip()
+    return AnalysisContext(prefix.text, prefix.tokens + count_tokens(query_text), selected, matching, query_text)
+
+
+def compact_history(history: List[Dict[str, str]], budget: int = HISTORY_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    """
+    Fit the earlier messages of a conversation in about `budget` tokens. The latest messages
+    are kept verbatim; once they no longer fit, the older ones are replaced by a single note
+    listing the questions asked in them.
+    """
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for message in reversed(history):
+        tokens = count_tokens(message["content"])
+        if used + tokens > budget * 3 // 4:
+            break
+        kept.append(message)
+        used += tokens
+    else:
+        return history
+    kept.reverse()
+    
+    questions = [
+        message["content"][:HISTORY_NOTE_CHARS]
+        for message in history[:len(history) - len(kept)] if message["role"] == "user"
+    ]
+    # Drop the oldest questions until the note fits in what is left of the budget
+    while questions:
+        note = "Earlier in this conversation I asked:\n" + "\n".join(f"- {question}" for question in questions)
+        if count_tokens(note) <= budget - used:
+            return [{"role": "user", "content": note}] + kept
+        questions.pop(0)
+    return kept
+
+
+def history_messages(history: List[Dict[str, str]]) -> List[Any]:
+    """Turn {"role", "content"} messages into chat messages."""
+    return [
+        HumanMessage(content=message["content"]) if message["role"] == "user" else AIMessage(content=message["content"])
+        for message in history
+    ]
+
+
+# Map-reduce analysis
+"""
+When the rows relevant to a query would take far more than one prompt, trimming them to the
+largest amounts loses most of the data. Above MAP_REDUCE_TOKEN_THRESHOLD estimated tokens the
+rows are instead split at month boundaries into up to MAP_REDUCE_MAX_CHUNKS parts, each part
+is analyzed by its own LLM call (at most MAP_REDUCE_CONCURRENCY at a time), and a final call
+combines the partial answers with the summary.
+
+This is opt-in, since it multiplies the cost of a question: one that takes this path makes up
+to MAP_REDUCE_MAX_CHUNKS + 1 LLM calls (9 by default) instead of one, each with a prompt of up
+to CONTEXT_TOKEN_BUDGET tokens, so it uses up to that many times the input tokens and is
+billed accordingly. Set MAP_REDUCE_TOKEN_THRESHOLD (e.g. to 50000) to enable it; only queries
+selecting at least MAP_REDUCE_MIN_ROWS rows are split.
+"""
+# 0 (the default) disables map-reduce
+MAP_REDUCE_TOKEN_THRESHOLD = int(os.environ.get("MAP_REDUCE_TOKEN_THRESHOLD", "0"))
+MAP_REDUCE_MIN_ROWS = int(os.environ.get("MAP_REDUCE_MIN_ROWS", "5000"))
+MAP_REDUCE_MAX_CHUNKS = int(os.environ.get("MAP_REDUCE_MAX_CHUNKS", "8"))
+MAP_REDUCE_CONCURRENCY = int(os.environ.get("MAP_REDUCE_CONCURRENCY", "4"))
+
+
+def partition_context_rows(store: TransactionStore, indexes: np.ndarray, parts: int) -> List[np.ndarray]:
+    """
+    Split rows into at most `parts` date-ordered groups of similar size, cutting only between
+    months when the rows span several, otherwise between rows. Each group keeps store order.
+    """
+    ordered = indexes[np.argsort(store.dates[indexes], kind="stable")]
+    if parts <= 1 or len(ordered) <= 1:
+        return [np.sort(ordered)]
+    months = store.dates[ordered].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    boundaries = np.flatnonzero(np.diff(months)) + 1
+    if not len(boundaries):
+        boundaries = np.arange(1, len(ordered))
+    targets = np.arange(1, parts) * len(ordered) / parts
+    nearest = np.clip(np.searchsorted(boundaries, targets), 0, len(boundaries) - 1)
+    previous = np.clip(nearest - 1, 0, len(boundaries) - 1)
+    cuts = np.where(np.abs(boundaries[previous] - targets) <= np.abs(boundaries[nearest] - targets), boundaries[previous], boundaries[nearest])
+    return [np.sort(group) for group in np.split(ordered, np.unique(cuts)) if len(group)]
+
+
+def build_chunk_contexts(store: TransactionStore, indexes: np.ndarray, estimated_tokens: float, budget: int = CONTEXT_TOKEN_BUDGET) -> List[AnalysisContext]:
+    """Encode the relevant rows as one table per part, each under `budget` tokens."""
+    parts = min(MAP_REDUCE_MAX_CHUNKS, int(np.ceil(estimated_tokens / budget)))
+    groups = partition_context_rows(store, indexes, parts)
+    contexts = []
+    for number, group in enumerate(groups, 1):
+        selected, rows_text = fit_context_rows(store, group, budget - 100)
+        dates = store.dates[selected]
+        dated = dates[dates != TransactionStore.NO_DATE]
+        period = f"{period_label(int(dated.min()), 'day')} to {period_label(int(dated.max()), 'day')}" if len(dated) else "undated rows"
+        if len(selected) == len(group):
+            heading = f"Part {number} of {len(groups)} ({period}), all {len(group)} relevant transactions in this part:"
+        else:
+            heading = (f"Part {number} of {len(groups)} ({period}), {len(selected)} of the {len(group)} relevant transactions "
+                       f"in this part (largest amounts first selected, shown by date):")
+        text = f"{heading}\n{rows_text}".rstrip()
+        contexts.append(AnalysisContext(text, count_tokens(text), len(selected), len(group)))
+    return contexts
+
+
+# Local query engine
+"""
+Questions that are pure aggregations (totals, monthly breakdown, months with the highest
+expenses, largest or most common transactions, spending by category) are answered exactly from the store in
+milliseconds. The route node recognises them, or takes an explicit StructuredQuery, and only
+open-ended questions go on to the LLM.
+"""
+LOCAL_QUERY_OPS = ("totals", "monthly", "top_months", "largest", "common", "categories")
+# Words that signal the user wants interpretation rather than a number
+OPEN_ENDED_PATTERN = re.compile(
+    r"\b(why|should|recommend|advice|advise|suggest|explain|unusual|pattern|trend|compare|save|saving|budget|insight|analy[sz]e)\b"
+)
+LOCAL_QUERY_PATTERNS = [
+    ("top_months", re.compile(r"\bmonths?\b.*\b(highest|most|largest|biggest|lowest|least|smallest)\b.*\b(expenses?|spending|debits?|income|credits?|deposits?)\b")),
+    ("monthly", re.compile(r"\b(monthly|per month|by month|each month|month[- ]by[- ]month)\b.*\b(breakdown|summary|totals?|income|expenses?|credits?|debits?)\b|\bbreakdown\b.*\bmonth")),
+    ("largest", re.compile(r"\b(largest|biggest|top|highest)\b.*\b(transactions?|debits?|credits?|expenses?|deposits?|payments?|withdrawals?)\b")),
+    ("common", re.compile(r"\bmost (common|frequent)\b")),
+    ("totals", re.compile(r"\btotal\b.*\b(credits?|debits?|income|expenses?|spending|deposits?|withdrawals?)\b|\bcredits and debits\b")),
+]
+CATEGORY_BREAKDOWN_PATTERN = re.compile(r"\b(by|per|each) category\b|\bcategor(y|ies)\b.*\b(breakdown|totals?|spending|expenses?)\b")
+# Names a question can refer to a category by: the name itself and each part of "X & Y" names
+CATEGORY_QUERY_NAMES = {
+    alias: name for name in CATEGORY_NAMES
+    for alias in [name.lower()] + [part.strip() for part in name.lower().split("&") if "&" in name]
+}
+# Names too generic to mean the category unless the question says "category" ("total income",
+# "cash flow", "other fees" are not category questions)
+GENERIC_CATEGORY_NAMES = {"Income", "Cash", UNCATEGORIZED}
+
+
+def category_alternation(names: Iterator[str]) -> str:
+    return "|".join(re.escape(alias) for alias in sorted(names, key=len, reverse=True))
+
+
+# A category is only routed to when the question is phrased about it: "spend on groceries",
+# "dining expenses", "the housing category"
+CATEGORY_QUERY_PATTERN = re.compile(
+    r"\b(?:spen[dt]|spending|paid|pay|paying|expenses?|costs?)\s+(?:on|for)\s+(?:my\s+|the\s+)?(?P<spent>"
+    + category_alternation(alias for alias, name in CATEGORY_QUERY_NAMES.items() if name not in GENERIC_CATEGORY_NAMES)
+    + r")\b|\b(?P<named>"
+    + category_alternation(alias for alias, name in CATEGORY_QUERY_NAMES.items() if name not in GENERIC_CATEGORY_NAMES)
+    + r")\s+(?:spending|expenses?|costs?)\b|\b(?P<category>"
+    + category_alternation(CATEGORY_QUERY_NAMES)
+    + r")\s+category\b"
+)
+LOWEST_WORDS = re.compile(r"\b(lowest|least|smallest)\b")
+# An explicit count: "top 10", "10 largest debits", "3 months"
+QUERY_COUNT_PATTERN = re.compile(
+    r"\btop\s+(\d{1,3})\b|(?<![\d-])\b(\d{1,3})\s+(?:largest|biggest|highest|lowest|smallest|most|least|months?|"
+    r"transactions?|debits?|credits?|expenses?|deposits?|payments?|withdrawals?|descriptions?)\b"
+)
+# Most rows a routed question can ask for
+LOCAL_QUERY_MAX_LIMIT = 100
+CREDIT_WORDS = re.compile(r"\b(credits?|income|deposits?)\b")
+DEBIT_WORDS = re.compile(r"\b(debits?|expenses?|spending|payments?|withdrawals?)\b")
+
+
+def route_query(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Return a StructuredQuery (as a dict) for a question the local engine can answer exactly,
+    or None when the question should go to the LLM.
+    """
+    text = query.lower()
+    if OPEN_ENDED_PATTERN.search(text):
+        return None
+    
+    match = CATEGORY_QUERY_PATTERN.search(text)
+    category = CATEGORY_QUERY_NAMES[next(alias for alias in match.groups() if alias)] if match else None
+    if category is None and CATEGORY_BREAKDOWN_PATTERN.search(text):
+        return {"op": "categories", "kind": None, "limit": len(CATEGORY_NAMES), "category": None}
+    
+    # A question naming a description or merchant goes to the LLM, including one that matches
+    # no row ("spending at Costco" with no Costco rows must not be answered with every debit).
+    # Category names often appear in descriptions too, so a named category skips this check.
+    if category is None and query_description_words(query):
+        return None
+    
+    # Aggregations come first; a named category only narrows the rows they run over
+    for op, pattern in LOCAL_QUERY_PATTERNS:
+        if pattern.search(text):
+            credit, debit = bool(CREDIT_WORDS.search(text)), bool(DEBIT_WORDS.search(text))
+            kind = "credit" if credit and not debit else "debit" if debit and not credit else None
+            if op == "top_months" and kind is None:
+                kind = "debit"
+            count = QUERY_COUNT_PATTERN.search(text)
+            if count:
+                limit = min(max(int(count.group(1) or count.group(2)), 1), LOCAL_QUERY_MAX_LIMIT)
+            else:
+                limit = 3 if op == "top_months" else 10 if op == "common" else 5
+            spec = {"op": op, "kind": kind, "limit": limit}
+            if op == "top_months" and LOWEST_WORDS.search(text):
+                spec["order"] = "asc"
+            if category:
+                spec["category"] = category
+            return spec
+    if category:
+        return {"op": "categories", "kind": None, "limit": len(CATEGORY_NAMES), "category": category}
+    return None
+
+
+def local_query_mask(store: TransactionStore, spec: Dict[str, Any], query: str) -> Optional[np.ndarray]:
+    """Rows selected by the spec's date range, or by the periods named in the query text."""
+    if spec.get("start_date") or spec.get("end_date"):
+        days = store.dates
+        mask = days != TransactionStore.NO_DATE
+        if spec.get("start_date"):
+            mask &= days >= to_epoch_day(datetime.fromisoformat(spec["start_date"]))
+        if spec.get("end_date"):
+            mask &= days <= to_epoch_day(datetime.fromisoformat(spec["end_date"]))
+        return mask
+    return query_date_mask(store, query) if query else None
+
+
+def category_mask(store: TransactionStore, category: str) -> np.ndarray:
+    """Rows in the named category (case-insensitive)."""
+    codes = [code for code, name in enumerate(store.pools["category"].values) if name.lower() == category.lower()]
+    return np.isin(store.column("category"), codes)
+
+
+def monthly_totals(store: TransactionStore, indexes: np.ndarray) -> Dict[str, Dict[str, Any]]:
+    """Monthly credits/debits/net/count over the given rows (rows without a typed date are skipped)."""
+    indexes = indexes[store.dates[indexes] != TransactionStore.NO_DATE]
+    months, inverse = np.unique(store.dates[indexes].astype("datetime64[D]").astype("datetime64[M]"), return_inverse=True)
+    inverse = inverse.ravel()
+    credits = np.bincount(inverse, weights=store.credit[indexes], minlength=len(months)).tolist()
+    debits = np.bincount(inverse, weights=store.debit[indexes], minlength=len(months)).tolist()
+    counts = np.bincount(inverse, minlength=len(months)).tolist()
+    return {
+        str(month): {"credits": credit, "debits": debit, "net": credit - debit, "count": count}
+        for month, credit, debit, count in zip(months, credits, debits, counts)
+    }
+
+
+def category_totals(store: TransactionStore, indexes: np.ndarray) -> Dict[str, Dict[str, Any]]:
+    """Per-category credits/debits/net/count over the given rows, largest spending first."""
+    codes = store.column("category")[indexes]
+    categorized = codes != TransactionStore.ABSENT
+    indexes, codes = indexes[categorized], codes[categorized]
+    size = len(store.pools["category"])
+    credits = np.bincount(codes, weights=store.credit[indexes], minlength=size).tolist()
+    debits = np.bincount(codes, weights=store.debit[indexes], minlength=size).tolist()
+    counts = np.bincount(codes, minlength=size).tolist()
+    return {
+        store.pools["category"][code]: {"credits": credits[code], "debits": debits[code], "net": credits[code] - debits[code], "count": counts[code]}
+        for code in sorted(range(size), key=lambda code: -debits[code]) if counts[code]
+    }
+
+
+def format_money(value: float) -> str:
+    return f"${value:,.2f}"
+
+
+def markdown_cell(text: str) -> str:
+    """Escape a description for use inside a Markdown table cell."""
+    return " ".join(text.split()).replace("|", "\\|")
+
+
+def execute_local_query(store: TransactionStore, summary: Dict[str, Any], spec: Dict[str, Any], query: str = "") -> str:
+    """Run a structured query against the store and return a Markdown answer."""
+    op = spec["op"]
+    if op not in LOCAL_QUERY_OPS:
+        raise ValueError(f"Unknown structured query op '{op}', expected one of {', '.join(LOCAL_QUERY_OPS)}")
+    
+    mask = local_query_mask(store, spec, query)
+    period = " in the requested period" if mask is not None else ""
+    # Other ops run over the rows of the spec's category; "categories" reports on it directly
+    category = spec.get("category") if op != "categories" else None
+    if category:
+        mask = category_mask(store, category) if mask is None else mask & category_mask(store, category)
+    indexes = np.flatnonzero(mask) if mask is not None else np.arange(len(store))
+    if mask is None:
+        scope = "all transactions"
+    elif category:
+        scope = f"the {len(indexes)} {category} transactions{period}"
+    else:
+        scope = f"the {len(indexes)} transactions in the requested period"
+    if not len(indexes):
+        return f"No {category} transactions{period}." if category else "No transactions fall in the requested period."
+    
+    limit = max(int(spec.get("limit") or 5), 1)
+    kind = spec.get("kind")
+    
+    if op == "totals":
+        credits = float(store.credit[indexes].sum()) if mask is not None else summary["total_credits"]
+        debits = float(store.debit[indexes].sum()) if mask is not None else summary["total_debits"]
+        return (
+            f"Across {scope}:\n\n"
+            f"| | Amount |\n|---|---:|\n"
+            f"| Total credits (money in) | {format_money(credits)} |\n"
+            f"| Total debits (money out) | {format_money(debits)} |\n"
+            f"| Net change | {format_money(credits - debits)} |\n"
+            f"| Transactions | {len(indexes)} |"
+        )
+    
+    if op in ("monthly", "top_months"):
+        monthly = summary["monthly_summary"] if mask is None else monthly_totals(store, indexes)
+        rows = list(monthly.items())
+        if op == "top_months":
+            column = "credits" if kind == "credit" else "debits"
+            lowest = spec.get("order") == "asc"
+            rows = sorted(rows, key=lambda item: item[1][column], reverse=not lowest)[:limit]
+            heading = f"Months with the {'lowest' if lowest else 'highest'} {'income' if kind == 'credit' else 'expenses'} across {scope}:"
+        else:
+            heading = f"Monthly breakdown across {scope}:"
+        lines = [heading, "", "| Month | Credits | Debits | Net | Count |", "|---|---:|---:|---:|---:|"]
+        lines += [
+            f"| {month} | {format_money(data['credits'])} | {format_money(data['debits'])} | {format_money(data['net'])} | {data['count']} |"
+            for month, data in rows
+        ]
+        return "\n".join(lines)
+    
+    if op == "largest":
+        sections = []
+        for column, label in (("credit", "credits"), ("debit", "debits")):
+            if kind and kind != column:
+                continue
+            amounts = store.column(column)[indexes]
+            top = indexes[top_k_indices(amounts, limit)]
+            top = top[store.column(column)[top] > 0]
+            lines = [f"Largest {label} across {scope}:", "", "| Date | Description | Amount |", "|---|---|---:|"]
+            lines += [f"| {t['date'][:10]} | {markdown_cell(t['description'])} | {format_money(t[column])} |" for t in store.rows(top)]
+            sections.append("\n".join(lines) if len(top) else f"No {label} across {scope}.")
+        return "\n\n".join(sections)
+    
+    if op == "categories":
+        categories = summary.get("categories") if mask is None else None
+        if categories is None:
+            categories = category_totals(store, indexes)
+        requested = spec.get("category")
+        if requested:
+            name = next((name for name in categories if name.lower() == requested.lower()), None)
+            if name is None:
+                return f"No transactions in the {requested} category across {scope}."
+            data = categories[name]
+            # The scope counts every row of the period, not only this category's
+            heading = f"{name} across all transactions" if mask is None else f"{name}: {data['count']} of the {len(indexes)} transactions in the requested period"
+            return (
+                f"{heading}:\n\n"
+                f"| | Amount |\n|---|---:|\n"
+                f"| Debits (money out) | {format_money(data['debits'])} |\n"
+                f"| Credits (money in) | {format_money(data['credits'])} |\n"
+                f"| Net | {format_money(data['net'])} |\n"
+                f"| Transactions | {data['count']} |"
+            )
+        rows = list(categories.items())
+        if kind == "credit":
+            rows.sort(key=lambda item: item[1]["credits"], reverse=True)
+        lines = [f"Totals by category across {scope}:", "", "| Category | Credits | Debits | Net | Count |", "|---|---:|---:|---:|---:|"]
+        lines += [
+            f"| {category} | {format_money(data['credits'])} | {format_money(data['debits'])} | {format_money(data['net'])} | {data['count']} |"
+            for category, data in rows[:limit]
+        ]
+        return "\n".join(lines)
+    
+    # op == "common"
+    codes = store.column("description")[indexes]
+    counts = np.bincount(codes, minlength=len(store.pools["description"]))
+    top = top_k_indices(counts, limit)
+    top = top[counts[top] > 0]
+    lines = [f"Most common transactions across {scope}:", "", "| Description | Count |", "|---|---:|"]
+    lines += [f"| {markdown_cell(store.pools['description'][code])} | {counts[code]} |" for code in top.tolist()]
+    return "\n".join(lines)
+
+
+class QueryRouterStats:
+    """Counts how often questions are answered locally versus by the LLM."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.local = 0
+        self.llm = 0
+    
+    def record(self, route: str) -> None:
+        with self._lock:
+            if route == "local":
+                self.local += 1
+            else:
+                self.llm += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.local + self.llm
+            return {"local": self.local, "llm": self.llm, "local_rate": self.local / total if total else 0.0}
+
+
+query_router_stats = QueryRouterStats()
+
+
+# Transaction listing
+"""
+/transactions filters, pages and projects rows with vectorized masks over the columns and
+streams the result as JSON or NDJSON, encoding one batch of rows at a time instead of
+building the whole list and validating it through the response model.
+"""
+TRANSACTION_FIELDS = ("date", "description", "debit", "credit", "balance") + TransactionStore.EXTRA_FIELDS
+TRANSACTION_LISTING_FORMATS = ("json", "ndjson")
+transaction_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+class TransactionListing(NamedTuple):
+    indexes: np.ndarray  # Row indexes of the page, in store order
+    total: int  # Matching rows, ignoring pagination
+    next_cursor: Optional[str]  # Cursor of the following page, None on the last page
+
+
+def parse_listing_date(value: str, name: str) -> int:
+    try:
+        return to_epoch_day(datetime.fromisoformat(value))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a YYYY-MM-DD date")
+
+
+def transaction_filter_mask(
+    store: TransactionStore,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    kind: Optional[str] = None,
+    search: Optional[str] = None
+) -> Optional[np.ndarray]:
+    """Mask of the rows matching every given filter, or None when no filter is set."""
+    mask = None
+    
+    def narrow(condition: np.ndarray) -> None:
+        nonlocal mask
+        mask = condition if mask is None else mask & condition
+    
+    if start_date or end_date:
+        days = store.dates
+        narrow(days != TransactionStore.NO_DATE)
+        if start_date:
+            narrow(days >= parse_listing_date(start_date, "start_date"))
+        if end_date:
+            narrow(days <= parse_listing_date(end_date, "end_date"))
+    
+    if min_amount is not None or max_amount is not None:
+        amounts = np.abs(store.debit) + np.abs(store.credit)
+        if min_amount is not None:
+            narrow(amounts >= min_amount)
+        if max_amount is not None:
+            narrow(amounts <= max_amount)
+    
+    if kind == "credit":
+        narrow(store.credit > 0)
+    elif kind == "debit":
+        narrow(store.debit > 0)
+    elif kind is not None:
+        raise HTTPException(status_code=400, detail="kind must be 'credit' or 'debit'")
+    
+    if search:
+        # Match each distinct description once, then map the result onto the rows
+        needle = search.casefold()
+        pool = store.pools["description"]
+        matches = np.fromiter((needle in pool[code].casefold() for code in range(len(pool))), dtype=bool, count=len(pool))
+        narrow(matches[store.column("description")])
+    
+    return mask
+
+
+def paginate_transactions(store: TransactionStore, mask: Optional[np.ndarray], offset: int, limit: Optional[int], cursor: Optional[str]) -> TransactionListing:
+    """
+    Select a page of matching rows. A cursor is the row index to resume from, so following
+    cursors stays O(page) however deep the listing goes; `offset` skips matches after it.
+    """
+    start = 0
+    if cursor:
+        try:
+            start = int(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if not 0 <= start <= len(store):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    if mask is None:
+        total = len(store)
+        first = min(start + offset, len(store))
+        stop = len(store) if limit is None else min(first + limit, len(store))
+        indexes = np.arange(first, stop, dtype=np.int64)
+        next_row = stop
+    else:
+        total = int(np.count_nonzero(mask))
+        matching = np.flatnonzero(mask[start:]) + start
+        indexes = matching[offset:] if limit is None else matching[offset:offset + limit]
+        following = matching[offset + len(indexes):offset + len(indexes) + 1]
+        next_row = int(following[0]) if len(following) else len(store)
+    
+    next_cursor = str(next_row) if next_row < len(store) and limit is not None else None
+    return TransactionListing(indexes, total, next_cursor)
+
+
+def encode_transactions(store: TransactionStore, indexes: np.ndarray, fields: Optional[List[str]], output: str) -> Iterator[bytes]:
+    """Serialize rows one batch at a time, as a JSON array or as one JSON object per line."""
+    encode = transaction_json_encoder.encode
+    ndjson = output == "ndjson"
+    if not ndjson:
+        yield b"["
+    for batch_start in range(0, len(indexes), TransactionStore.BATCH_SIZE):
+        rows = store.rows(indexes[batch_start:batch_start + TransactionStore.BATCH_SIZE])
+        if fields is not None:
+            rows = [{field: row[field] for field in fields if field in row} for row in rows]
+        encoded = [encode(row) for row in rows]
+        if ndjson:
+            yield ("\n".join(encoded) + "\n").encode("utf-8")
+        else:
+            yield (("," if batch_start else "") + ",".join(encoded)).encode("utf-8")
+    if not ndjson:
+        yield b"]"
+
+
+# Time index
+"""
+Range and re-bucketed totals for /summary come from a per-session index: the typed dates
+sorted once, with prefix sums of credits and debits. A date range is two binary searches and
+a subtraction, and a period breakdown is one binary search per period boundary, so neither
+touches the rows themselves. Rows whose date could not be parsed are left out.
+"""
+# Period -> (NumPy datetime unit, periods per bucket, unit index of a bucket boundary mod step)
+TIME_GRANULARITIES = {
+    "day": ("D", 1, 0),
+    "week": ("D", 7, 4),  # Epoch day 4 (1970-01-05) is a Monday
+    "month": ("M", 1, 0),
+    "quarter": ("M", 3, 0),
+    "year": ("Y", 1, 0),
+}
+
+
+def period_label(day: int, granularity: str) -> str:
+    """Name of the period starting on epoch day `day`: 2024-03-04, 2024-W10, 2024-03, 2024-Q1 or 2024."""
+    value = datetime.fromordinal(day + EPOCH_ORDINAL)
+    if granularity == "day":
+        return value.strftime("%Y-%m-%d")
+    if granularity == "week":
+        year, week, _ = value.isocalendar()
+        return f"{year}-W{week:02d}"
+    if granularity == "month":
+        return value.strftime("%Y-%m")
+    if granularity == "quarter":
+        return f"{value.year}-Q{(value.month - 1) // 3 + 1}"
+    return str(value.year)
 
 
-# Utility functions
-def detect_csv_format(file_path: str) -> str:
-    """
-    Detect the format of the CSV file.
+class TimeIndex:
+    """Typed dates of a store in sorted order, with cumulative credits and debits."""
     
-    Returns:
-        str: 'simple' for basic format or 'desjardins' for Desjardins format
-    """
-    with open(file_path, 'r', newline='', encoding='utf-8') as csv_file:
-        sample_content = csv_file.read(2000)  # Read first 2000 chars to detect format
-        
-        # Check for Desjardins format (contains "Desjardins Ontario" in quotes)
-        if '"Desjardins Ontario"' in sample_content:
-            return 'desjardins'
-        
-        # Check if this might be the simple format (mm/dd/yyyy date pattern at start of lines)
-        if re.search(r'^\d{2}/\d{2}/\d{4}', sample_content, re.MULTILINE):
-            return 'simple'
+    def __init__(self, store: TransactionStore):
+        days = store.dates
+        typed = np.flatnonzero(days != TransactionStore.NO_DATE)
+        order = typed[np.argsort(days[typed], kind="stable")]
+        self.version = store.version
+        self.days = days[order]
+        # Entry i is the total of the first i rows in date order; counts are index differences
+        self.credits = np.concatenate(([0.0], np.cumsum(store.credit[order])))
+        self.debits = np.concatenate(([0.0], np.cumsum(store.debit[order])))
+        self.undated = len(store) - len(order)
+    
+    def bounds(self, start_day: Optional[int] = None, end_day: Optional[int] = None) -> Tuple[int, int]:
+        """Positions [lo, hi) of the rows dated within [start_day, end_day]."""
+        lo = 0 if start_day is None else int(np.searchsorted(self.days, start_day, side="left"))
+        hi = len(self.days) if end_day is None else int(np.searchsorted(self.days, end_day, side="right"))
+        return lo, max(lo, hi)
+    
+    def totals(self, lo: int, hi: int) -> Dict[str, Any]:
+        # Differences of running sums drift by a few ulps, so amounts are rounded to cents
+        credits = round(float(self.credits[hi] - self.credits[lo]), 2)
+        debits = round(float(self.debits[hi] - self.debits[lo]), 2)
+        return {"credits": credits, "debits": debits, "net": round(credits - debits, 2), "count": hi - lo}
+    
+    def period_starts(self, first_day: int, last_day: int, granularity: str) -> np.ndarray:
+        """Epoch days of the period boundaries covering [first_day, last_day], plus the end of the last one."""
+        unit, step, offset = TIME_GRANULARITIES[granularity]
+        first, last = np.array([first_day, last_day], dtype="datetime64[D]").astype(f"datetime64[{unit}]").astype(np.int64).tolist()
+        first -= (first - offset) % step
+        last -= (last - offset) % step
+        return np.arange(first, last + step + 1, step).astype(f"datetime64[{unit}]").astype("datetime64[D]").astype(np.int64)
+    
+    def summarize(self, start_day: Optional[int] = None, end_day: Optional[int] = None, granularity: Optional[str] = None) -> Dict[str, Any]:
+        """Totals of the rows dated within [start_day, end_day], broken down by period when `granularity` is set."""
+        lo, hi = self.bounds(start_day, end_day)
+        result = {
+            "start_date": period_label(int(self.days[lo]), "day") if hi > lo else None,
+            "end_date": period_label(int(self.days[hi - 1]), "day") if hi > lo else None,
+            "totals": self.totals(lo, hi),
+            "undated": self.undated,
+        }
+        if granularity is None:
+            return result
         
-        # Default to simple if we can't determine
-        return 'simple'
+        result["granularity"] = granularity
+        result["periods"] = []
+        if hi == lo:
+            return result
+        starts = self.period_starts(int(self.days[lo]), int(self.days[hi - 1]), granularity)
+        positions = np.clip(np.searchsorted(self.days, starts, side="left"), lo, hi).tolist()
+        starts = starts.tolist()
+        for index in range(len(starts) - 1):
+            if positions[index + 1] > positions[index]:
+                period = {
+                    "period": period_label(starts[index], granularity),
+                    "start": period_label(starts[index], "day"),
+                    "end": period_label(starts[index + 1] - 1, "day"),
+                }
+                period.update(self.totals(positions[index], positions[index + 1]))
+                result["periods"].append(period)
+        return result
 
 
-def parse_csv_file(file_path: str) -> Tuple[List[Dict[str, Any]], str]:
-    """
-    Parse a CSV file into a list of transaction dictionaries, handling different formats.
-    
-    Returns:
-        Tuple containing:
-        - List of transaction dictionaries
-        - CSV format string ('simple' or 'desjardins')
-    """
-    transactions = []
+def session_time_index(session: "Session") -> TimeIndex:
+    """Return the session's time index, rebuilding it when rows were added since it was built."""
+    index = session.time_index
+    if index is None or index.version != session.transactions.version:
+        with StageTimer("time_index", rows=len(session.transactions)):
+            index = TimeIndex(session.transactions)
+        session.time_index = index
+    return index
+
+
+# Summary cache
+"""
+Summaries computed inside the analysis graph are cached by TransactionStore.content_hash so a
+session whose stored summary is stale is only summarized once per content change.
+"""
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", "32"))
+
+
+class SummaryCache:
+    """Least-recently-used cache of transaction summaries keyed by content hash."""
     
-    # Detect the CSV format
-    csv_format = detect_csv_format(file_path)
-    print(f"Detected CSV format: {csv_format}")
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._summaries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
     
-    if csv_format == 'simple':
-        # Simple 5-column format (date, description, debit, credit, balance)
-        with open(file_path, 'r', newline='', encoding='utf-8') as csv_file:
-            reader = csv.reader(csv_file)
-            
-            for row in reader:
-                if len(row) < 5 or not row[0].strip():  # Skip empty rows
-                    continue
-                
-                # Typical structure: date, description, debit, credit, balance
-                try:
-                    date_str = row[0].strip()
-                    description = row[1].strip()
-                    
-                    # Handle debit and credit columns - one should be empty
-                    debit_str = row[2].strip()
-                    credit_str = row[3].strip()
-                    balance_str = row[4].strip()
-                    
-                    # Parse date to ISO format
-                    try:
-                        date = datetime.strptime(date_str, '%m/%d/%Y').isoformat()
-                    except ValueError:
-                        date = date_str
-                    
-                    # Parse numeric values, handling empty strings
-                    debit = float(debit_str) if debit_str else 0.0
-                    credit = float(credit_str) if credit_str else 0.0
-                    balance = float(balance_str) if balance_str else 0.0
-                    
-                    # Create transaction object
-                    transaction = {
-                        "date": date,
-                        "description": description,
-                        "debit": debit,
-                        "credit": credit,
-                        "balance": balance
-                    }
-                    
-                    transactions.append(transaction)
-                except Exception as e:
-                    print(f"Error parsing row in simple format: {row}. Error: {str(e)}")
-                    continue
-                
-    elif csv_format == 'desjardins':
-        # Desjardins format
-        with open(file_path, 'r', newline='', encoding='utf-8') as csv_file:
-            reader = csv.reader(csv_file, quotechar='"', delimiter=',')
-            
-            for row in reader:
-                if not row or len(row) < 8:  # Skip rows without enough data
-                    continue
-                
-                try:
-                    # Extract fields from row
-                    bank = row[0].strip() if len(row) > 0 else ""
-                    date_str = row[3].strip() if len(row) > 3 else ""
-                    transaction_id = row[4].strip() if len(row) > 4 else ""
-                    description = row[5].strip() if len(row) > 5 else ""
-                    
-                    # Skip header or empty rows
-                    if not date_str or date_str == "PCA" or bank == "":
-                        continue
-                    
-                    # Get the last column for balance
-                    balance_str = row[-1].strip()
-                    balance = float(balance_str) if balance_str else 0.0
-                    
-                    # Find debit and credit amounts
-                    debit = 0.0
-                    credit = 0.0
-                    
-                    # In Desjardins format, the debit is usually column 7 and credit is column 8
-                    # But we need to check which one has a value
-                    if len(row) > 7 and row[7].strip():
-                        debit_str = row[7].strip()
-                        debit = float(debit_str) if debit_str else 0.0
-                    
-                    if len(row) > 8 and row[8].strip():
-                        credit_str = row[8].strip()
-                        credit = float(credit_str) if credit_str else 0.0
-                    
-                    # Parse date 
-                    try:
-                        if '/' in date_str:
-                            date = datetime.strptime(date_str, '%Y/%m/%d').isoformat()
-                        else:
-                            date = date_str
-                    except ValueError:
-                        date = date_str
-                    
-                    # Create transaction object
-                    transaction = {
-                        "date": date,
-                        "description": description,
-                        "debit": debit,
-                        "credit": credit,
-                        "balance": balance,
-                        "bank": bank,
-                        "transaction_id": transaction_id
-                    }
-                    
-                    transactions.append(transaction)
-                except Exception as e:
-                    print(f"Error parsing row in Desjardins format: {row}. Error: {str(e)}")
-                    continue
+    def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            summary = self._summaries.get(content_hash)
+            if summary is None:
+                self.misses += 1
+                return None
+            self._summaries.move_to_end(content_hash)
+            self.hits += 1
+            return summary
     
-    # Add debug output
-    print(f"Parsed {len(transactions)} transactions")
+    def put(self, content_hash: str, summary: Dict[str, Any]) -> None:
+        with self._lock:
+            self._summaries[content_hash] = summary
+            self._summaries.move_to_end(content_hash)
+            while len(self._summaries) > self.max_size:
+                self._summaries.popitem(last=False)
     
-    return transactions, csv_format
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._summaries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
 
 
-def create_transaction_summary(transactions: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Create a summary of the transaction data."""
-    if not transactions:
-        return {}
+summary_cache = SummaryCache(SUMMARY_CACHE_SIZE)
+# Session prompt prefixes (see build_prompt_prefix), keyed by content hash and token budget
+prompt_prefix_cache = SummaryCache(SUMMARY_CACHE_SIZE)
+
+
+# Answer cache
+"""
+Answers to /analyze are cached by (session content hash, normalized query, model) so the canned
+/query-suggestions prompts asked again against unchanged data skip the graph and the LLM call.
+LLM answers depend on the conversation they follow, so they are only cached for, and only
+served to, the first question of a conversation. Local answers do not depend on it and are
+cached and served in any conversation.
+"""
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for cache lookups: case, unicode forms, whitespace and end punctuation."""
+    text = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(text.split()).strip(" ?!.")
+
+
+class AnswerCache:
+    """Least-recently-used answer cache with a per-entry time to live."""
     
-    # Basic stats
-    total_transactions = len(transactions)
-    total_credits = sum(t["credit"] for t in transactions)
-    total_debits = sum(t["debit"] for t in transactions)
-    net_change = total_credits - total_debits
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._answers: "OrderedDict[Tuple[str, str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
     
-    # First and last transaction dates
-    start_date = transactions[0]["date"]
-    end_date = transactions[-1]["date"]
+    @staticmethod
+    def key(content_hash: str, query: str, model: str) -> Tuple[str, str, str]:
+        return (content_hash, normalize_query(query), model)
     
-    # Monthly breakdown
-    monthly_data = defaultdict(lambda: {"credits": 0, "debits": 0, "count": 0})
+    def get(self, key: Tuple[str, str, str], follow_up: bool = False) -> Optional[Dict[str, Any]]:
+        """Return a cached answer; a follow-up question only gets answers computed locally."""
+        with self._lock:
+            entry = self._answers.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._answers[key]
+                self.expired += 1
+                entry = None
+            if entry is None or (follow_up and not entry[1]["answered_locally"]):
+                self.misses += 1
+                return None
+            self._answers.move_to_end(key)
+            self.hits += 1
+            return entry[1]
     
-    for t in transactions:
-        date_string = t["date"]
-        month = None
-        
-        # Try to extract month from ISO format date
-        if isinstance(date_string, str) and "T" in date_string:
-            month = date_string[:7]  # Extract YYYY-MM from ISO format
-        
-        # If we couldn't extract month in standard way, try alternative formats
-        if not month:
-            try:
-                if isinstance(date_string, str) and "/" in date_string:
-                    # Try parsing as YYYY/MM/DD
-                    parts = date_string.split('/')
-                    if len(parts) == 3:
-                        month = f"{parts[0]}-{parts[1]}"
-            except:
-                pass
-        
-        # If we have a month, add to the summary
-        if month:
-            monthly_data[month]["credits"] += t["credit"]
-            monthly_data[month]["debits"] += t["debit"]
-            monthly_data[month]["count"] += 1
-    
-    # Convert to regular dict
-    monthly_summary = {
-        month: {
-            "credits": data["credits"],
-            "debits": data["debits"],
-            "net": data["credits"] - data["debits"],
-            "count": data["count"]
-        }
-        for month, data in sorted(monthly_data.items())
-    }
+    def put(self, key: Tuple[str, str, str], answer: Dict[str, Any], follow_up: bool = False) -> None:
+        """Cache an answer, unless it came from the LLM in reply to a follow-up question."""
+        if follow_up and not answer["answered_locally"]:
+            return
+        with self._lock:
+            self._answers[key] = (time.monotonic() + self.ttl, answer)
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.max_size:
+                self._answers.popitem(last=False)
+                self.evicted += 1
     
-    # Most common descriptions
-    description_counter = defaultdict(int)
-    for t in transactions:
-        description_counter[t["description"]] += 1
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._answers),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evicted": self.evicted,
+                "expired": self.expired,
+            }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+
+
+# LLM client pooling
+"""
+ChatOpenAI clients own an HTTP connection pool, so they are created once per (API key, model)
+and reused across requests to keep connections to the model endpoint alive.
+"""
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-4-turbo")
+LLM_CLIENT_POOL_SIZE = int(os.environ.get("LLM_CLIENT_POOL_SIZE", "8"))
+
+
+class LLMClientPool:
+    """Least-recently-used pool of ChatOpenAI clients keyed by (API key, model)."""
     
-    common_descriptions = [
-        {"description": desc, "count": count}
-        for desc, count in sorted(description_counter.items(), key=lambda x: x[1], reverse=True)[:10]
-    ]
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._clients: "OrderedDict[Tuple[str, str], ChatOpenAI]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
     
-    # Largest transactions
-    largest_credits = sorted(transactions, key=lambda x: x["credit"], reverse=True)[:5]
-    largest_debits = sorted(transactions, key=lambda x: x["debit"], reverse=True)[:5]
+    def get(self, api_key: str, model: str) -> ChatOpenAI:
+        """Return the client for this key and model, creating it on first use."""
+        key = (api_key, model)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.reused += 1
+                return client
+            
+            client = ChatOpenAI(model=model, temperature=0, api_key=api_key)
+            self._clients[key] = client
+            self.created += 1
+            if len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evicted += 1
+            return client
     
-    return {
-        "total_transactions": total_transactions,
-        "total_credits": total_credits,
-        "total_debits": total_debits,
-        "net_change": net_change,
-        "date_range": {
-            "start": start_date,
-            "end": end_date
-        },
-        "monthly_summary": monthly_summary,
-        "common_descriptions": common_descriptions,
-        "largest_credits": largest_credits,
-        "largest_debits": largest_debits
-    }
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pool_size": len(self._clients),
+                "max_size": self.max_size,
+                "created": self.created,
+                "reused": self.reused,
+                "evicted": self.evicted,
+            }
+
+
+llm_clients = LLMClientPool(LLM_CLIENT_POOL_SIZE)
 
 
 # Node functions for LangGraph
@@ -414,38 +3743,147 @@ def process_csv(state: GraphState) -> GraphState:
     """
     Process the CSV data into transactions and summary.
     This assumes transactions are already loaded in the state.
+    
+    A summary passed in by the session is reused as long as it was computed at the store's
+    current version; otherwise the summary cache is checked before recomputing.
     """
+    transactions = state["transactions"]
+    if state["transaction_summary"] and state["summary_version"] == transactions.version:
+        return state
+    
     # Create summary of transactions
-    summary = create_transaction_summary(state["transactions"])
+    summary = summary_cache.get(transactions.content_hash)
+    if summary is None:
+        with StageTimer("summarize", len(transactions)):
+            summary = create_transaction_summary(transactions)
+        summary_cache.put(transactions.content_hash, summary)
     
     return {
         **state,
-        "transaction_summary": summary
+        "transaction_summary": summary,
+        "summary_version": transactions.version
     }
 
 
-def analyze_with_llm(state: GraphState) -> GraphState:
+def route(state: GraphState) -> GraphState:
     """
-    Send transactions to LLM and get analysis based on the query.
+    Decide whether the question can be answered exactly from the data. An explicit structured
+    query always runs locally; otherwise the query text is matched against known aggregations.
+    """
+    local_query = state["local_query"]
+    if local_query is None and state.get("transactions"):
+        local_query = route_query(state["query"])
+    
+    route_taken = "local" if local_query is not None else "llm"
+    query_router_stats.record(route_taken)
+    return {**state, "local_query": local_query, "route": route_taken}
+
+
+def answer_locally(state: GraphState) -> GraphState:
+    """Answer a structured query from the store without calling the LLM."""
+    with StageTimer("local_answer"):
+        response = execute_local_query(state["transactions"], state["transaction_summary"], state["local_query"], state["query"])
+    return {**state, "response": response}
+
+
+def build_context(state: GraphState) -> GraphState:
+    """
+    Select the data the LLM needs for this query and encode it under the token budget.
     """
     if not state.get("transactions"):
-        return {**state, "response": "No transactions to analyze."}
+        return {**state, "context": "", "query_context": "", "context_tokens": 0, "tokens_saved": 0}
     
-    # Initialize the LLM
-    llm = ChatOpenAI(
-        model="gpt-4-turbo",
-        temperature=0
+    store = state["transactions"]
+    summary = state["transaction_summary"]
+    chunks: List[AnalysisContext] = []
+    with StageTimer("prompt_build"):
+        indexes = select_context_rows(store, state["query"])
+        estimated_tokens = estimate_table_tokens(store, indexes)
+        if (MAP_REDUCE_TOKEN_THRESHOLD and MAP_REDUCE_MAX_CHUNKS > 1 and len(indexes) >= MAP_REDUCE_MIN_ROWS
+                and estimated_tokens > MAP_REDUCE_TOKEN_THRESHOLD):
+            # Too many relevant rows for one prompt: the parts go to map_chunks and only the
+            # summary to the reducing call
+            chunks = build_chunk_contexts(store, indexes, estimated_tokens)
+            prefix = session_prompt_prefix(store, summary, insights=state["insights"])
+            context = AnalysisContext(
+                prefix.text,
+                prefix.tokens + sum(chunk.tokens for chunk in chunks),
+                sum(chunk.selected_rows for chunk in chunks),
+                len(indexes)
+            )
+        else:
+            context = build_analysis_context(store, summary, state["query"], indexes=indexes, insights=state["insights"])
+        legacy_tokens = estimate_legacy_prompt_tokens(store, summary)
+        history = compact_history(state["history"])
+    tokens_saved = max(legacy_tokens - context.tokens, 0)
+    context_tokens_histogram.observe(context.tokens)
+    log_event(
+        "context_built",
+        logging.DEBUG,
+        selected_rows=context.selected_rows,
+        matching_rows=context.matching_rows,
+        tokens=context.tokens,
+        tokens_saved=tokens_saved,
+        chunks=len(chunks)
     )
     
-    # Convert data to JSON strings
-    transactions_json = json.dumps(state["transactions"], indent=2)
-    summary_json = json.dumps(state["transaction_summary"], indent=2)
+    return {
+        **state,
+        "context": context.text,
+        "query_context": context.query_text,
+        "history": history,
+        "context_tokens": context.tokens,
+        "tokens_saved": tokens_saved,
+        "chunks": [chunk.text for chunk in chunks]
+    }
+
+
+async def invoke_llm(messages: List[Any], phase: str) -> Any:
+    """Call the pooled model for the current API key, recording latency and token usage."""
+    llm = llm_clients.get(os.environ.get("OPENAI_API_KEY", ""), LLM_MODEL)
+    started = time.perf_counter()
+    try:
+        response = await llm.ainvoke(messages)
+    except Exception:
+        llm_request_seconds.observe(time.perf_counter() - started, LLM_MODEL, "error")
+        raise
+    seconds = time.perf_counter() - started
+    llm_request_seconds.observe(seconds, LLM_MODEL, "ok")
+    
+    usage = getattr(response, "usage_metadata", None) or {}
+    for kind in ("input_tokens", "output_tokens"):
+        if usage.get(kind):
+            llm_tokens.inc(usage[kind], LLM_MODEL, kind.split("_")[0])
+    # Prompt tokens the provider served from its prompt cache
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read")
+    if cached_tokens:
+        llm_tokens.inc(cached_tokens, LLM_MODEL, "cached_input")
+    log_event(
+        "llm_answered",
+        model=LLM_MODEL,
+        phase=phase,
+        seconds=round(seconds, 3),
+        input_tokens=usage.get("input_tokens"),
+        cached_input_tokens=cached_tokens or 0,
+        output_tokens=usage.get("output_tokens")
+    )
+    return response
+
+
+async def analyze_with_llm(state: GraphState) -> GraphState:
+    """
+    Send transactions to LLM and get analysis based on the query.
+    """
+    if not state.get("transactions"):
+        return {**state, "response": "No transactions to analyze."}
     
     # Create a prompt for the LLM
     system_prompt = """
     You are a financial analyst assistant. You will be given:
-    1. A full list of banking transactions in JSON format
-    2. A pre-computed summary of those transactions
+    1. A pre-computed summary of the user's banking transactions
+    2. Pre-computed insights: unusual amounts, recurring payments and possible duplicate charges
+    3. All of the transactions when they fit, otherwise the ones relevant to each query, given with it
+    4. The conversation so far, if any, followed by the user's query
     
     The transaction data includes dates, descriptions, debits (money out), credits (money in), and account balances.
     
@@ -453,61 +3891,139 @@ def analyze_with_llm(state: GraphState) -> GraphState:
     Be thorough but concise in your analysis, focusing on what the user is asking about.
     Use bullet points, tables, or other formatting to make your response clear and readable.
     
-    Each transaction has this structure:
-    {
-      "date": "YYYY-MM-DDTHH:MM:SS", 
-      "description": "Transaction description",
-      "debit": amount_out (number),
-      "credit": amount_in (number),
-      "balance": account_balance (number)
-    }
+    Data is given as pipe-separated tables with a header line, for example:
+    date|description|debit|credit|balance
+    2024-01-31|Payroll deposit||2500.00|3120.45
+    
+    An empty debit or credit cell means 0. When only part of the transactions is listed,
+    rely on the summary for totals and say so if the answer depends on rows you cannot see.
     
     The summary provides aggregated information about the transactions to help you
-    understand the big picture without having to compute it yourself.
+    understand the big picture without having to compute it yourself. Unusual amounts are
+    scored against earlier transactions with the same description; prefer the insights over
+    scanning the rows when asked about unusual, recurring or duplicate transactions.
     
     Format your response in Markdown for better readability.
     """
     
-    human_prompt = f"""
-    Here is the user's query:
-    {state["query"]}
+    data_prompt = f"""
+    Here is the transaction data:
+    {state["context"]}
+    """
     
-    Here is a summary of the transaction data:
-    ```json
-    {summary_json}
-    ```
+    query_prompt = f"""
+    {state["query_context"]}
     
-    And here is the complete transaction data:
-    ```json
-    {transactions_json}
-    ```
+    Here is the user's query:
+    {state["query"]}
     
     Please analyze this data to answer the user's query.
     """
     
-    # Get response from LLM
+    # Get response from LLM; everything before the history is identical for every query on
+    # the same data, so the provider can serve it from its prompt cache
     messages = [
         SystemMessage(content=system_prompt),
-        HumanMessage(content=human_prompt)
+        HumanMessage(content=data_prompt),
+        *history_messages(state["history"]),
+        HumanMessage(content=query_prompt)
     ]
     
-    response = llm.invoke(messages)
+    response = await invoke_llm(messages, "single")
+    return {**state, "response": response.content}
+
+
+MAP_SYSTEM_PROMPT = """
+You are a financial analyst assistant helping to answer a question about a large set of banking
+transactions. You are given one part of the transactions, covering a period of time, as a
+pipe-separated table (date|description|debit|credit|balance; an empty debit or credit cell means 0).
+
+Extract everything in this part that is relevant to the user's query: totals, notable or unusual
+transactions, recurring payments and trends, with dates and amounts. Your notes will be combined
+with the notes for the other parts by another analyst, so be factual and concise, do not address
+the user, and say so briefly if nothing in this part is relevant.
+"""
+
+REDUCE_SYSTEM_PROMPT = """
+You are a financial analyst assistant. The user's transactions were too many to review at once,
+so they were split into parts by period and each part was analyzed separately. You will be given
+a pre-computed summary of all the transactions, the conversation so far if any, and the notes
+written for each part.
+
+Combine them into one answer to the user's query. Rely on the summary for overall totals, and on
+the notes for details. Use bullet points, tables, or other formatting to make your response clear
+and readable, and format your response in Markdown.
+"""
+
+
+async def map_chunks(state: GraphState) -> GraphState:
+    """Analyze each part of the relevant rows with its own LLM call, a bounded number at a time."""
+    semaphore = asyncio.Semaphore(MAP_REDUCE_CONCURRENCY)
+    
+    async def analyze_chunk(chunk: str) -> str:
+        async with semaphore:
+            response = await invoke_llm([
+                SystemMessage(content=MAP_SYSTEM_PROMPT),
+                HumanMessage(content=f"{chunk}\n\nUser's query:\n{state['query']}")
+            ], "map")
+        return response.content
     
+    partial_answers = await asyncio.gather(*(analyze_chunk(chunk) for chunk in state["chunks"]))
+    return {**state, "partial_answers": list(partial_answers)}
+
+
+async def reduce_answers(state: GraphState) -> GraphState:
+    """Combine the partial answers and the summary into the final answer."""
+    notes = "\n\n".join(
+        f"Notes for part {number} of {len(state['partial_answers'])}:\n{answer}"
+        for number, answer in enumerate(state["partial_answers"], 1)
+    )
+    response = await invoke_llm([
+        SystemMessage(content=REDUCE_SYSTEM_PROMPT),
+        HumanMessage(content=state["context"]),
+        *history_messages(state["history"]),
+        HumanMessage(content=f"{notes}\n\nUser's query:\n{state['query']}")
+    ], "reduce")
     return {**state, "response": response.content}
 
 
+def offload(node):
+    """Wrap a synchronous, CPU-bound graph node so it runs on the CPU pool."""
+    async def run(state: GraphState) -> GraphState:
+        return await run_cpu_bound(node, state)
+    run.__name__ = node.__name__
+    return run
+
+
 # Create the LangGraph
 def create_analysis_graph():
     """Create and return the LangGraph for transaction analysis."""
     graph = StateGraph(GraphState)
     
-    # Add nodes
-    graph.add_node("process_csv", process_csv)
+    # Add nodes; CPU-bound nodes run on the CPU pool so the event loop stays free
+    graph.add_node("process_csv", offload(process_csv))
+    graph.add_node("route", offload(route))
+    graph.add_node("answer_locally", offload(answer_locally))
+    graph.add_node("build_context", offload(build_context))
     graph.add_node("analyze", analyze_with_llm)
+    graph.add_node("map_chunks", map_chunks)
+    graph.add_node("reduce", reduce_answers)
     
-    # Add edges
-    graph.add_edge("process_csv", "analyze")
+    # Add edges; aggregations are answered locally, everything else goes to the LLM
+    graph.add_edge("process_csv", "route")
+    graph.add_conditional_edges("route", lambda state: state["route"], {
+        "local": "answer_locally",
+        "llm": "build_context"
+    })
+    graph.add_edge("answer_locally", END)
+    # Rows that do not fit one prompt are analyzed in parts, then combined
+    graph.add_conditional_edges("build_context", lambda state: "map_reduce" if state["chunks"] else "single", {
+        "single": "analyze",
+        "map_reduce": "map_chunks"
+    })
     graph.add_edge("analyze", END)
+    graph.add_edge("map_chunks", "reduce")
+    graph.add_edge("reduce", END)
     
     # Set entry point
     graph.set_entry_point("process_csv")
@@ -516,21 +4032,127 @@ def create_analysis_graph():
     return graph.compile()
 
 
+# The compiled graph is stateless, so it is built once and shared by every request
+analysis_graph = None
+
+
+def get_analysis_graph():
+    """Return the compiled analysis graph, compiling it on first use."""
+    global analysis_graph
+    if analysis_graph is None:
+        with StageTimer("graph_compile"):
+            analysis_graph = create_analysis_graph()
+    return analysis_graph
+
+
 # Run the analysis graph with a query
-def run_transaction_analysis(transactions: List[Dict[str, Any]], query: str) -> str:
-    """Run the transaction analysis with the given data and query."""
-    graph = create_analysis_graph()
+async def run_transaction_analysis(transactions: TransactionStore, query: str,
+                                   transaction_summary: Optional[Dict[str, Any]] = None,
+                                   summary_version: int = -1,
+                                   structured: Optional[StructuredQuery] = None,
+                                   history: Optional[List[Dict[str, str]]] = None,
+                                   insights: Optional[Dict[str, Any]] = None) -> GraphState:
+    """
+    Run the transaction analysis with the given data and query and return the final state.
+    
+    Pass the session's precomputed summary and the store version it was computed at to skip
+    summarizing again inside the graph, a structured query to skip the LLM, the earlier
+    messages of the conversation to continue it, and the session's insights to include them
+    in the prompt.
+    """
+    graph = get_analysis_graph()
+    initial_state = make_initial_state(transactions, query, transaction_summary, summary_version, structured, history, insights)
+    
+    return await graph.ainvoke(initial_state)
+
+
+async def stream_transaction_analysis(transactions: TransactionStore, query: str,
+                                      transaction_summary: Optional[Dict[str, Any]] = None,
+                                      summary_version: int = -1,
+                                      structured: Optional[StructuredQuery] = None,
+                                      history: Optional[List[Dict[str, str]]] = None,
+                                      insights: Optional[Dict[str, Any]] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Run the transaction analysis and yield ("token", text) for each piece of the answer as the
+    analyze or reduce node receives it from the model, then ("final", state) once the graph finishes.
+    Answers computed locally are yielded as a single token.
+    """
+    graph = get_analysis_graph()
+    initial_state = make_initial_state(transactions, query, transaction_summary, summary_version, structured, history, insights)
     
-    initial_state: GraphState = {
+    final_state = initial_state
+    streamed = False
+    async for mode, chunk in graph.astream(initial_state, stream_mode=["messages", "values"]):
+        if mode == "values":
+            final_state = chunk
+            continue
+        message, metadata = chunk
+        if metadata.get("langgraph_node") in ("analyze", "reduce") and message.content:
+            streamed = True
+            yield "token", message.content
+    
+    if not streamed and final_state["response"]:
+        yield "token", final_state["response"]
+    yield "final", final_state
+
+
+def make_initial_state(transactions: TransactionStore, query: str,
+                       transaction_summary: Optional[Dict[str, Any]] = None,
+                       summary_version: int = -1,
+                       structured: Optional[StructuredQuery] = None,
+                       history: Optional[List[Dict[str, str]]] = None,
+                       insights: Optional[Dict[str, Any]] = None) -> GraphState:
+    """Build the graph input for a query over a session's transactions."""
+    return {
         "transactions": transactions,
-        "transaction_summary": {},
+        "transaction_summary": transaction_summary or {},
+        "summary_version": summary_version,
+        "insights": insights or {},
         "query": query,
+        "context": "",
+        "query_context": "",
+        "history": history or [],
+        "context_tokens": 0,
+        "tokens_saved": 0,
+        "local_query": structured.model_dump() if structured is not None else None,
+        "route": "",
+        "chunks": [],
+        "partial_answers": [],
         "response": ""
     }
-    
-    final_state = graph.invoke(initial_state)
-    
-    return final_state["response"]
+
+
+def validate_transaction_query(query: TransactionQuery) -> None:
+    """Reject queries with neither text nor a valid structured query."""
+    if query.structured is not None:
+        if query.structured.op not in LOCAL_QUERY_OPS:
+            raise HTTPException(status_code=400, detail=f"Unknown structured query op '{query.structured.op}', expected one of {', '.join(LOCAL_QUERY_OPS)}")
+        if query.structured.order not in (None, "asc", "desc"):
+            raise HTTPException(status_code=400, detail=f"Unknown structured query order '{query.structured.order}', expected 'asc' or 'desc'")
+    elif not query.query.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+
+
+def query_cache_text(query: TransactionQuery) -> str:
+    """Text identifying a query in the answer cache, including any structured spec."""
+    if query.structured is not None:
+        return f"{query.query} {query.structured.model_dump_json()}"
+    return query.query
+
+
+def conversation_history(session: Session) -> List[Dict[str, str]]:
+    """The session's messages as {"role", "content"} dictionaries, oldest first."""
+    return [{"role": message.role, "content": message.content} for message in session.messages]
+
+
+def analysis_answer(final_state: GraphState) -> Dict[str, Any]:
+    """The fields of TransactionResponse produced by a graph run, as stored in the answer cache."""
+    return {
+        "response": final_state["response"],
+        "context_tokens": final_state["context_tokens"],
+        "tokens_saved": final_state["tokens_saved"],
+        "answered_locally": final_state["route"] == "local"
+    }
 
 
 # API endpoints
@@ -551,12 +4173,48 @@ async def set_api_key(api_key: str = Form(...)):
     try:
         # In production, you should validate and store this more securely
         os.environ["OPENAI_API_KEY"] = api_key
-        print(f"API key set: {api_key[:5]}...")
+        log_event("api_key_set", key_prefix=api_key[:5])
         return {"status": "success", "message": "API key updated successfully"}
     except Exception as e:
-        print(f"Error setting API key: {str(e)}")
+        log_event("api_key_set_failed", logging.ERROR, error=str(e))
         raise HTTPException(status_code=500, detail=f"Error setting API key: {str(e)}")
 
+async def load_session(session_id: str) -> Session:
+    """Fetch a session from the session store, or fail with a 404."""
+    session = await run_cpu_bound(sessions.get, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+
+@contextlib.asynccontextmanager
+async def locked_session(session_id: str) -> AsyncIterator[Session]:
+    """Hold the session's lock and yield its latest stored state, to change and save it."""
+    async with sessions.lock(session_id):
+        yield await load_session(session_id)
+
+
+class SessionSnapshot(NamedTuple):
+    transactions: TransactionStore
+    transaction_summary: Optional[Dict[str, Any]]
+    summary_version: int
+    insights: Dict[str, Any]
+    history: List[Dict[str, str]]
+
+
+async def snapshot_session(session_id: str) -> SessionSnapshot:
+    """
+    Take the session's rows, summary, insights and conversation under its lock, so an append
+    in progress is either entirely visible or not at all, and later appends leave them unchanged.
+    """
+    async with locked_session(session_id) as session:
+        insights = await run_cpu_bound(session_insights, session)
+        return SessionSnapshot(
+            session.transactions.snapshot(), session.transaction_summary, session.summary_version, insights,
+            conversation_history(session)
+        )
+
+
 @app.post("/upload", response_model=UploadResponse)
 async def upload_csv(file: UploadFile = File(...)):
     """Upload a CSV file and create a new analysis session."""
@@ -568,34 +4226,28 @@ async def upload_csv(file: UploadFile = File(...)):
     session_path = os.path.join(SESSION_DIR, f"{session_id}")
     os.makedirs(session_path, exist_ok=True)
     
-    # Save the uploaded file
-    file_path = os.path.join(session_path, "transactions.csv")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Parse the CSV file
+    # Parse the upload while it streams to disk
     try:
-        transactions, csv_format = parse_csv_file(file_path)
+        transactions, transaction_summary, csv_format, summary_builder, insights, insight_detector = await run_cpu_bound(ingest_csv_upload, file.file, session_path)
+        file_path = os.path.join(session_path, "transactions.csv")
         
         if not transactions:
             raise ValueError("No valid transactions found in the CSV file.")
         
-        # Create transaction summary
-        transaction_summary = create_transaction_summary(transactions)
-        
-        # Save transactions to JSON
-        json_path = os.path.join(session_path, "transactions.json")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(transactions, f, indent=2)
-        
         # Save session
-        active_sessions[session_id] = Session(
+        session = Session(
             session_id=session_id,
             file_path=file_path,
             transactions=transactions,
             transaction_summary=transaction_summary,
-            csv_format=csv_format
+            csv_format=csv_format,
+            summary_version=transactions.version,
+            summary_builder=summary_builder,
+            insights=insights,
+            insights_version=transactions.version,
+            insight_detector=insight_detector
         )
+        await run_cpu_bound(sessions.save, session)
         
         return UploadResponse(
             session_id=session_id,
@@ -606,26 +4258,181 @@ async def upload_csv(file: UploadFile = File(...)):
     
     except Exception as e:
         # Clean up in case of failure
-        shutil.rmtree(session_path, ignore_errors=True)
+        await run_cpu_bound(shutil.rmtree, session_path, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+
+
+@app.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_csv_batch(files: List[UploadFile] = File(...)):
+    """Upload several CSV files, in any supported format, as one merged analysis session."""
+    if len(files) > BATCH_UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_UPLOAD_MAX_FILES} files can be uploaded at once")
+    if any(not file.filename.endswith('.csv') for file in files):
+        raise HTTPException(status_code=400, detail="File must be a CSV")
+    
+    session_id = str(uuid.uuid4())
+    session_path = os.path.join(SESSION_DIR, f"{session_id}")
+    sources_path = os.path.join(session_path, BATCH_SOURCES_DIR)
+    os.makedirs(sources_path, exist_ok=True)
+    
+    try:
+        filenames = [os.path.basename(file.filename) for file in files]
+        paths = [os.path.join(sources_path, f"{index}-{filename}") for index, filename in enumerate(filenames)]
+        for file, path in zip(files, paths):
+            await run_cpu_bound(save_batch_source, file.file, path)
+        
+        parsed = await asyncio.gather(*(run_in_parse_pool(parse_csv_file, path) for path in paths))
+        transactions, transaction_summary, csv_format, summary_builder, insights, insight_detector = await run_cpu_bound(merge_batch_upload, parsed, filenames, session_path)
+        
+        if not transactions:
+            raise ValueError("No valid transactions found in the CSV files.")
+        
+        session = Session(
+            session_id=session_id,
+            file_path=sources_path,
+            transactions=transactions,
+            transaction_summary=transaction_summary,
+            csv_format=csv_format,
+            summary_version=transactions.version,
+            summary_builder=summary_builder,
+            insights=insights,
+            insights_version=transactions.version,
+            insight_detector=insight_detector
+        )
+        await run_cpu_bound(sessions.save, session)
+        
+        return BatchUploadResponse(
+            session_id=session_id,
+            message=f"{len(files)} files uploaded and merged successfully (Format: {csv_format})",
+            transaction_count=len(transactions),
+            csv_format=csv_format,
+            files=[
+                BatchFileResult(filename=filename, csv_format=file_format, transaction_count=len(store))
+                for filename, (store, file_format) in zip(filenames, parsed)
+            ]
+        )
+    
+    except Exception as e:
+        # Clean up in case of failure
+        await run_cpu_bound(shutil.rmtree, session_path, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+
+
+@app.post("/sessions/{session_id}/append", response_model=AppendResponse)
+async def append_csv(session_id: str, file: UploadFile = File(...)):
+    """Merge another CSV statement into an existing session, skipping rows it already has."""
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="File must be a CSV")
+    
+    await load_session(session_id)
+    session_path = os.path.join(SESSION_DIR, f"{session_id}")
+    
+    try:
+        # Concurrent appends to one session, in this worker or another, would interleave their
+        # updates of the store, the duplicate index and the summary builder
+        async with locked_session(session_id) as session:
+            added_count, duplicate_count, csv_format = await run_cpu_bound(append_csv_upload, file.file, session, session_path)
+            await run_cpu_bound(sessions.save, session)
+            transaction_count = len(session.transactions)
+        
+        return AppendResponse(
+            session_id=session_id,
+            message=f"Added {added_count} transactions, skipped {duplicate_count} duplicates (Format: {csv_format})",
+            transaction_count=transaction_count,
+            added_count=added_count,
+            duplicate_count=duplicate_count,
+            csv_format=csv_format
+        )
+    
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
 
 @app.get("/transactions/{session_id}", response_model=List[Dict[str, Any]])
-async def get_transactions(session_id: str):
-    """Get all transactions for a session."""
-    if session_id not in active_sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+async def get_transactions(
+    session_id: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    kind: Optional[str] = None,
+    search: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = "json"
+):
+    """
+    Get the transactions of a session, optionally filtered, paginated and projected.
     
-    return active_sessions[session_id].transactions
+    Dates are YYYY-MM-DD (inclusive), amounts compare against the debit or credit of a row,
+    `search` is a case-insensitive description substring and `fields` a comma-separated list
+    of columns. Without `limit` every matching row is returned. The number of matching rows is
+    sent in X-Total-Count and the cursor of the next page in X-Next-Cursor. `format=ndjson`
+    streams one transaction per line.
+    """
+    if format not in TRANSACTION_LISTING_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(TRANSACTION_LISTING_FORMATS)}")
+    projection = None
+    if fields:
+        projection = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in projection if field not in TRANSACTION_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields {', '.join(unknown)}, expected some of {', '.join(TRANSACTION_FIELDS)}")
+    
+    session = await load_session(session_id)
+    store = session.transactions
+    mask = await run_cpu_bound(transaction_filter_mask, store, start_date, end_date, min_amount, max_amount, kind, search)
+    listing = paginate_transactions(store, mask, offset, limit, cursor)
+    
+    headers = {"X-Total-Count": str(listing.total)}
+    if listing.next_cursor is not None:
+        headers["X-Next-Cursor"] = listing.next_cursor
+    return StreamingResponse(
+        encode_transactions(store, listing.indexes, projection, format),
+        media_type="application/x-ndjson" if format == "ndjson" else "application/json",
+        headers=headers
+    )
 
 
 @app.get("/summary/{session_id}", response_model=Dict[str, Any])
-async def get_summary(session_id: str):
-    """Get the summary for a session."""
-    if session_id not in active_sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+async def get_summary(
+    session_id: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    granularity: Optional[str] = None
+):
+    """
+    Get the summary for a session.
+    
+    With `start_date`/`end_date` (YYYY-MM-DD, inclusive) or `granularity` (day, week, month,
+    quarter or year), returns the credits, debits, net and count of the rows in that range
+    instead, broken down by period when a granularity is given. Weeks start on Monday.
+    """
+    if granularity is not None and granularity not in TIME_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(TIME_GRANULARITIES)}")
+    start_day = parse_listing_date(start_date, "start_date") if start_date else None
+    end_day = parse_listing_date(end_date, "end_date") if end_date else None
+    if start_day is not None and end_day is not None and start_day > end_day:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
     
-    return active_sessions[session_id].transaction_summary
+    session = await load_session(session_id)
+    if start_day is None and end_day is None and granularity is None:
+        return session.transaction_summary
+    index = await run_cpu_bound(session_time_index, session)
+    return index.summarize(start_day, end_day, granularity)
+
+
+@app.get("/insights/{session_id}", response_model=Dict[str, Any])
+async def get_insights(session_id: str):
+    """
+    Get the transactions flagged at upload: amounts far from the usual amount for their
+    description, recurring payments with their cadence and next expected date, and the same
+    charge repeated within DUPLICATE_WINDOW_DAYS. Each list holds the most significant
+    entries; the counts cover every detection.
+    """
+    return (await snapshot_session(session_id)).insights
 
 
 @app.post("/analyze", response_model=TransactionResponse)
@@ -633,74 +4440,162 @@ async def analyze_transactions(query: TransactionQuery):
     """Analyze transactions based on a user query."""
     session_id = query.session_id
     
-    if session_id not in active_sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+    validate_transaction_query(query)
     
-    # Check if OpenAI API key is set - this is likely the issue
-    if not os.environ.get("OPENAI_API_KEY"):
+    # Check if OpenAI API key is set - this is likely the issue; structured queries never reach the LLM
+    if query.structured is None and not os.environ.get("OPENAI_API_KEY"):
         raise HTTPException(status_code=400, detail="OpenAI API key not set. Please set your API key.")
     
-    session = active_sessions[session_id]
+    snapshot = await snapshot_session(session_id)
+    history = snapshot.history
     
     try:
-        # Store user message
         user_message = Message(
             role="user",
             content=query.query,
             timestamp=datetime.now().isoformat()
         )
-        session.messages.append(user_message)
         
-        # Run the analysis
-        response = run_transaction_analysis(session.transactions, query.query)
+        # Answer from the cache when the same question was asked about the same data
+        cache_key = answer_cache.key(snapshot.transactions.content_hash, query_cache_text(query), LLM_MODEL)
+        cached = answer_cache.get(cache_key, follow_up=bool(history))
+        if cached is None:
+            # Run the analysis
+            final_state = await run_transaction_analysis(
+                snapshot.transactions,
+                query.query,
+                transaction_summary=snapshot.transaction_summary,
+                summary_version=snapshot.summary_version,
+                structured=query.structured,
+                history=history,
+                insights=snapshot.insights
+            )
+            answer = analysis_answer(final_state)
+            answer_cache.put(cache_key, answer, follow_up=bool(history))
+        else:
+            answer = cached
+        response = answer["response"]
         
-        # Store assistant message
         assistant_message = Message(
             role="assistant",
             content=response,
             timestamp=datetime.now().isoformat()
         )
-        session.messages.append(assistant_message)
         
-        # Update session in active_sessions
-        active_sessions[session_id] = session
+        # Add the turn to the latest stored conversation, which other requests may have extended
+        async with locked_session(session_id) as session:
+            session.messages += [user_message, assistant_message]
+            await run_cpu_bound(sessions.save, session)
         
         return TransactionResponse(
             session_id=session_id,
-            response=response
+            cached=cached is not None,
+            **answer
         )
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing transactions: {str(e)}")
 
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Encode one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/analyze/stream")
+async def analyze_transactions_stream(query: TransactionQuery):
+    """
+    Analyze transactions and stream the answer as server-sent events.
+    
+    Emits `token` events ({"content": ...}) as the model produces text, then a single `done`
+    event with the same fields as /analyze, or an `error` event if the analysis fails.
+    """
+    session_id = query.session_id
+    
+    validate_transaction_query(query)
+    
+    if query.structured is None and not os.environ.get("OPENAI_API_KEY"):
+        raise HTTPException(status_code=400, detail="OpenAI API key not set. Please set your API key.")
+    
+    await load_session(session_id)
+    
+    async def event_stream() -> AsyncIterator[str]:
+        snapshot = await snapshot_session(session_id)
+        history = snapshot.history
+        user_message = Message(
+            role="user",
+            content=query.query,
+            timestamp=datetime.now().isoformat()
+        )
+        
+        cache_key = answer_cache.key(snapshot.transactions.content_hash, query_cache_text(query), LLM_MODEL)
+        answer = answer_cache.get(cache_key, follow_up=bool(history))
+        cached = answer is not None
+        
+        if cached:
+            yield format_sse("token", {"content": answer["response"]})
+        else:
+            try:
+                async for kind, payload in stream_transaction_analysis(
+                    snapshot.transactions,
+                    query.query,
+                    transaction_summary=snapshot.transaction_summary,
+                    summary_version=snapshot.summary_version,
+                    structured=query.structured,
+                    history=history,
+                    insights=snapshot.insights
+                ):
+                    if kind == "token":
+                        yield format_sse("token", {"content": payload})
+                    else:
+                        final_state = payload
+            except Exception as e:
+                yield format_sse("error", {"detail": f"Error analyzing transactions: {str(e)}"})
+                return
+            
+            answer = analysis_answer(final_state)
+            answer_cache.put(cache_key, answer, follow_up=bool(history))
+        
+        # Store the turn once the stream has finished
+        assistant_message = Message(
+            role="assistant",
+            content=answer["response"],
+            timestamp=datetime.now().isoformat()
+        )
+        async with locked_session(session_id) as session:
+            session.messages += [user_message, assistant_message]
+            await run_cpu_bound(sessions.save, session)
+        
+        yield format_sse("done", TransactionResponse(session_id=session_id, cached=cached, **answer).model_dump())
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # Add a new endpoint to get conversation history
 @app.get("/messages/{session_id}", response_model=List[Message])
 async def get_messages(session_id: str):
     """Get conversation history for a session."""
-    if session_id not in active_sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    return active_sessions[session_id].messages
+    session = await load_session(session_id)
+    return session.messages
 
 
 @app.get("/sessions", response_model=List[str])
 async def list_sessions():
-    """List all active session IDs."""
-    return list(active_sessions.keys())
+    """List all stored session IDs."""
+    return await run_cpu_bound(sessions.list_ids)
 
 
 @app.delete("/sessions/{session_id}")
-async def delete_session(session_id: str):
+async def delete_session(session_id: str, background_tasks: BackgroundTasks):
     """Delete a session and its files."""
-    if session_id not in active_sessions:
+    # Remove the session from memory, then its files from disk once the response is sent
+    handle = await run_cpu_bound(sessions.delete, session_id)
+    if handle is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Remove session files
-    session_path = os.path.join(SESSION_DIR, f"{session_id}")
-    shutil.rmtree(session_path, ignore_errors=True)
-    
-    # Remove from active sessions
-    del active_sessions[session_id]
+    background_tasks.add_task(run_cpu_bound, sessions.reclaim, handle)
     
     return {"message": f"Session {session_id} deleted successfully"}
 
@@ -717,7 +4612,8 @@ async def get_query_suggestions():
         "What's the monthly breakdown of income and expenses?",
         "Which months had the highest expenses?",
         "What were the largest transactions this year?",
-        "How much did I spend on bank fees?"
+        "How much did I spend on bank fees?",
+        "Which recurring payments should I review?"
     ]
 
 
@@ -725,41 +4621,62 @@ async def get_query_suggestions():
 @app.get("/health")
 async def health_check():
     """Check if the API is healthy."""
+    session_store = sessions.stats()
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "api_version": "1.0.0",
-        "sessions_active": len(active_sessions)
+        "sessions_active": session_store["hot_sessions"],
+        "session_store": session_store,
+        "session_janitor": session_janitor.stats(),
+        "graph_compiled": analysis_graph is not None,
+        "llm_clients": llm_clients.stats(),
+        "summary_cache": summary_cache.stats(),
+        "prompt_prefix_cache": prompt_prefix_cache.stats(),
+        "category_cache": categorize_description.cache_info()._asdict(),
+        "answer_cache": answer_cache.stats(),
+        "query_router": query_router_stats.stats()
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Stage timings, LLM latency and token counts in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 # Endpoint to get CSV format information
 @app.get("/format/{session_id}")
 async def get_csv_format(session_id: str):
     """Get information about the CSV format for a specific session."""
-    if session_id not in active_sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
+    session = await load_session(session_id)
     return {
-        "format": active_sessions[session_id].csv_format,
-        "transaction_count": len(active_sessions[session_id].transactions)
+        "format": session.csv_format,
+        "transaction_count": len(session.transactions)
     }
 
 
 # Startup event to load any existing sessions
 @app.on_event("startup")
 async def startup_event():
-    print("🚀 Transaction Analysis API is starting up!")
-    print("✅ Swagger documentation available at /docs")
-    print("✅ ReDoc documentation available at /redoc")
-    print("✅ Health check endpoint available at /health")
-    print("✅ Hello World endpoint available at /")
+    global janitor_task
+    get_analysis_graph()
+    if SESSION_JANITOR_INTERVAL > 0 and janitor_task is None:
+        janitor_task = asyncio.create_task(session_janitor.run())
+    log_event("startup", docs="/docs", redoc="/redoc", health="/health", metrics="/metrics")
 
 
 # Shutdown event to clean up
 @app.on_event("shutdown")
 async def shutdown_event():
-    print("👋 Transaction Analysis API is shutting down!")
+    global janitor_task, parse_executor
+    log_event("shutdown")
+    if janitor_task is not None:
+        janitor_task.cancel()
+        janitor_task = None
+    if parse_executor is not None:
+        parse_executor.shutdown(wait=False, cancel_futures=True)
+        parse_executor = None
     # Optional: Clean up temporary files or save state
 
 
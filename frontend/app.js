@@ -222,11 +222,10 @@ async function loadSession(sessionId) {
     try {
         // Fetch transactions for this session
 
-        const response = await fetch(`${API_URL}/transactions/${sessionId}`);
-        const transactions = await response.json();
+        const page = await fetchTransactionPage(sessionId);
         
         // Display transactions in the table
-        displayTransactionsTable(transactions, 'transaction-table-container');
+        displayTransactionsTable(page.transactions, 'transaction-table-container', page);
         
         // Fetch conversation history for this session
         const messageHistory = await fetchConversationHistory(sessionId);
@@ -324,6 +323,34 @@ function addMessage(sender, content) {
     document.querySelectorAll('pre code').forEach((block) => {
         hljs.highlightElement(block);
     });
+    
+    return messageDiv;
+}
+
+// Replace the content of an assistant message while its answer is streaming in
+function updateMessage(messageDiv, content, highlight = false) {
+    messageDiv.querySelector('.message-content').innerHTML = marked.parse(content);
+    messages.scrollTop = messages.scrollHeight;
+    
+    if (highlight) {
+        messageDiv.querySelectorAll('pre code').forEach((block) => {
+            hljs.highlightElement(block);
+        });
+    }
+}
+
+// Parse one server-sent event block ("event: ...\ndata: ...")
+function parseServerSentEvent(rawEvent) {
+    let type = 'message';
+    let data = '';
+    rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            type = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            data += line.slice(5).trim();
+        }
+    });
+    return { type, data: data ? JSON.parse(data) : {} };
 }
 
 // Add a loading message
@@ -347,7 +374,7 @@ function addLoadingMessage() {
     return messageDiv;
 }
 
-// Submit a query to the API
+// Submit a query to the API, rendering the answer as it streams in
 async function submitQuery(query) {
     if (!currentSessionId || !query.trim()) return;
     
@@ -358,7 +385,7 @@ async function submitQuery(query) {
     const loadingMessage = addLoadingMessage();
     
     try {
-        const response = await fetch(`${API_URL}/analyze`, {
+        const response = await fetch(`${API_URL}/analyze/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -374,13 +401,50 @@ async function submitQuery(query) {
             throw new Error(errorData.detail || `Server returned ${response.status}`);
         }
         
-        const data = await response.json();
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        let assistantMessage = null;
         
-        // Remove loading message
-        loadingMessage.remove();
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            // Events are separated by a blank line; keep any partial event for the next chunk
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            
+            for (const rawEvent of events) {
+                const event = parseServerSentEvent(rawEvent);
+                
+                if (event.type === 'error') {
+                    throw new Error(event.data.detail);
+                }
+                
+                if (event.type === 'token') {
+                    answer += event.data.content;
+                } else if (event.type === 'done') {
+                    answer = event.data.response;
+                } else {
+                    continue;
+                }
+                
+                // Replace the loading message with the answer on the first token
+                if (!assistantMessage) {
+                    loadingMessage.remove();
+                    assistantMessage = addMessage('assistant', answer);
+                } else {
+                    updateMessage(assistantMessage, answer, event.type === 'done');
+                }
+            }
+        }
         
-        // Add assistant response
-        addMessage('assistant', data.response);
+        if (!assistantMessage) {
+            loadingMessage.remove();
+            addMessage('assistant', answer);
+        }
     } catch (error) {
         console.error('Error analyzing query:', error);
         
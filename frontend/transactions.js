@@ -1,11 +1,52 @@
 // Transaction table functionality
 let transactionData = [];
 let isTableVisible = false; // Track table visibility state
+const TRANSACTION_PAGE_SIZE = 1000;
+let transactionPaging = { sessionId: null, total: 0, nextCursor: null };
+
+// Fetch one page of transactions; the total and the next page cursor come back in headers
+async function fetchTransactionPage(sessionId, cursor = null) {
+    const params = new URLSearchParams({ limit: TRANSACTION_PAGE_SIZE });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    const response = await fetch(`${API_URL}/transactions/${sessionId}?${params}`);
+    const transactions = await response.json();
+    return {
+        sessionId,
+        transactions,
+        total: parseInt(response.headers.get('X-Total-Count') || transactions.length, 10),
+        nextCursor: response.headers.get('X-Next-Cursor')
+    };
+}
+
+// Append the next page to the loaded transactions and refresh the table
+async function loadMoreTransactions() {
+    if (!transactionPaging.nextCursor) return;
+    
+    const page = await fetchTransactionPage(transactionPaging.sessionId, transactionPaging.nextCursor);
+    transactionData = transactionData.concat(page.transactions);
+    transactionPaging = { sessionId: page.sessionId, total: page.total, nextCursor: page.nextCursor };
+    
+    filterTransactions();
+    updateLoadMoreButton();
+}
+
+// Show the load more button only while there are pages left
+function updateLoadMoreButton() {
+    const loadMoreBtn = document.getElementById('load-more-transactions');
+    if (loadMoreBtn) {
+        loadMoreBtn.style.display = transactionPaging.nextCursor ? 'inline-block' : 'none';
+    }
+}
 
 // Create and display the transaction table
-function displayTransactionsTable(transactions, containerId = 'transaction-table-container') {
+function displayTransactionsTable(transactions, containerId = 'transaction-table-container', page = null) {
     // Store the transaction data globally
     transactionData = transactions;
+    transactionPaging = page
+        ? { sessionId: page.sessionId, total: page.total, nextCursor: page.nextCursor }
+        : { sessionId: null, total: transactions.length, nextCursor: null };
     
     const container = document.getElementById(containerId);
     if (!container) {
@@ -127,14 +168,23 @@ function displayTransactionsTable(transactions, containerId = 'transaction-table
     // Add info about transaction count
     const tableInfo = document.createElement('div');
     tableInfo.className = 'table-info';
-    tableInfo.innerHTML = `<span>Showing ${transactions.length} transactions</span>`;
+    tableInfo.innerHTML = `<span>Showing ${transactions.length} of ${transactionPaging.total} transactions</span>`;
     tableWrapper.appendChild(tableInfo);
     
+    // Add a button to fetch the next page
+    const loadMoreBtn = document.createElement('button');
+    loadMoreBtn.id = 'load-more-transactions';
+    loadMoreBtn.className = 'toggle-table-btn';
+    loadMoreBtn.textContent = 'Load more transactions';
+    loadMoreBtn.onclick = loadMoreTransactions;
+    tableWrapper.appendChild(loadMoreBtn);
+    
     // Add the table to the container
     container.appendChild(tableWrapper);
     
     // Set up event listeners for search and sort
     setupTableInteractivity();
+    updateLoadMoreButton();
     
     // Maintain the previous state of visibility
     container.style.display = isTableVisible ? 'block' : 'none';
@@ -269,7 +319,7 @@ function filterTransactions() {
     // Update info about transaction count
     const tableInfo = document.querySelector('.table-info span');
     if (tableInfo) {
-        tableInfo.textContent = `Showing ${filteredData.length} of ${transactionData.length} transactions`;
+        tableInfo.textContent = `Showing ${filteredData.length} of ${transactionPaging.total} transactions`;
     }
 }
 